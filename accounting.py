@@ -0,0 +1,216 @@
+import os
+import math
+import threading
+import time
+import logging
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass
+from models import User
+from precompute import load_records_after_snapshots, cumulative_hours_from
+
+logger = logging.getLogger(__name__)
+
+# 配分比率の基準（累積労働時間 / 対象期間の労働時間）
+WEIGHTINGS = ('cumulative', 'period')
+# 配分額の丸め方（四捨五入 / 切り捨て / 切り捨て後の端数を端数の大きい順に1円ずつ配分して合計を収益に一致させる）
+ROUNDINGS = ('round', 'floor', 'largest_remainder')
+# 1回のリクエストで計算するシナリオ数の上限
+MAX_SCENARIOS = int(os.environ.get('ACCOUNTING_MAX_SCENARIOS', 20))
+
+# テンプレートから data.user.id / data.user.display_name として参照するためのユーザー情報
+VectorUser = namedtuple('VectorUser', ['id', 'display_name'])
+
+@dataclass(frozen=True)
+class HourVector:
+    """対象期間の参加者別労働時間（累積・期間）のベクトル（配分計算の入力）"""
+    team_id: str
+    start_date: str
+    end_date: str
+    version: int
+    users: tuple
+    cumulative_hours: tuple
+    period_hours: tuple
+
+    def to_payload(self):
+        """クライアント側でのシミュレーション用のコンパクトなJSON"""
+        return {
+            'version': self.version,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'users': [[user.id, user.display_name] for user in self.users],
+            'cumulative': list(self.cumulative_hours),
+            'period': list(self.period_hours)
+        }
+
+    def cumulative_work_data(self):
+        """get_cumulative_work_hours と同じ形式の累積労働時間データ"""
+        return [
+            {'user': user, 'cumulative_hours': hours}
+            for user, hours in zip(self.users, self.cumulative_hours)
+        ]
+
+def build_hour_vector(read_db, team_id, version, start_date, end_date, period_range, cumulative_end, calculate_func):
+    """
+    参加者別の累積・期間労働時間を計算
+
+    累積労働時間は事前計算済みの値（precompute_hours_snapshots）にそれ以降の記録を加算するため、
+    出退勤記録の読み込みは対象期間と事前計算の境界以降の1回のスキャンで済む。
+
+    Args:
+        period_range: 対象期間（UTC）の (開始, 終了)
+        cumulative_end: 累積労働時間の集計終了日時（UTC）
+        calculate_func: 出退勤記録のリストから労働時間を計算する関数
+    """
+    period_start, period_end = period_range
+    users = read_db.query(User).filter_by(team_id=team_id).all()
+    snapshots, records_by_user = load_records_after_snapshots(
+        read_db, team_id, [user.id for user in users], cumulative_end, since=period_start
+    )
+
+    # 期間の境界はDBの日時（タイムゾーンなし）と比較する
+    naive_start = period_start.replace(tzinfo=None)
+    naive_end = period_end.replace(tzinfo=None)
+    rows = []
+    for user in users:
+        records = records_by_user.get(user.id, [])
+        cumulative = cumulative_hours_from(snapshots.get(user.id), records)
+        period_records = [r for r in records if naive_start <= r.timestamp.replace(tzinfo=None) <= naive_end]
+        period = round(calculate_func(period_records), 2) if period_records else 0
+        rows.append((VectorUser(user.id, user.display_name), cumulative, period))
+
+    # 累積労働時間の多い順（get_cumulative_work_hours と同じ並び）
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return HourVector(
+        team_id=team_id,
+        start_date=start_date,
+        end_date=end_date,
+        version=version,
+        users=tuple(row[0] for row in rows),
+        cumulative_hours=tuple(row[1] for row in rows),
+        period_hours=tuple(row[2] for row in rows)
+    )
+
+def _round_amounts(raw_amounts, revenue, rounding):
+    if rounding == 'floor':
+        return [math.floor(amount) for amount in raw_amounts]
+    if rounding == 'largest_remainder':
+        amounts = [math.floor(amount) for amount in raw_amounts]
+        remainder = int(round(revenue)) - sum(amounts)
+        order = sorted(range(len(raw_amounts)), key=lambda i: raw_amounts[i] - amounts[i], reverse=True)
+        for i in order[:max(remainder, 0)]:
+            amounts[i] += 1
+        return amounts
+    return [round(amount, 0) for amount in raw_amounts]
+
+def distribute(vector, revenue, weighting='cumulative', rounding='round'):
+    """
+    キャッシュ済みの労働時間ベクトルに対して収益配分を計算（出退勤記録は参照しない）
+
+    Returns:
+        dict: calculate_revenue_distribution と同じ形式の配分結果
+    """
+    if weighting not in WEIGHTINGS:
+        raise ValueError(f"Unknown weighting: {weighting}")
+    if rounding not in ROUNDINGS:
+        raise ValueError(f"Unknown rounding: {rounding}")
+
+    weights = vector.cumulative_hours if weighting == 'cumulative' else vector.period_hours
+    indexes = [i for i, weight in enumerate(weights) if weight > 0]
+    total_weight = sum(weights[i] for i in indexes)
+    result = {
+        'total_revenue': revenue,
+        'total_cumulative_hours': round(sum(h for h in vector.cumulative_hours if h > 0), 2),
+        'weighting': weighting,
+        'rounding': rounding,
+        'distributions': [],
+        'period_info': {
+            'start_date': vector.start_date,
+            'end_date': vector.end_date
+        }
+    }
+    if total_weight == 0:
+        return result
+
+    raw_amounts = [revenue * weights[i] / total_weight for i in indexes]
+    amounts = _round_amounts(raw_amounts, revenue, rounding)
+    for i, amount in zip(indexes, amounts):
+        result['distributions'].append({
+            'user': vector.users[i],
+            'cumulative_hours': vector.cumulative_hours[i],  # 累積労働時間（配分用）
+            'period_hours': vector.period_hours[i],          # 対象期間労働時間（時給計算用）
+            'work_ratio': round(weights[i] / total_weight * 100, 2),  # パーセンテージ
+            'allocated_amount': amount
+        })
+    return result
+
+def evaluate_scenarios(vector, scenarios):
+    """
+    複数の収益・配分方法のシナリオをまとめて計算
+
+    Args:
+        scenarios: {'revenue': 数値, 'weighting': 配分基準, 'rounding': 丸め方} のリスト（最大 MAX_SCENARIOS 件）
+
+    Returns:
+        list: シナリオごとの配分額（vector.users と同じ並び、配分対象外は0）
+    """
+    if not isinstance(scenarios, list) or len(scenarios) > MAX_SCENARIOS:
+        raise ValueError(f"scenarios must be a list of at most {MAX_SCENARIOS} items")
+    user_index = {user.id: i for i, user in enumerate(vector.users)}
+    results = []
+    for scenario in scenarios:
+        revenue = float(scenario['revenue'])
+        # NaN・無限大（"nan"・"inf"・1e400 など）は配分額を計算できない
+        if not math.isfinite(revenue) or revenue <= 0:
+            raise ValueError('revenue must be a positive finite number')
+        weighting = scenario.get('weighting', 'cumulative')
+        rounding = scenario.get('rounding', 'round')
+        distribution = distribute(vector, revenue, weighting, rounding)
+        amounts = [0] * len(vector.users)
+        for item in distribution['distributions']:
+            amounts[user_index[item['user'].id]] = item['allocated_amount']
+        results.append({
+            'revenue': revenue,
+            'weighting': weighting,
+            'rounding': rounding,
+            'total_allocated': sum(amounts),
+            'amounts': amounts
+        })
+    return results
+
+class HourVectorCache:
+    """
+    (ワークスペースID, 開始日, 終了日) -> 労働時間ベクトルのキャッシュ
+
+    データバージョンが変わった場合は作り直す。
+    """
+
+    def __init__(self, max_entries=64, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None else float(os.environ.get('ACCOUNTING_CACHE_TTL', 600))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, team_id, start_date, end_date, version, build_func):
+        """キャッシュ済みのベクトルを返す（なければ build_func で計算して保存）"""
+        if version is None:
+            return build_func()
+
+        key = (team_id, start_date, end_date)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1].version == version and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        vector = build_func()
+        with self._lock:
+            self._entries[key] = (now, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
@@ -1,22 +1,52 @@
+import time
+
+# 起動時間計測の開始時刻（コールドスタート計測用）
+_import_started_at = time.perf_counter()
+
 import os
 import re
+import math
+import hashlib
 from datetime import datetime, timezone, timedelta
 from flask import Flask, render_template, redirect, url_for, request, jsonify, session, flash
-from slack_bolt import App
-from slack_bolt.adapter.flask import SlackRequestHandler
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-from models import db, User, Attendance
+from models import db, User, Attendance, SchemaVersion, compute_schema_version
+from health import TimedQueuePool, ReadinessProbe, pool_status, queue_depths, register_queue
+from cache import FragmentCache, get_data_version, bump_data_version, ensure_data_version
+from slack_sender import SlackMessageSender
+from scheduler import PeriodicScheduler
+from open_sessions import sweep_open_sessions, open_session_cutoff
+from auth import current_principal, workspace_admin_id
+from workspaces import DEFAULT_TEAM_ID, WORKSPACES, MULTI_WORKSPACE, resolve_team_id, SlackClientPool
+from migrations import run_migrations
+from replica import ReplicaRouter
+from timeline import WeeklyTimeline, week_of_offset, week_offset
+from punch_batcher import PunchBatcher
+from accounting import HourVectorCache, build_hour_vector, distribute, evaluate_scenarios, WEIGHTINGS, ROUNDINGS
+from weekly_stats import WeeklyStatsIndex, install_weekly_hours_hooks, rebuild_weekly_hours, week_start_of
+from precompute import (accumulate_work_hours, precompute_hours_snapshots, install_snapshot_invalidation_hooks,
+                        load_records_after_snapshots, cumulative_hours_from)
+from range_cache import AttendanceRangeCache
+from outbox import OutboxDispatcher, install_outbox_hooks, prune_outbox
+from app_home import HomeTabPublisher
+from slash_commands import DeferredResponder, parse_command, jst_day_bounds, COMMAND_USAGE
+from sqlite_profile import SingleWriter, install_sqlite_pragmas, sqlite_busy_timeout
+from columnar_export import ColumnarExporter, OfflineAnalytics
+from compression import ResponseCompressor
+from static_assets import StaticAssets
+from tracing import tracer, summarize_traces
+from data_quality import scan_data_quality, issue_summary, ISSUE_KINDS
+from presence_table import PresenceTable
+from benchmarks import bench_cli
+from models import WeeklyHours, AttendanceIssue
+from sqlalchemy import event, func, and_, select
 from dotenv import load_dotenv
+import asyncio
 import threading
-import requests
 import logging
-import statistics
 from collections import defaultdict
-import pytz
-
-# 日本時間のタイムゾーン定義
-JST_TZ = pytz.timezone('Asia/Tokyo')
+from contextlib import contextmanager
+import click
+from timezones import JST_TZ
 
 # ログ設定の改善
 logging.basicConfig(level=logging.INFO)
@@ -56,7 +86,7 @@ app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF保護
 
 # データベース設定の改善
 database_url = os.environ.get('DATABASE_URL')
-if database_url:
+if database_url and not database_url.startswith('sqlite'):
     # PostgreSQL用の接続設定の最適化
     if database_url.startswith('postgres://'):
         database_url = database_url.replace('postgres://', 'postgresql://', 1)
@@ -68,14 +98,18 @@ if database_url:
         'pool_size': 10,        # 接続プールサイズ
         'max_overflow': 20,     # 最大オーバーフロー
         'pool_timeout': 30,     # 接続タイムアウト（秒）
+        'poolclass': TimedQueuePool,  # 接続待ち時間を計測
         'connect_args': {'sslmode': 'require', 'connect_timeout': 30}
     }
 else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///instance/attendance.db'
+    # DATABASE_URL 未設定時（またはSQLiteのURL指定時）はSQLiteを使用
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url or 'sqlite:///instance/attendance.db'
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
         'pool_pre_ping': True,
         'pool_recycle': 3600,
-        'pool_timeout': 30
+        'pool_timeout': 30,
+        'poolclass': TimedQueuePool,
+        'connect_args': {'timeout': sqlite_busy_timeout()}  # 他のワーカーの書き込み完了を待つ時間
     }
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -83,6 +117,71 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # データベースの初期化
 db.init_app(app)
 
+# SQLite運用時は接続ごとにPRAGMA（WAL・synchronous・cache_size・mmap_size）を設定し、
+# 打刻・記録の編集の書き込みをワーカー間で1つずつ実行する（SQLITE_SINGLE_WRITER=false で無効化）
+sqlite_database = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+sqlite_lock_path = None
+if sqlite_database:
+    with app.app_context():
+        install_sqlite_pragmas(db.engine)
+        if db.engine.url.database and db.engine.url.database != ':memory:':
+            sqlite_lock_path = f"{db.engine.url.database}-writer.lock"
+single_writer = SingleWriter(
+    sqlite_lock_path,
+    enabled=sqlite_database and os.environ.get('SQLITE_SINGLE_WRITER', 'true').lower() == 'true'
+)
+
+def commit_write(team_id):
+    """データバージョンを増加させてコミット（SQLiteの場合は他の書き込みの完了を待ってから書き込む）"""
+    with single_writer.serialize():
+        bump_data_version(team_id)
+        db.session.commit()
+
+# 処理区間の計測（TRACING_ENABLED=true の場合のみ）: HTTPリクエストごとにトレースを開始し、
+# Slackのリスナー・SQL文・Slack API・集計関数・バックグラウンドスレッドの送信をその子として記録する
+tracer.configure(os.path.join(app.instance_path, 'traces.jsonl'))
+if tracer.enabled:
+    from sqlalchemy.engine import Engine
+    from flask import g
+
+    tracer.instrument_sqlalchemy(Engine)
+    tracer.instrument_slack_sdk()
+
+    @app.before_request
+    def start_request_trace():
+        g._trace = tracer.start_root('http.request', **{
+            'http.method': request.method,
+            'http.route': request.url_rule.rule if request.url_rule else request.path
+        })
+
+    @app.after_request
+    def record_response_status(response):
+        started = g.get('_trace')
+        if started is not None:
+            started[0].set_attribute('http.status_code', response.status_code)
+        return response
+
+    @app.teardown_request
+    def end_request_trace(exception=None):
+        tracer.end_root(g.pop('_trace', None), exception)
+
+# 分析・ダッシュボード向けの読み取り先（DATABASE_REPLICA_URL 未設定時は常にプライマリ）
+replica_url = os.environ.get('DATABASE_REPLICA_URL')
+if replica_url and replica_url.startswith('postgres://'):
+    replica_url = replica_url.replace('postgres://', 'postgresql://', 1)
+replica_router = ReplicaRouter(replica_url, app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+
+@app.teardown_appcontext
+def remove_replica_session(exception=None):
+    replica_router.remove()
+
+# 全ユーザー共通の描画済みフラグメント（全社統計・出勤中メンバー・ユーザー一覧）のキャッシュ
+fragment_cache = FragmentCache()
+
+# HTML・JSONのレスポンスの圧縮と、静的ファイルのハッシュ付きURL（無期限キャッシュ・事前圧縮）
+response_compressor = ResponseCompressor(app)
+static_assets = StaticAssets(app)
+
 # カスタムフィルタを追加（UTC時間を日本時間に変換）
 @app.template_filter('jst')
 def jst_filter(utc_datetime):
@@ -101,104 +200,240 @@ def strftime_filter(datetime_obj, format_str):
         return None
     return datetime_obj.strftime(format_str)
 
-# Slack Bolt の自動OAuth設定を無効にするために環境変数を一時的に削除
+# Slack OAuth（Sign in with Slack）用の認証情報を保持
+# Bolt の自動OAuth設定とは切り離し、ログイン処理ではこちらを参照する
 slack_client_id = os.environ.get('SLACK_CLIENT_ID')
 slack_client_secret = os.environ.get('SLACK_CLIENT_SECRET')
-if 'SLACK_CLIENT_ID' in os.environ:
-    del os.environ['SLACK_CLIENT_ID']
-if 'SLACK_CLIENT_SECRET' in os.environ:
-    del os.environ['SLACK_CLIENT_SECRET']
-
-# Slack Boltアプリケーションの設定（シンプルなトークンベース）
-slack_app = App(
-    token=os.environ.get('SLACK_BOT_TOKEN'),
-    signing_secret=os.environ.get('SLACK_SIGNING_SECRET'),
-    process_before_response=True
-)
 
-# 環境変数を復元
-if slack_client_id:
-    os.environ['SLACK_CLIENT_ID'] = slack_client_id
-if slack_client_secret:
-    os.environ['SLACK_CLIENT_SECRET'] = slack_client_secret
+# 起動最適化モード（Slackクライアントの生成とトークン検証を初回利用時まで遅延）
+fast_startup = os.environ.get('FAST_STARTUP', 'false').lower() == 'true'
 
-# Slack Web クライアント
-slack_client = WebClient(token=os.environ.get('SLACK_BOT_TOKEN'))
+# Slack関連オブジェクト（初回利用時に生成）
+_slack_lock = threading.Lock()
+_slack_app = None
+_slack_handler = None
+slack_client_pool = SlackClientPool()
 
-# SlackRequestHandlerの設定
-handler = SlackRequestHandler(slack_app)
+# Slack Bolt が環境変数から自動で設定する項目（OAuth設定・ボットトークン）
+BOLT_ENV_DEFAULTS = ('SLACK_CLIENT_ID', 'SLACK_CLIENT_SECRET', 'SLACK_BOT_TOKEN')
+
+@contextmanager
+def without_bolt_env_defaults():
+    """
+    Slack Bolt の自動OAuth設定などを無効にするために環境変数を一時的に削除（終了時に復元）
+
+    ボットトークンは Web クライアント（client）または authorize 関数で明示的に渡す。
+    """
+    saved = {name: os.environ.pop(name) for name in BOLT_ENV_DEFAULTS if name in os.environ}
+    try:
+        yield
+    finally:
+        os.environ.update(saved)
 
-# Slack Bot イベントリスナー（最適化）
-@slack_app.message(re.compile(r'(出勤|おはよう)', re.IGNORECASE))
-def handle_checkin(message, say):
+def _build_slack_app():
+    """Slack Boltアプリケーションを生成してイベントリスナーを登録"""
+    from slack_bolt import App
+    from slack_sdk import WebClient
+
+    with without_bolt_env_defaults():
+        if MULTI_WORKSPACE:
+            # 複数ワークスペース運用時はイベントのチームIDからボットトークンを選択
+            slack_app = App(
+                client=WebClient(base_url=os.environ.get('SLACK_API_BASE_URL', WebClient.BASE_URL)),
+                authorize=slack_client_pool.authorize,
+                signing_secret=os.environ.get('SLACK_SIGNING_SECRET'),
+                process_before_response=True
+            )
+        else:
+            # Slack Boltアプリケーションの設定（シンプルなトークンベース）
+            # 起動最適化モードでは auth.test を初回イベント受信時まで遅延
+            slack_app = App(
+                client=get_slack_client(DEFAULT_TEAM_ID),
+                signing_secret=os.environ.get('SLACK_SIGNING_SECRET'),
+                process_before_response=True,
+                token_verification_enabled=not fast_startup
+            )
+
+    # 「出勤中」が出勤打刻として扱われないよう、在席確認を先に登録（最初に一致したリスナーのみ実行される）
+    # リスナーの実行はトレース中の場合 slack.listener.<関数名> のスパンとして記録
+    def listener(func):
+        return tracer.traced(f"slack.listener.{func.__name__}")(func)
+
+    slack_app.message(PRESENCE_PATTERN)(listener(handle_presence))
+    slack_app.message(re.compile(r'(出勤|おはよう)', re.IGNORECASE))(listener(handle_checkin))
+    slack_app.message(re.compile(r'(退勤|おつかれ)', re.IGNORECASE))(listener(handle_checkout))
+    slack_app.message(re.compile(r'(ヘルプ|help)', re.IGNORECASE))(listener(handle_help))
+    slack_app.event("app_mention")(listener(handle_app_mention))
+    slack_app.event("app_home_opened")(listener(handle_app_home_opened))
+    slack_app.command(SLASH_COMMAND)(listener(handle_attendance_command))
+
+    logger.info("Slack Bolt app initialized")
+    return slack_app
+
+def get_slack_app():
+    """Slack Boltアプリケーションを取得（初回呼び出し時に生成）"""
+    global _slack_app
+    if _slack_app is None:
+        with _slack_lock:
+            if _slack_app is None:
+                _slack_app = _build_slack_app()
+    return _slack_app
+
+def get_slack_client(team_id=None):
+    """ワークスペースの Slack Web クライアントを取得（初回呼び出し時に生成）"""
+    return slack_client_pool.get(team_id)
+
+def get_slack_handler():
+    """SlackRequestHandlerを取得（初回呼び出し時に生成）"""
+    global _slack_handler
+    if _slack_handler is None:
+        from slack_bolt.adapter.flask import SlackRequestHandler
+        slack_app = get_slack_app()
+        with _slack_lock:
+            if _slack_handler is None:
+                _slack_handler = SlackRequestHandler(slack_app)
+    return _slack_handler
+
+# Slackへの返信送信キュー（打刻処理のトランザクションにSlackの遅延を含めない）
+slack_sender = SlackMessageSender(get_slack_client)
+slack_sender.register_shutdown_flush()
+register_queue('slack_outbound', slack_sender.qsize)
+
+def reply_async(message, say, text, team_id=None):
+    """返信を送信キュー経由で非同期に送信（チャンネル不明の場合は say で即時送信）"""
+    channel = message.get('channel')
+    if channel and team_id:
+        slack_sender.send(channel, text, team_id=team_id)
+    else:
+        say(text)
+
+def message_team_id(message, context):
+    """イベントのワークスペースIDを取得（未登録のワークスペースの場合は None）"""
+    return resolve_team_id((context or {}).get('team_id') or message.get('team'))
+
+# 打刻のグループコミット（出勤開始時刻などに集中する打刻を数ミリ秒単位でまとめてコミット）
+punch_group_commit = os.environ.get('PUNCH_GROUP_COMMIT', 'false').lower() == 'true'
+punch_batcher = PunchBatcher(app, writer=single_writer)
+register_queue('punch_batch', punch_batcher.qsize)
+
+def _record_punch_direct(team_id, slack_user_id, kind):
+    """打刻を1件ずつコミットして記録"""
+    user = get_or_create_user(slack_user_id, team_id)
+    if not user:
+        return None
+    
+    timestamp = datetime.now(timezone.utc)
+    attendance = Attendance(
+        team_id=team_id,
+        user_id=user.id,
+        type=kind,
+        timestamp=timestamp
+    )
+    db.session.add(attendance)
+    commit_write(team_id)
+    return timestamp
+
+def _record_punch_batched(team_id, slack_user_id, kind, batcher=None):
+    """打刻をグループコミットのキューに追加し、コミットまで待機して記録"""
+    timestamp = datetime.now(timezone.utc)
+    profile = None
+    if User.query.with_entities(User.id).filter_by(team_id=team_id, slack_user_id=slack_user_id).first() is None:
+        # 未登録ユーザーはプロフィールを取得し、打刻と同じトランザクションで作成
+        profile = fetch_slack_profile(slack_user_id, team_id)
+        if profile is None:
+            return None
+    # 読み取りのみのトランザクションを終了してから待機
+    db.session.rollback()
+    (batcher or punch_batcher).record(team_id, slack_user_id, kind, timestamp, profile)
+    return timestamp
+
+@tracer.traced('punch.record')
+def record_punch(team_id, slack_user_id, kind):
+    """
+    打刻を記録して確定した打刻時刻を返す（ユーザー情報を取得できない場合は None）
+
+    PUNCH_GROUP_COMMIT が有効な場合は他の打刻とまとめて1回のコミットで記録する。
+    """
+    if punch_group_commit:
+        return _record_punch_batched(team_id, slack_user_id, kind)
+    return _record_punch_direct(team_id, slack_user_id, kind)
+
+# Slack Bot イベントリスナー（最適化、登録は _build_slack_app で実施）
+def handle_checkin(message, say, context=None):
     """出勤打刻を処理"""
+    team_id = message_team_id(message, context)
+    if team_id is None:
+        logger.warning(f"Ignored checkin from unregistered workspace: {message.get('team')}")
+        return
     try:
         user_id = message['user']
         logger.info(f"Received checkin message from user: {user_id}")
         
-        # ユーザー情報を取得
-        user = get_or_create_user(user_id)
-        if not user:
+        # 出勤記録を作成（ユーザー情報の取得に失敗した場合は None）
+        timestamp = record_punch(team_id, user_id, '出勤')
+        if timestamp is None:
             logger.error(f"Failed to get or create user: {user_id}")
-            say("申し訳ありませんが、ユーザー情報の取得に失敗しました。")
+            reply_async(message, say, "申し訳ありませんが、ユーザー情報の取得に失敗しました。", team_id)
             return
         
-        # 出勤記録を作成
-        attendance = Attendance(
-            user_id=user.id,
-            type='出勤',
-            timestamp=datetime.now(timezone.utc)
-        )
-        
-        db.session.add(attendance)
-        db.session.commit()
-        
         # 返信メッセージを送信（日本時間で表示）
-        jst_timestamp = attendance.timestamp.astimezone(JST_TZ)
-        say(f"出勤打刻を受け付けました！ {jst_timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
+        jst_timestamp = timestamp.astimezone(JST_TZ)
+        reply_async(message, say, f"出勤打刻を受け付けました！ {jst_timestamp.strftime('%Y-%m-%d %H:%M:%S')}", team_id)
         logger.info(f"Checkin recorded for user: {user_id}")
         
     except Exception as e:
         logger.error(f"Error handling checkin: {e}")
-        say("申し訳ありませんが、出勤打刻の処理中にエラーが発生しました。")
+        reply_async(message, say, "申し訳ありませんが、出勤打刻の処理中にエラーが発生しました。", team_id)
 
-@slack_app.message(re.compile(r'(退勤|おつかれ)', re.IGNORECASE))
-def handle_checkout(message, say):
+def handle_checkout(message, say, context=None):
     """退勤打刻を処理"""
+    team_id = message_team_id(message, context)
+    if team_id is None:
+        logger.warning(f"Ignored checkout from unregistered workspace: {message.get('team')}")
+        return
     try:
         user_id = message['user']
         logger.info(f"Received checkout message from user: {user_id}")
         
-        # ユーザー情報を取得
-        user = get_or_create_user(user_id)
-        if not user:
+        # 退勤記録を作成（ユーザー情報の取得に失敗した場合は None）
+        timestamp = record_punch(team_id, user_id, '退勤')
+        if timestamp is None:
             logger.error(f"Failed to get or create user: {user_id}")
-            say("申し訳ありませんが、ユーザー情報の取得に失敗しました。")
+            reply_async(message, say, "申し訳ありませんが、ユーザー情報の取得に失敗しました。", team_id)
             return
         
-        # 退勤記録を作成
-        attendance = Attendance(
-            user_id=user.id,
-            type='退勤',
-            timestamp=datetime.now(timezone.utc)
-        )
-        
-        db.session.add(attendance)
-        db.session.commit()
-        
         # 返信メッセージを送信（日本時間で表示）
-        jst_timestamp = attendance.timestamp.astimezone(JST_TZ)
-        say(f"退勤打刻を受け付けました！ {jst_timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
+        jst_timestamp = timestamp.astimezone(JST_TZ)
+        reply_async(message, say, f"退勤打刻を受け付けました！ {jst_timestamp.strftime('%Y-%m-%d %H:%M:%S')}", team_id)
         logger.info(f"Checkout recorded for user: {user_id}")
         
     except Exception as e:
         logger.error(f"Error handling checkout: {e}")
-        say("申し訳ありませんが、退勤打刻の処理中にエラーが発生しました。")
+        reply_async(message, say, "申し訳ありませんが、退勤打刻の処理中にエラーが発生しました。", team_id)
 
-@slack_app.message(re.compile(r'(ヘルプ|help)', re.IGNORECASE))
-def handle_help(message, say):
-    """ヘルプメッセージを送信"""
-    help_text = """
+# 現在出勤中のメンバーを確認するメッセージ
+PRESENCE_PATTERN = re.compile(r'(出勤中|在席|誰がいる)')
+
+def presence_text(members):
+    """現在出勤中のメンバーの一覧を返信用の文字列に整形"""
+    if not members:
+        return "現在出勤中のメンバーはいません。"
+    lines = [f"現在出勤中のメンバー（{len(members)}人）:"]
+    for member in members:
+        checkin_time = member['checkin_time'].replace(tzinfo=timezone.utc).astimezone(JST_TZ)
+        lines.append(f"• {member['user'].display_name}（{checkin_time.strftime('%H:%M')} 出勤）")
+    return "\n".join(lines)
+
+def handle_presence(message, say, context=None):
+    """現在出勤中のメンバーを返信"""
+    team_id = message_team_id(message, context)
+    if team_id is None:
+        logger.warning(f"Ignored presence query from unregistered workspace: {message.get('team')}")
+        return
+    reply_async(message, say, presence_text(get_currently_working_members(team_id)), team_id)
+
+# ボットの使い方（ヘルプ・メンションへの返信）
+HELP_TEXT = """
 📋 **出退勤管理ボットの使い方**
 
 🌅 **出勤打刻:**
@@ -209,6 +444,13 @@ def handle_help(message, say):
 • `退勤`
 • `おつかれ`
 
+👥 **現在出勤中のメンバー:**
+• `出勤中`
+• `在席`
+
+📊 **労働時間の照会:**
+• `/attendance today` / `this week` / `last month` など
+
 ❓ **このヘルプを表示:**
 • `ヘルプ`
 • `help`
@@ -216,11 +458,20 @@ def handle_help(message, say):
 💻 **Web画面でも確認できます:**
 https://arabesque-time.onrender.com/
     """
-    say(help_text)
+
+def handle_app_home_opened(event, context=None):
+    """ホームタブが開かれた場合に、このワーカーで未公開であれば公開を予約"""
+    team_id = resolve_team_id((context or {}).get('team_id') or event.get('team'))
+    if team_id is None or event.get('tab') != 'home' or not home_tab_enabled:
+        return
+    home_publisher.opened(team_id, event['user'])
+
+def handle_help(message, say):
+    """ヘルプメッセージを送信"""
+    say(HELP_TEXT)
 
 # デバッグ用メッセージハンドラーを削除（本番環境では不要）
 # 代わりにapp_mentionsイベントのみ処理
-@slack_app.event("app_mention")
 def handle_app_mention(event, say):
     """ボットへのメンションを処理"""
     text = event.get('text', '').lower()
@@ -229,41 +480,140 @@ def handle_app_mention(event, say):
     else:
         say("こんにちは！出退勤管理ボットです。`ヘルプ`と送信すると使い方を確認できます。")
 
-def get_or_create_user(slack_user_id):
+# スラッシュコマンド（/attendance）による労働時間の照会
+SLASH_COMMAND = os.environ.get('SLASH_COMMAND_NAME', '/attendance')
+slash_responder = DeferredResponder(app)
+register_queue('slash_commands', slash_responder.qsize)
+
+def _user_records(team_id, user_id, start, end, read_db=None):
+    """ユーザーの期間内（日本時間の日付）の出退勤記録を時系列順に取得（ユーザー・日時のインデックス範囲のみ読み込む）"""
+    start_datetime, end_datetime = jst_day_bounds(start, end)
+    return (read_db or db.session).query(Attendance).filter(
+        Attendance.team_id == team_id,
+        Attendance.user_id == user_id,
+        Attendance.timestamp >= start_datetime,
+        Attendance.timestamp < end_datetime
+    ).order_by(Attendance.timestamp).all()
+
+def _period_hours_text(team_id, user_id, query):
+    """期間の労働時間と出勤日数の返信（response_url への送信用）"""
+    records = _user_records(team_id, user_id, query.start, query.end, replica_router.read_session(team_id))
+    hours = calculate_work_hours_from_records(records)
+    days = len({jst_filter(record.timestamp).date() for record in records if record.type == '出勤'})
+    return (f"{query.label}（{query.start.strftime('%m/%d')}〜{query.end.strftime('%m/%d')}）の労働時間: "
+            f"{hours}時間（出勤日数 {days}日）")
+
+def answer_attendance_command(team_id, slack_user_id, text, now=None):
+    """
+    スラッシュコマンドの返信を作成
+
+    応答期限（3秒）内に返すため、即時の返信は週別労働時間の集計テーブルの1行か当日分の記録のみを参照する。
+    月単位の照会は返信の代わりに後から実行する関数を返す。
+
+    Returns:
+        tuple: (即時の返信, 応答後に実行して返信本文を返す関数 または None)
+    """
+    now = now or datetime.now(timezone.utc)
+    query = parse_command(text, now.astimezone(JST_TZ).date(), week_start_of(now))
+    if query is None:
+        return f"「{text}」は照会できません。\n{COMMAND_USAGE}", None
+    if query.kind == 'help':
+        return COMMAND_USAGE, None
+    if query.kind == 'presence':
+        return presence_text(get_currently_working_members(team_id)), None
+
+    user = User.query.filter_by(team_id=team_id, slack_user_id=slack_user_id).first()
+    if user is None:
+        return "まだ打刻の記録がありません。DMで「出勤」と送信すると打刻できます。", None
+    if query.kind == 'week':
+        hours = db.session.query(WeeklyHours.hours).filter_by(
+            team_id=team_id, user_id=user.id, week_start=query.start
+        ).scalar()
+        return (f"{query.label}（{query.start.strftime('%m/%d')}〜{query.end.strftime('%m/%d')}）の労働時間: "
+                f"{round(hours or 0, 2)}時間"), None
+    if query.kind == 'today':
+        records = _user_records(team_id, user.id, query.start, query.end)
+        if not records:
+            return "今日の打刻はまだありません。", None
+        lines = [f"今日の労働時間: {calculate_work_hours_from_records(records)}時間"]
+        lines.extend(f"• {jst_filter(record.timestamp).strftime('%H:%M')} {record.type}" for record in records)
+        if records[-1].type == '出勤':
+            lines.append("（出勤中の時間は退勤打刻後に加算されます）")
+        return "\n".join(lines), None
+    user_id = user.id
+    return f"{query.label}の労働時間を集計しています…", lambda: _period_hours_text(team_id, user_id, query)
+
+def handle_attendance_command(ack, command, context=None):
+    """スラッシュコマンドに応答（重い照会は応答後に response_url へ返信）"""
+    team_id = resolve_team_id((context or {}).get('team_id') or command.get('team_id'))
+    if team_id is None:
+        logger.warning(f"Ignored slash command from unregistered workspace: {command.get('team_id')}")
+        ack("このワークスペースでは利用できません。")
+        return
+    started = time.perf_counter()
+    try:
+        text, job = answer_attendance_command(team_id, command['user_id'], command.get('text', ''))
+        if job is not None and not slash_responder.submit(command['response_url'], job):
+            text = "照会が混み合っています。しばらくしてから再度お試しください。"
+    except Exception as e:
+        logger.error(f"Error handling slash command: {e}")
+        text = "申し訳ありませんが、照会の処理中にエラーが発生しました。"
+    ack(text)
+    logger.info(f"{SLASH_COMMAND} answered in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def fetch_slack_profile(slack_user_id, team_id=DEFAULT_TEAM_ID):
+    """Slack APIからユーザーの表示名とメールアドレスを取得（取得できない場合は None）"""
+    from slack_sdk.errors import SlackApiError
+
+    try:
+        response = get_slack_client(team_id).users_info(user=slack_user_id)
+        if not response.get('ok'):
+            logger.error(f"Slack API error: {response.get('error')}")
+            return None
+        
+        return profile_from_user_info(response['user'])
+    except SlackApiError as e:
+        logger.error(f"Error fetching user info: {e}")
+        # エラーの場合はデフォルトの表示名を使用
+        return default_profile(slack_user_id)
+
+def profile_from_user_info(user_info):
+    """users.info のユーザー情報から表示名とメールアドレスを取得"""
+    return {
+        'display_name': user_info.get('real_name', user_info.get('name', 'Unknown')),
+        'email': user_info.get('profile', {}).get('email', '')
+    }
+
+def default_profile(slack_user_id):
+    """Slack APIでユーザー情報を取得できない場合の表示名"""
+    return {
+        'display_name': f'User_{slack_user_id[-4:]}',  # IDの末尾4桁のみ表示
+        'email': ''
+    }
+
+@tracer.traced('user.get_or_create')
+def get_or_create_user(slack_user_id, team_id=DEFAULT_TEAM_ID):
     """Slackユーザー情報を取得または作成（エラーハンドリング改善）"""
     try:
-        user = User.query.filter_by(slack_user_id=slack_user_id).first()
+        user = User.query.filter_by(team_id=team_id, slack_user_id=slack_user_id).first()
         
         if not user:
+            # Slack APIからユーザー情報を取得
+            profile = fetch_slack_profile(slack_user_id, team_id)
+            if profile is None:
+                return None
+            
             try:
-                # Slack APIからユーザー情報を取得
-                response = slack_client.users_info(user=slack_user_id)
-                if not response.get('ok'):
-                    logger.error(f"Slack API error: {response.get('error')}")
-                    return None
-                    
-                user_info = response['user']
-                
                 user = User(
+                    team_id=team_id,
                     slack_user_id=slack_user_id,
-                    display_name=user_info.get('real_name', user_info.get('name', 'Unknown')),
-                    email=user_info.get('profile', {}).get('email', '')
+                    display_name=profile['display_name'],
+                    email=profile['email']
                 )
                 
                 db.session.add(user)
-                db.session.commit()
+                commit_write(team_id)
                 logger.info(f"Created new user: {slack_user_id}")
-                
-            except SlackApiError as e:
-                logger.error(f"Error fetching user info: {e}")
-                # エラーの場合はデフォルトユーザーを作成
-                user = User(
-                    slack_user_id=slack_user_id,
-                    display_name=f'User_{slack_user_id[-4:]}',  # IDの末尾4桁のみ表示
-                    email=''
-                )
-                db.session.add(user)
-                db.session.commit()
             except Exception as e:
                 logger.error(f"Database error creating user: {e}")
                 return None
@@ -288,21 +638,8 @@ def calculate_work_hours_from_records(records):
         if not records:
             return 0
         
-        # 記録を時系列順にソート
-        sorted_records = sorted(records, key=lambda x: x.timestamp)
-        
-        total_hours = 0
-        current_checkin = None
-        
-        for record in sorted_records:
-            if record.type == '出勤':
-                # 既に出勤中の場合は、前の出勤記録を更新
-                current_checkin = record
-            elif record.type == '退勤' and current_checkin is not None:
-                # 出勤中の場合、労働時間を計算
-                hours = (record.timestamp - current_checkin.timestamp).total_seconds() / 3600
-                total_hours += hours
-                current_checkin = None  # 退勤したのでリセット
+        # 事前計算（累積労働時間のスナップショット）と同じ規則で加算
+        total_hours, _ = accumulate_work_hours(records)
         
         return round(total_hours, 2)
     
@@ -310,66 +647,200 @@ def calculate_work_hours_from_records(records):
         logger.error(f"Error calculating work hours from records: {e}")
         return 0
 
-def calculate_work_hours_statistics(user_id=None):
-    """活動時間の統計を計算（週単位）- 最適化版"""
+# 出退勤記録の変更をコミット時に週別労働時間（weekly_hours）へ反映
+install_weekly_hours_hooks(calculate_work_hours_from_records)
+
+def precompute_boundary(now=None):
+    """累積労働時間の事前計算の境界（当日の開始、日本時間）をUTCで取得"""
+    today_jst = (now or datetime.now(timezone.utc)).astimezone(JST_TZ).date()
+    return JST_TZ.localize(datetime.combine(today_jst, datetime.min.time())).astimezone(timezone.utc)
+
+# 当日より前の出退勤記録の変更時に、該当ユーザーの累積労働時間の事前計算結果を破棄
+install_snapshot_invalidation_hooks(precompute_boundary)
+
+# 出退勤記録の変更イベント（attendance_outbox）の各ワーカーへの配信
+outbox_dispatcher = OutboxDispatcher(app)
+
+# Slackのホームタブ（変更をコミットしたワーカーが該当ユーザーの分を公開）
+home_tab_enabled = os.environ.get('HOME_TAB_ENABLED', 'true').lower() == 'true'
+home_publisher = HomeTabPublisher(app, get_slack_client)
+register_queue('home_tab', home_publisher.qsize)
+
+# 出勤中のユーザーの共有メモリ上の表（gunicorn の全ワーカーで共有、PRESENCE_SHARED=false で無効化）
+def _presence_table_path():
+    if os.environ.get('PRESENCE_SHM_PATH'):
+        return os.environ['PRESENCE_SHM_PATH']
+    # データベースごとに別の表（同じサーバーで複数の環境を動かす場合）
+    with app.app_context():
+        database_key = hashlib.sha1(str(db.engine.url).encode()).hexdigest()[:12]
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else app.instance_path
+    return os.path.join(directory, f'attendance-presence-{database_key}')
+
+presence_table = PresenceTable(
+    _presence_table_path(),
+    enabled=os.environ.get('PRESENCE_SHARED', 'true').lower() == 'true'
+)
+
+def rebuild_presence_table():
+    """最新の打刻が出勤のユーザーをデータベースから取得して共有メモリ上の表を作り直す（起動時・定期実行）"""
+    def load_rows():
+        latest = db.session.query(
+            Attendance.user_id,
+            func.max(Attendance.timestamp).label('latest_timestamp')
+        ).group_by(Attendance.user_id).subquery()
+        return db.session.query(
+            Attendance.team_id, Attendance.user_id, Attendance.timestamp, User.slack_user_id, User.display_name
+        ).join(latest, and_(Attendance.user_id == latest.c.user_id,
+                            Attendance.timestamp == latest.c.latest_timestamp)
+        ).join(User, User.id == Attendance.user_id).filter(Attendance.type == '出勤').all()
+
+    presence_table.rebuild(load_rows)
+    return presence_table.stats()['entries']
+
+# コミット後に表へ反映するユーザー（ワークスペースID, ユーザーID）
+_presence_pending = set()
+_presence_pending_lock = threading.Lock()
+
+def refresh_presence():
+    """変更のあったユーザーの最新の打刻を共有メモリ上の表に反映（コミット後のため別の接続で取得）"""
+    with _presence_pending_lock:
+        keys = set(_presence_pending)
+        _presence_pending.clear()
+    if not keys:
+        return
     try:
-        # 対象のユーザーを決定（最適化：必要なデータのみ取得）
-        if user_id:
-            attendances = Attendance.query.filter_by(user_id=user_id).order_by(Attendance.timestamp).all()
-        else:
-            # 全体統計の場合、過去3ヶ月に制限（パフォーマンス対策）
-            three_months_ago = datetime.now(timezone.utc) - timedelta(days=90)
-            attendances = Attendance.query.filter(
-                Attendance.timestamp >= three_months_ago
-            ).order_by(Attendance.timestamp).all()
-        
-        if not attendances:
-            return {
-                'weekly_hours': [],
-                'average_hours': 0,
-                'median_hours': 0,
-                'total_weeks': 0,
-                'total_hours': 0
-            }
-        
-        # ユーザーごとの出退勤記録を整理
-        user_attendances = defaultdict(list)
-        for attendance in attendances:
-            user_attendances[attendance.user_id].append(attendance)
-        
-        # 週ごとの作業時間を計算
-        weekly_hours = []
-        
-        for uid, records in user_attendances.items():
-            # 週ごとに記録を分類
-            weekly_records = defaultdict(list)
-            for record in records:
-                week_start = record.timestamp.date() - timedelta(days=record.timestamp.weekday())
-                weekly_records[week_start].append(record)
-            
-            # 各週の作業時間を計算（日跨ぎ対応）
-            for week_start, week_records in weekly_records.items():
-                week_hours = calculate_work_hours_from_records(week_records)
-                if week_hours > 0:
-                    weekly_hours.append(week_hours)
-        
-        # 統計値を計算
-        if weekly_hours:
-            average_hours = statistics.mean(weekly_hours)
-            median_hours = statistics.median(weekly_hours)
-            total_hours = sum(weekly_hours)
+        with app.app_context(), db.engine.connect() as connection:
+            def load_latest(team_id, user_id):
+                return connection.execute(
+                    select(Attendance.type, Attendance.timestamp, User.slack_user_id, User.display_name)
+                    .join(User, User.id == Attendance.user_id)
+                    .where(Attendance.team_id == team_id, Attendance.user_id == user_id)
+                    .order_by(Attendance.timestamp.desc(), Attendance.id.desc())
+                    .limit(1)
+                ).first()
+
+            presence_table.refresh(keys, load_latest)
+    except Exception as e:
+        logger.error(f"Error refreshing presence table: {e}")
+        presence_table.invalidate()
+
+def on_attendance_commit(events):
+    """出退勤記録の変更のコミット後の処理（出勤中のユーザーの表の更新、このワーカーの配信スレッドの起床とホームタブの更新予約）"""
+    if presence_table.enabled:
+        with _presence_pending_lock:
+            _presence_pending.update((event.team_id, event.user_id) for event in events)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            # 非同期版（async_app）のコミットはイベントループ上で呼ばれるため、データベースの取得とロックは別スレッドで行う
+            loop.run_in_executor(None, refresh_presence)
         else:
-            average_hours = 0
-            median_hours = 0
-            total_hours = 0
-        
-        return {
-            'weekly_hours': weekly_hours,
-            'average_hours': round(average_hours, 2),
-            'median_hours': round(median_hours, 2),
-            'total_weeks': len(weekly_hours),
-            'total_hours': round(total_hours, 2)
-        }
+            refresh_presence()
+    outbox_dispatcher.notify()
+    if home_tab_enabled:
+        home_publisher.on_commit(events)
+
+install_outbox_hooks(on_commit=on_attendance_commit)
+
+# 出退勤一覧・ユーザー詳細の期間指定表示用の日別キャッシュ（変更イベントで該当日を破棄）
+attendance_range_cache = AttendanceRangeCache()
+outbox_dispatcher.subscribe(attendance_range_cache.apply_events)
+
+def get_attendances_in_range(team_id, user_id, start_datetime, end_datetime):
+    """期間内のユーザーの出退勤記録を新しい順で取得（取得済みの日はキャッシュから返す）"""
+    version = get_data_version(team_id)
+    if version is None:
+        # 変更イベントに追いついたか確認できないため破棄
+        attendance_range_cache.clear(team_id)
+    else:
+        outbox_dispatcher.catch_up(team_id, version)
+    return attendance_range_cache.attendances(team_id, user_id, start_datetime, end_datetime)
+
+def versioned_json(team_id, principal_id, build):
+    """
+    ワークスペースのデータバージョンを含む ETag 付きのJSONレスポンス
+
+    If-None-Match が一致する場合（前回の取得から出退勤データが変更されていない場合）は本文を生成せずに 304 を返す。
+    """
+    version = get_data_version(team_id)
+    if version is None:
+        return jsonify(build())
+    # 同じバージョンでも利用者・パラメータ・日付（期間の既定値）が異なれば別の内容
+    key = f'{principal_id}:{request.full_path}:{datetime.now(JST_TZ).date().isoformat()}'
+    etag = f'{team_id}-{version}-{hashlib.sha1(key.encode()).hexdigest()[:16]}'
+    # 圧縮したレスポンスの ETag は弱いETagになるため、弱い比較で判定
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def precompute_aggregates(full=False):
+    """全ワークスペースの累積労働時間を当日の開始時点まで事前計算"""
+    as_of = precompute_boundary()
+    team_ids = [team_id for (team_id,) in db.session.query(User.team_id).distinct()]
+    results = {}
+    for team_id in team_ids:
+        results[team_id] = precompute_hours_snapshots(team_id, as_of, full=full)
+        logger.info(f"Precomputed hours snapshots for {team_id}: {results[team_id]}")
+    return results
+
+def scan_all_data_quality(full=False):
+    """全ワークスペースの出退勤記録の問題を検出（前回のスキャン以降に変更のあったユーザーのみ）"""
+    team_ids = [team_id for (team_id,) in db.session.query(User.team_id).distinct()]
+    return {team_id: scan_data_quality(team_id, full=full) for team_id in team_ids}
+
+# 出退勤記録の月別の列指向ファイル（Parquet）への書き出し（分析用、既定でリードレプリカを参照）
+attendance_export_dir = os.environ.get('ATTENDANCE_EXPORT_DIR', os.path.join(app.instance_path, 'export'))
+
+def export_attendance(team_ids=None, include_current=False, export_dir=None):
+    """ワークスペースごとに未書き出し・変更のあった月の出退勤記録を書き出す"""
+    team_ids = team_ids or [team_id for (team_id,) in db.session.query(User.team_id).distinct()]
+    results = {}
+    for team_id in team_ids:
+        exporter = ColumnarExporter(export_dir or attendance_export_dir, replica_router.read_session(team_id))
+        results[team_id] = exporter.export(team_id, include_current=include_current)
+        logger.info(f"Exported attendance for {team_id}: {results[team_id]}")
+    return results
+
+# 週別労働時間の統計インデックス（平均・中央値・p90 を差分更新）
+weekly_stats_index = WeeklyStatsIndex()
+
+# ユーザー別の週次労働時間の時系列（グラフ用、ワークスペースごとにファイルへ保存）
+weekly_timeline = WeeklyTimeline(os.environ.get('TIMELINE_CACHE_DIR', os.path.join(app.instance_path, 'timeline')))
+weekly_timeline.register_shutdown_persist()
+
+# 時系列APIで一度に取得できるユーザー数・週数
+TIMELINE_MAX_USERS = 200
+TIMELINE_MAX_WEEKS = 520
+
+@event.listens_for(User, 'after_delete')
+def _forget_deleted_user_statistics(mapper, connection, target):
+    """削除されたユーザーの統計をインデックスから除外"""
+    weekly_stats_index.forget_user(target.id)
+    weekly_timeline.forget_user(target.id)
+
+@tracer.traced('stats.work_hours')
+def calculate_work_hours_statistics(user_id=None, team_id=DEFAULT_TEAM_ID):
+    """
+    活動時間の統計を計算（週単位）
+    
+    週別労働時間の集計テーブルから差分同期した統計インデックスを参照するため、
+    出退勤記録の再スキャンや中央値計算のための再ソートは行わない。
+    全体統計は過去3ヶ月（90日）に開始した週が対象。
+    """
+    try:
+        if user_id:
+            # 本人の統計は書き込み直後でも反映されるようプライマリを参照
+            weekly_stats_index.sync(team_id)
+            return weekly_stats_index.user_summary(team_id, user_id)
+        # 全体統計はレプリカがプライマリに追いついている場合のみレプリカを参照
+        weekly_stats_index.sync(team_id, session=replica_router.read_session(team_id, max_lag=0))
+        return weekly_stats_index.overall_summary(team_id)
         
     except Exception as e:
         logger.error(f"Error calculating statistics: {e}")
@@ -377,34 +848,25 @@ def calculate_work_hours_statistics(user_id=None):
             'weekly_hours': [],
             'average_hours': 0,
             'median_hours': 0,
+            'p90_hours': 0,
             'total_weeks': 0,
             'total_hours': 0
         }
 
-def get_all_users_work_hours():
-    """全ユーザーの総労働時間を取得"""
+@tracer.traced('stats.all_users_work_hours')
+def get_all_users_work_hours(team_id=DEFAULT_TEAM_ID):
+    """ワークスペースの全ユーザーの総労働時間を取得"""
     try:
-        users = User.query.all()
-        user_work_data = []
-        
-        for user in users:
-            # 各ユーザーの出退勤記録を取得
-            attendances = Attendance.query.filter_by(user_id=user.id).order_by(Attendance.timestamp).all()
-            
-            if not attendances:
-                user_work_data.append({
-                    'user': user,
-                    'total_hours': 0
-                })
-                continue
-            
-            # 出退勤記録から総労働時間を計算（日跨ぎ対応）
-            total_hours = calculate_work_hours_from_records(attendances)
-            
-            user_work_data.append({
-                'user': user,
-                'total_hours': round(total_hours, 2)
-            })
+        read_db = replica_router.read_session(team_id)
+        users = read_db.query(User).filter_by(team_id=team_id).all()
+        # 事前計算済みの累積労働時間に、それ以降の記録（未来の日時の記録を含む全記録）だけを加算
+        snapshots, records_by_user = load_records_after_snapshots(
+            read_db, team_id, [user.id for user in users], None
+        )
+        user_work_data = [
+            {'user': user, 'total_hours': cumulative_hours_from(snapshots.get(user.id), records_by_user.get(user.id, []))}
+            for user in users
+        ]
         
         return sorted(user_work_data, key=lambda x: x['total_hours'], reverse=True)
     
@@ -412,8 +874,9 @@ def get_all_users_work_hours():
         logger.error(f"Error getting all users work hours: {e}")
         return []
 
-def get_period_work_hours(start_date=None, end_date=None):
-    """指定期間の全ユーザーの労働時間を取得"""
+@tracer.traced('stats.period_work_hours')
+def get_period_work_hours(start_date=None, end_date=None, team_id=DEFAULT_TEAM_ID, read_db=None):
+    """指定期間のワークスペースの全ユーザーの労働時間を取得（既定でリードレプリカを参照）"""
     try:
         if start_date and end_date:
             # 指定された期間を使用（日本時間）
@@ -437,12 +900,13 @@ def get_period_work_hours(start_date=None, end_date=None):
         start_datetime = start_jst.astimezone(timezone.utc)
         end_datetime = end_jst.astimezone(timezone.utc)
         
-        users = User.query.all()
+        read_db = read_db or replica_router.read_session(team_id)
+        users = read_db.query(User).filter_by(team_id=team_id).all()
         period_work_data = []
         
         for user in users:
             # 指定期間の出退勤記録を取得
-            attendances = Attendance.query.filter(
+            attendances = read_db.query(Attendance).filter(
                 Attendance.user_id == user.id,
                 Attendance.timestamp >= start_datetime,
                 Attendance.timestamp <= end_datetime
@@ -469,8 +933,9 @@ def get_period_work_hours(start_date=None, end_date=None):
         logger.error(f"Error getting period work hours: {e}")
         return []
 
-def get_cumulative_work_hours(end_date=None):
-    """指定日までの累積労働時間を取得（配分計算用）"""
+@tracer.traced('stats.cumulative_work_hours')
+def get_cumulative_work_hours(end_date=None, team_id=DEFAULT_TEAM_ID, read_db=None):
+    """指定日までの累積労働時間を取得（配分計算用、既定でリードレプリカを参照）"""
     try:
         if end_date:
             # 指定された日まで（日本時間）
@@ -481,30 +946,16 @@ def get_cumulative_work_hours(end_date=None):
             # デフォルト：今日まで
             end_datetime = datetime.now(timezone.utc)
         
-        users = User.query.all()
-        cumulative_work_data = []
-        
-        for user in users:
-            # 指定日までの全出退勤記録を取得
-            attendances = Attendance.query.filter(
-                Attendance.user_id == user.id,
-                Attendance.timestamp <= end_datetime
-            ).order_by(Attendance.timestamp).all()
-            
-            if not attendances:
-                cumulative_work_data.append({
-                    'user': user,
-                    'cumulative_hours': 0
-                })
-                continue
-            
-            # 出退勤記録から累積労働時間を計算（日跨ぎ対応）
-            cumulative_hours = calculate_work_hours_from_records(attendances)
-            
-            cumulative_work_data.append({
-                'user': user,
-                'cumulative_hours': round(cumulative_hours, 2)
-            })
+        read_db = read_db or replica_router.read_session(team_id)
+        users = read_db.query(User).filter_by(team_id=team_id).all()
+        # 事前計算済みの累積労働時間に、それ以降の記録だけを加算
+        snapshots, records_by_user = load_records_after_snapshots(
+            read_db, team_id, [user.id for user in users], end_datetime
+        )
+        cumulative_work_data = [
+            {'user': user, 'cumulative_hours': cumulative_hours_from(snapshots.get(user.id), records_by_user.get(user.id, []))}
+            for user in users
+        ]
         
         return sorted(cumulative_work_data, key=lambda x: x['cumulative_hours'], reverse=True)
     
@@ -512,59 +963,51 @@ def get_cumulative_work_hours(end_date=None):
         logger.error(f"Error getting cumulative work hours: {e}")
         return []
 
-def calculate_revenue_distribution(revenue, start_date=None, end_date=None):
-    """収益に基づいて労働時間比率で配分を計算（累積労働時間ベース、時給は対象期間労働時間ベース）"""
+# 決算ページの労働時間ベクトル（期間ごと、データバージョンが変わるまで再計算しない）
+hour_vector_cache = HourVectorCache()
+
+def _accounting_range(start_date=None, end_date=None):
+    """決算の対象期間（UTC）と累積労働時間の集計終了日時（UTC）を取得"""
+    if start_date and end_date:
+        # 指定された期間を使用（日本時間）
+        start_jst = JST_TZ.localize(datetime.fromisoformat(start_date))
+        end_jst = JST_TZ.localize(datetime.fromisoformat(end_date)).replace(hour=23, minute=59, second=59)
+        cumulative_end = end_jst.astimezone(timezone.utc)
+    else:
+        # デフォルト：今月（日本時間）、累積は現在まで
+        now_jst = datetime.now(JST_TZ)
+        start_jst = JST_TZ.localize(datetime(now_jst.year, now_jst.month, 1))
+        if now_jst.month == 12:
+            next_month_jst = JST_TZ.localize(datetime(now_jst.year + 1, 1, 1))
+        else:
+            next_month_jst = JST_TZ.localize(datetime(now_jst.year, now_jst.month + 1, 1))
+        end_jst = next_month_jst - timedelta(seconds=1)
+        cumulative_end = datetime.now(timezone.utc)
+    return (start_jst.astimezone(timezone.utc), end_jst.astimezone(timezone.utc)), cumulative_end
+
+def get_hour_vector(start_date=None, end_date=None, team_id=DEFAULT_TEAM_ID):
+    """
+    対象期間の参加者別労働時間（累積・期間）を取得
+
+    出退勤記録のスキャンは (開始日, 終了日) ごとに1回で、データバージョンが変わるまでキャッシュする。
+    収益額や配分方法を変えた再計算ではスキャンしない。
+    """
+    version = get_data_version(team_id)
+
+    def build():
+        period_range, cumulative_end = _accounting_range(start_date, end_date)
+        # データバージョン単位でキャッシュするため、追いついたレプリカのみ参照
+        read_db = replica_router.read_session(team_id, max_lag=0)
+        return build_hour_vector(read_db, team_id, version, start_date, end_date,
+                                 period_range, cumulative_end, calculate_work_hours_from_records)
+
+    return hour_vector_cache.get_or_build(team_id, start_date, end_date, version, build)
+
+def calculate_revenue_distribution(revenue, start_date=None, end_date=None, team_id=DEFAULT_TEAM_ID,
+                                   weighting='cumulative', rounding='round'):
+    """収益に基づいて労働時間比率で配分を計算（既定は累積労働時間ベース、時給は対象期間労働時間ベース）"""
     try:
-        # 累積労働時間データを取得（配分計算用）
-        cumulative_work_data = get_cumulative_work_hours(end_date)
-        # 対象期間の労働時間データを取得（時給計算用）
-        period_work_data = get_period_work_hours(start_date, end_date)
-        
-        # 対象期間の労働時間をユーザーIDでマッピング
-        period_hours_map = {data['user'].id: data['period_hours'] for data in period_work_data}
-        
-        # 累積総労働時間を計算（配分用）
-        total_cumulative_hours = sum(data['cumulative_hours'] for data in cumulative_work_data if data['cumulative_hours'] > 0)
-        
-        if total_cumulative_hours == 0:
-            return {
-                'total_revenue': revenue,
-                'total_cumulative_hours': 0,
-                'distributions': [],
-                'period_info': {
-                    'start_date': start_date,
-                    'end_date': end_date
-                }
-            }
-        
-        # 各ユーザーへの配分を計算
-        distributions = []
-        for data in cumulative_work_data:
-            if data['cumulative_hours'] > 0:
-                # 累積労働時間に基づく配分率
-                work_ratio = data['cumulative_hours'] / total_cumulative_hours
-                allocated_amount = revenue * work_ratio
-                
-                # 対象期間の労働時間を取得
-                period_hours = period_hours_map.get(data['user'].id, 0)
-                
-                distributions.append({
-                    'user': data['user'],
-                    'cumulative_hours': data['cumulative_hours'],  # 累積労働時間（配分用）
-                    'period_hours': period_hours,                  # 対象期間労働時間（時給計算用）
-                    'work_ratio': round(work_ratio * 100, 2),      # パーセンテージ
-                    'allocated_amount': round(allocated_amount, 0)  # 整数に丸める
-                })
-        
-        return {
-            'total_revenue': revenue,
-            'total_cumulative_hours': round(total_cumulative_hours, 2),  # 累積総労働時間
-            'distributions': distributions,
-            'period_info': {
-                'start_date': start_date,
-                'end_date': end_date
-            }
-        }
+        return distribute(get_hour_vector(start_date, end_date, team_id), revenue, weighting, rounding)
     
     except Exception as e:
         logger.error(f"Error calculating revenue distribution: {e}")
@@ -578,7 +1021,8 @@ def calculate_revenue_distribution(revenue, start_date=None, end_date=None):
             }
         }
 
-def get_currently_working_members():
+@tracer.traced('stats.currently_working_members')
+def get_currently_working_members(team_id=DEFAULT_TEAM_ID):
     """
     現在出勤中のメンバーを取得する関数
     """
@@ -590,41 +1034,94 @@ def get_currently_working_members():
         # UTC時間に変換
         start_datetime = start_jst.astimezone(timezone.utc)
         
-        # 今日の出退勤記録を取得
-        attendances = Attendance.query.filter(
+        # 共有メモリ上の表を参照できる場合はデータベースに問い合わせない（今日出勤したユーザーのみ）
+        members = presence_table.members(team_id)
+        if members is not None:
+            start_naive = start_datetime.replace(tzinfo=None)
+            return select_currently_working(
+                (user, '出勤', checkin_time) for user, checkin_time in members if checkin_time >= start_naive)
+        
+        # 今日の出退勤記録を取得（描画結果をキャッシュするため、追いついたレプリカのみ参照）
+        read_db = replica_router.read_session(team_id, max_lag=0)
+        attendances = read_db.query(Attendance).filter(
+            Attendance.team_id == team_id,
             Attendance.timestamp >= start_datetime
         ).order_by(Attendance.timestamp.desc()).all()
         
-        # ユーザーごとの最新の出退勤状況を追跡
-        user_status = {}
-        
-        for attendance in attendances:
-            user_id = attendance.user_id
-            if user_id not in user_status:
-                user_status[user_id] = {
-                    'last_type': attendance.type,
-                    'timestamp': attendance.timestamp,
-                    'user': attendance.user
-                }
-        
-        # 現在出勤中のメンバーを抽出
-        currently_working = []
-        for user_id, status in user_status.items():
-            if status['last_type'] == '出勤':
-                currently_working.append({
-                    'user': status['user'],
-                    'checkin_time': status['timestamp']
-                })
-        
-        # 出勤時刻順にソート
-        currently_working.sort(key=lambda x: x['checkin_time'])
-        
-        return currently_working
+        return select_currently_working((a.user, a.type, a.timestamp) for a in attendances)
     
     except Exception as e:
         logger.error(f"Error getting currently working members: {e}")
         return []
 
+def select_currently_working(latest_first):
+    """
+    新しい順の出退勤記録から現在出勤中のメンバーを抽出（打刻漏れとみなす古い出勤は除外）
+
+    Args:
+        latest_first: 新しい順の (ユーザー, 種別, 日時) の列
+    """
+    # ユーザーごとの最新の出退勤状況を追跡
+    user_status = {}
+    for user, kind, timestamp in latest_first:
+        if user.id not in user_status:
+            user_status[user.id] = (user, kind, timestamp)
+    
+    cutoff = open_session_cutoff().replace(tzinfo=None)
+    currently_working = [
+        {'user': user, 'checkin_time': timestamp}
+        for user, kind, timestamp in user_status.values()
+        if kind == '出勤' and timestamp.replace(tzinfo=None) >= cutoff
+    ]
+    
+    # 出勤時刻順にソート
+    currently_working.sort(key=lambda x: x['checkin_time'])
+    return currently_working
+
+# 全ユーザー共通フラグメントの描画関数（フラグメントキャッシュのミス時のみ実行）
+def render_overall_statistics(team_id):
+    """全社統計カードを描画"""
+    try:
+        overall_statistics = calculate_work_hours_statistics(team_id=team_id)  # 全体統計
+    except Exception as e:
+        logger.error(f"Error calculating overall statistics: {e}")
+        overall_statistics = {'average_hours': 0, 'median_hours': 0, 'p90_hours': 0, 'total_hours': 0, 'total_weeks': 0}
+    return render_template('_overall_statistics.html', overall_statistics=overall_statistics)
+
+def render_currently_working(team_id):
+    """現在出勤中のメンバーのパネルを描画"""
+    try:
+        currently_working = get_currently_working_members(team_id)
+    except Exception as e:
+        logger.error(f"Error getting currently working members: {e}")
+        currently_working = []
+    return render_template('_currently_working.html', currently_working=currently_working)
+
+def render_admin_statistics(team_id):
+    """管理者画面の全体統計カードを描画"""
+    try:
+        statistics_data = calculate_work_hours_statistics(team_id=team_id)
+    except Exception as e:
+        logger.error(f"Error calculating admin statistics: {e}")
+        statistics_data = {'average_hours': 0, 'median_hours': 0, 'p90_hours': 0, 'total_hours': 0, 'total_weeks': 0}
+    return render_template('_admin_statistics.html', statistics=statistics_data)
+
+def render_admin_user_list(team_id):
+    """管理者画面の登録ユーザー一覧を描画"""
+    # ワークスペースの全ユーザーの情報を取得（ユーザー一覧表示用）
+    read_db = replica_router.read_session(team_id, max_lag=0)
+    users = read_db.query(User).filter_by(team_id=team_id).all()
+    
+    # 各ユーザーの最新の出退勤記録を取得
+    users_with_last_attendance = []
+    for u in users:
+        last_attendance = read_db.query(Attendance).filter_by(user_id=u.id).order_by(Attendance.timestamp.desc()).first()
+        users_with_last_attendance.append({
+            'user': u,
+            'last_attendance': last_attendance
+        })
+    return render_template('_admin_user_list.html', users_with_last_attendance=users_with_last_attendance)
+
 # Webアプリケーションのルート
 @app.route('/')
 def index():
@@ -633,7 +1130,8 @@ def index():
         return redirect(url_for('login'))
     
     try:
-        user = User.query.get(session['user_id'])
+        # ログイン中のユーザー（キャッシュ済みの場合はDBを参照しない）
+        user = current_principal()
         if not user:
             session.clear()
             return redirect(url_for('login'))
@@ -655,11 +1153,7 @@ def index():
                 end_datetime = end_jst.astimezone(timezone.utc)
                 
                 # 指定期間内の出退勤記録を取得
-                attendances = Attendance.query.filter(
-                    Attendance.user_id == user.id,
-                    Attendance.timestamp >= start_datetime,
-                    Attendance.timestamp <= end_datetime
-                ).order_by(Attendance.timestamp.desc()).all()
+                attendances = get_attendances_in_range(user.team_id, user.id, start_datetime, end_datetime)
                 
                 formatted_start_date = start_jst.strftime('%Y-%m-%d')
                 formatted_end_date = end_jst.strftime('%Y-%m-%d')
@@ -678,45 +1172,39 @@ def index():
             end_datetime = end_jst.astimezone(timezone.utc)
             
             # 今日の出退勤記録を取得
-            attendances = Attendance.query.filter(
-                Attendance.user_id == user.id,
-                Attendance.timestamp >= start_datetime,
-                Attendance.timestamp <= end_datetime
-            ).order_by(Attendance.timestamp.desc()).all()
+            attendances = get_attendances_in_range(user.team_id, user.id, start_datetime, end_datetime)
             
             formatted_start_date = today_jst.strftime('%Y-%m-%d')
             formatted_end_date = today_jst.strftime('%Y-%m-%d')
         
         # 管理者権限チェック用
-        admin_user_id = os.environ.get('ADMIN_USER_ID')
+        admin_user_id = workspace_admin_id(user.team_id)
         
         # 統計情報を計算（エラーハンドリング強化）
         try:
-            personal_statistics = calculate_work_hours_statistics(user.id)
+            personal_statistics = calculate_work_hours_statistics(user.id, team_id=user.team_id)
         except Exception as e:
             logger.error(f"Error calculating personal statistics: {e}")
-            personal_statistics = {'average_hours': 0, 'median_hours': 0, 'total_hours': 0, 'total_weeks': 0}
-        
-        try:
-            overall_statistics = calculate_work_hours_statistics()  # 全体統計
-        except Exception as e:
-            logger.error(f"Error calculating overall statistics: {e}")
-            overall_statistics = {'average_hours': 0, 'median_hours': 0, 'total_hours': 0, 'total_weeks': 0}
-
-        # 現在出勤中のメンバーを取得
-        try:
-            currently_working = get_currently_working_members()
-        except Exception as e:
-            logger.error(f"Error getting currently working members: {e}")
-            currently_working = []
+            personal_statistics = {'average_hours': 0, 'median_hours': 0, 'p90_hours': 0, 'total_hours': 0, 'total_weeks': 0}
+        
+        # 全社統計と出勤中メンバーはデータバージョン単位でキャッシュした描画結果を使用
+        data_version = get_data_version(user.team_id)
+        today_key = datetime.now(JST_TZ).date().isoformat()
+        overall_statistics_html = fragment_cache.get_or_render(
+            user.team_id, 'overall_statistics', data_version,
+            lambda: render_overall_statistics(user.team_id), extra_key=today_key)
+        # 出勤中のメンバーは共有メモリ上の表の世代もキーに含める（他のワーカーのコミット直後の表の更新前に描画した結果を使わない）
+        currently_working_html = fragment_cache.get_or_render(
+            user.team_id, 'currently_working', data_version,
+            lambda: render_currently_working(user.team_id), extra_key=f'{today_key}:{presence_table.generation()}')
 
         return render_template('index.html', 
                              user=user, 
                              attendances=attendances, 
                              admin_user_id=admin_user_id,
                              personal_statistics=personal_statistics,
-                             overall_statistics=overall_statistics,
-                             currently_working=currently_working,
+                             overall_statistics_html=overall_statistics_html,
+                             currently_working_html=currently_working_html,
                              start_date=formatted_start_date,
                              end_date=formatted_end_date)
     except Exception as e:
@@ -727,7 +1215,7 @@ def index():
 @app.route('/', methods=['POST'])
 def handle_slack_events():
     """Slackイベントを処理（ルートパス）"""
-    return handler.handle(request)
+    return get_slack_handler().handle(request)
 
 @app.route('/login')
 def login():
@@ -736,7 +1224,7 @@ def login():
         return redirect(url_for('index'))
     
     # Modern Sign in with Slack (OpenID Connect) のURL
-    client_id = os.environ.get('SLACK_CLIENT_ID')
+    client_id = slack_client_id
     # OpenID Connect スコープ: openid（必須）, profile（ユーザー名・チーム情報）, email（メールアドレス）
     scope = 'openid profile email'
     redirect_uri = url_for('callback', _external=True)
@@ -748,6 +1236,8 @@ def login():
 @app.route('/callback')
 def callback():
     """Slack認証後のコールバック（Modern Sign in with Slack - OpenID Connect）"""
+    import requests
+
     code = request.args.get('code')
     error = request.args.get('error')
     
@@ -766,14 +1256,15 @@ def callback():
         token_url = "https://slack.com/api/openid.connect.token"
         
         token_data = {
-            'client_id': os.environ.get('SLACK_CLIENT_ID'),
-            'client_secret': os.environ.get('SLACK_CLIENT_SECRET'),
+            'client_id': slack_client_id,
+            'client_secret': slack_client_secret,
             'code': code,
             'grant_type': 'authorization_code',
             'redirect_uri': url_for('callback', _external=True)
         }
         
-        response = requests.post(token_url, data=token_data)
+        with tracer.span('http.client', **{'http.url': token_url}):
+            response = requests.post(token_url, data=token_data)
         token_response = response.json()
         
         if not token_response.get('ok', False):
@@ -793,7 +1284,8 @@ def callback():
         user_info_url = "https://slack.com/api/openid.connect.userInfo"
         headers = {'Authorization': f'Bearer {access_token}'}
         
-        user_response = requests.get(user_info_url, headers=headers)
+        with tracer.span('http.client', **{'http.url': user_info_url}):
+            user_response = requests.get(user_info_url, headers=headers)
         user_data = user_response.json()
         
         if not user_data.get('ok', False):
@@ -805,30 +1297,36 @@ def callback():
         slack_user_id = user_data.get('sub')  # OpenID Connect標準のsubject ID
         user_name = user_data.get('name', 'Unknown User')
         user_email = user_data.get('email', '')
-        team_id = user_data.get('https://slack.com/team_id')
+        team_id = resolve_team_id(user_data.get('https://slack.com/team_id'))
         
         if not slack_user_id:
             logger.error("Slack user ID not found in response")
             flash('ユーザーIDの取得に失敗しました。', 'error')
             return redirect(url_for('login'))
         
+        if team_id is None:
+            logger.error(f"Login from unregistered workspace: {user_data.get('https://slack.com/team_id')}")
+            flash('このワークスペースは登録されていません。', 'error')
+            return redirect(url_for('login'))
+        
         # ユーザーを取得または作成
-        user = User.query.filter_by(slack_user_id=slack_user_id).first()
+        user = User.query.filter_by(team_id=team_id, slack_user_id=slack_user_id).first()
         
         if not user:
             user = User(
+                team_id=team_id,
                 slack_user_id=slack_user_id,
                 display_name=user_name,
                 email=user_email
             )
             db.session.add(user)
-            db.session.commit()
+            commit_write(team_id)
             logger.info(f"Created new user: {slack_user_id}")
         else:
             # 既存ユーザーの情報を更新
             user.display_name = user_name
             user.email = user_email
-            db.session.commit()
+            commit_write(team_id)
             logger.info(f"Updated user info: {slack_user_id}")
         
         # セッションに保存
@@ -860,7 +1358,8 @@ def logout():
 @app.route('/attendance/add', methods=['POST'])
 def add_attendance():
     """出退勤記録の新規追加"""
-    if 'user_id' not in session:
+    user = current_principal()
+    if not user:
         return jsonify({'error': 'ログインが必要です'}), 401
     
     try:
@@ -882,13 +1381,14 @@ def add_attendance():
         
         # 新規出退勤記録を作成
         attendance = Attendance(
-            user_id=session['user_id'],
+            team_id=user.team_id,
+            user_id=user.id,
             type=data['type'],
             timestamp=timestamp
         )
         
         db.session.add(attendance)
-        db.session.commit()
+        commit_write(user.team_id)
         
         return jsonify({'message': '記録を追加しました', 'attendance': attendance.to_dict()})
     except Exception as e:
@@ -898,7 +1398,7 @@ def add_attendance():
 @app.route('/attendance/update/<int:id>', methods=['POST'])
 def update_attendance(id):
     """出退勤記録の更新"""
-    if 'user_id' not in session:
+    if not current_principal():
         return jsonify({'error': 'ログインが必要です'}), 401
     
     try:
@@ -913,6 +1413,8 @@ def update_attendance(id):
         data = request.get_json()
         
         if 'type' in data:
+            if data['type'] not in ['出勤', '退勤']:
+                return jsonify({'error': '種別は「出勤」または「退勤」である必要があります'}), 400
             attendance.type = data['type']
         
         if 'timestamp' in data:
@@ -925,7 +1427,7 @@ def update_attendance(id):
                 return jsonify({'error': '日時の形式が正しくありません'}), 400
         
         attendance.updated_at = datetime.now(timezone.utc)
-        db.session.commit()
+        commit_write(attendance.team_id)
         
         return jsonify({'message': '更新しました', 'attendance': attendance.to_dict()})
     except Exception as e:
@@ -935,7 +1437,7 @@ def update_attendance(id):
 @app.route('/attendance/delete/<int:id>', methods=['DELETE'])
 def delete_attendance(id):
     """出退勤記録の削除"""
-    if 'user_id' not in session:
+    if not current_principal():
         return jsonify({'error': 'ログインが必要です'}), 401
     
     try:
@@ -948,13 +1450,65 @@ def delete_attendance(id):
             return jsonify({'error': '権限がありません'}), 403
         
         db.session.delete(attendance)
-        db.session.commit()
+        commit_write(attendance.team_id)
         
         return jsonify({'message': '削除しました'})
     except Exception as e:
         logger.error(f"Error deleting attendance: {e}")
         return jsonify({'error': '削除中にエラーが発生しました'}), 500
 
+@app.route('/timeline')
+def weekly_timeline_api():
+    """
+    ユーザー別の週次労働時間の時系列（グラフ用）
+
+    パラメータ: user_id（複数指定可、省略時は本人。本人以外は管理者のみ）、
+               start_date / end_date（YYYY-MM-DD、省略時は直近52週）
+    """
+    user = current_principal()
+    if not user:
+        return jsonify({'error': 'ログインが必要です'}), 401
+    
+    user_ids = request.args.getlist('user_id', type=int) or [user.id]
+    if len(user_ids) > TIMELINE_MAX_USERS:
+        return jsonify({'error': f'ユーザーは{TIMELINE_MAX_USERS}人まで指定できます'}), 400
+    if not user.is_admin and any(user_id != user.id for user_id in user_ids):
+        return jsonify({'error': '権限がありません'}), 403
+    
+    try:
+        end_date = request.args.get('end_date')
+        end = datetime.fromisoformat(end_date).date() if end_date else datetime.now(JST_TZ).date()
+        start_date = request.args.get('start_date')
+        start = datetime.fromisoformat(start_date).date() if start_date else end - timedelta(weeks=52)
+    except ValueError:
+        return jsonify({'error': '日付の形式が正しくありません'}), 400
+    
+    # 週の開始日（月曜日）に揃える
+    start_week = week_of_offset(week_offset(start))
+    end_week = week_of_offset(week_offset(end))
+    if start_week > end_week or week_offset(end_week) - week_offset(start_week) >= TIMELINE_MAX_WEEKS:
+        return jsonify({'error': f'期間は{TIMELINE_MAX_WEEKS}週以内で指定してください'}), 400
+    
+    try:
+        if user_ids != [user.id]:
+            # 他のワークスペースのユーザーは参照不可
+            found = {u.id for u in User.query.filter(User.team_id == user.team_id, User.id.in_(user_ids))}
+            if found != set(user_ids):
+                return jsonify({'error': 'ユーザーが見つかりません'}), 404
+        
+        def build():
+            weekly_timeline.sync(user.team_id, session=replica_router.read_session(user.team_id, max_lag=0))
+            series = weekly_timeline.series(user.team_id, user_ids, start_week, end_week)
+            return {
+                'start_week': start_week.isoformat(),
+                'end_week': end_week.isoformat(),
+                'series': {str(user_id): values for user_id, values in series.items()}
+            }
+        return versioned_json(user.team_id, user.id, build)
+    except Exception as e:
+        logger.error(f"Error getting weekly timeline: {e}")
+        return jsonify({'error': 'データの取得中にエラーが発生しました'}), 500
+
 @app.route('/admin')
 def admin():
     """管理者用の全ユーザー出退勤一覧ページ"""
@@ -962,13 +1516,13 @@ def admin():
         return redirect(url_for('login'))
     
     try:
-        # 管理者チェック
-        user = User.query.get(session['user_id'])
-        admin_user_id = os.environ.get('ADMIN_USER_ID')
+        # 管理者チェック（キャッシュ済みの場合はDBを参照しない）
+        user = current_principal()
         
-        if not user or user.slack_user_id != admin_user_id:
+        if not user or not user.is_admin:
             flash('管理者権限が必要です。', 'error')
             return redirect(url_for('index'))
+        admin_user_id = workspace_admin_id(user.team_id)
         
         # 今日の全ユーザーの出退勤記録を取得（日本時間）
         today_jst = datetime.now(JST_TZ).date()
@@ -979,34 +1533,26 @@ def admin():
         start_datetime = start_jst.astimezone(timezone.utc)
         end_datetime = end_jst.astimezone(timezone.utc)
         
-        attendances = db.session.query(Attendance, User).join(User).filter(
+        attendances = replica_router.read_session(user.team_id).query(Attendance, User).join(User).filter(
+            Attendance.team_id == user.team_id,
             Attendance.timestamp >= start_datetime,
             Attendance.timestamp <= end_datetime
         ).order_by(Attendance.timestamp.desc()).all()
         
-        # 全ユーザーの情報を取得（ユーザー一覧表示用）
-        users = User.query.all()
-        
-        # 各ユーザーの最新の出退勤記録を取得
-        users_with_last_attendance = []
-        for u in users:
-            last_attendance = Attendance.query.filter_by(user_id=u.id).order_by(Attendance.timestamp.desc()).first()
-            users_with_last_attendance.append({
-                'user': u,
-                'last_attendance': last_attendance
-            })
-        
-        # 全体の統計情報を計算（エラーハンドリング強化）
-        try:
-            statistics_data = calculate_work_hours_statistics()
-        except Exception as e:
-            logger.error(f"Error calculating admin statistics: {e}")
-            statistics_data = {'average_hours': 0, 'median_hours': 0, 'total_hours': 0, 'total_weeks': 0}
+        # 全体統計とユーザー一覧はデータバージョン単位でキャッシュした描画結果を使用
+        data_version = get_data_version(user.team_id)
+        today_key = today_jst.isoformat()
+        statistics_html = fragment_cache.get_or_render(
+            user.team_id, 'admin_statistics', data_version,
+            lambda: render_admin_statistics(user.team_id), extra_key=today_key)
+        user_list_html = fragment_cache.get_or_render(
+            user.team_id, 'admin_user_list', data_version,
+            lambda: render_admin_user_list(user.team_id))
         
         return render_template('admin.html', 
                              attendances=attendances,
-                             users_with_last_attendance=users_with_last_attendance,
-                             statistics=statistics_data,
+                             statistics_html=statistics_html,
+                             user_list_html=user_list_html,
                              admin_user_id=admin_user_id)
     except Exception as e:
         logger.error(f"Error in admin route: {e}")
@@ -1020,17 +1566,17 @@ def admin_user_detail(user_id):
         return redirect(url_for('login'))
     
     try:
-        # 管理者チェック
-        admin_user = User.query.get(session['user_id'])
-        admin_user_id = os.environ.get('ADMIN_USER_ID')
+        # 管理者チェック（キャッシュ済みの場合はDBを参照しない）
+        admin_user = current_principal()
         
-        if not admin_user or admin_user.slack_user_id != admin_user_id:
+        if not admin_user or not admin_user.is_admin:
             flash('管理者権限が必要です。', 'error')
             return redirect(url_for('index'))
+        admin_user_id = workspace_admin_id(admin_user.team_id)
         
-        # 対象ユーザーを取得
-        target_user = User.query.get(user_id)
-        if not target_user:
+        # 対象ユーザーを取得（他のワークスペースのユーザーは参照不可）
+        target_user = db.session.get(User, user_id)
+        if not target_user or target_user.team_id != admin_user.team_id:
             flash('ユーザーが見つかりません。', 'error')
             return redirect(url_for('admin'))
         
@@ -1061,18 +1607,19 @@ def admin_user_detail(user_id):
             start_datetime = start_jst.astimezone(timezone.utc)
         
         # 指定期間内のユーザーの出退勤記録を取得
-        attendances = Attendance.query.filter(
-            Attendance.user_id == user_id,
-            Attendance.timestamp >= start_datetime,
-            Attendance.timestamp <= end_datetime
-        ).order_by(Attendance.timestamp.desc()).all()
+        attendances = get_attendances_in_range(target_user.team_id, user_id, start_datetime, end_datetime)
+        
+        # データ品質スキャンで検出された記録（記録ごとの問題の種類）
+        issues_by_attendance = defaultdict(list)
+        for issue in AttendanceIssue.query.filter_by(team_id=target_user.team_id, user_id=user_id):
+            issues_by_attendance[issue.attendance_id].append(ISSUE_KINDS[issue.kind])
         
         # 個別ユーザーの統計情報を計算
         try:
-            user_statistics = calculate_work_hours_statistics(user_id)
+            user_statistics = calculate_work_hours_statistics(user_id, team_id=target_user.team_id)
         except Exception as e:
             logger.error(f"Error calculating user statistics: {e}")
-            user_statistics = {'average_hours': 0, 'median_hours': 0, 'total_hours': 0, 'total_weeks': 0}
+            user_statistics = {'average_hours': 0, 'median_hours': 0, 'p90_hours': 0, 'total_hours': 0, 'total_weeks': 0}
         
         # 期間指定のフォーマット（日本時間で表示）
         if start_date and end_date:
@@ -1086,6 +1633,7 @@ def admin_user_detail(user_id):
                              target_user=target_user,
                              attendances=attendances,
                              user_statistics=user_statistics,
+                             issues_by_attendance=issues_by_attendance,
                              start_date=formatted_start_date,
                              end_date=formatted_end_date,
                              admin_user_id=admin_user_id)
@@ -1094,6 +1642,47 @@ def admin_user_detail(user_id):
         flash('データの取得中にエラーが発生しました。', 'error')
         return redirect(url_for('admin'))
 
+@app.route('/admin/data-quality')
+def admin_data_quality():
+    """管理者用のデータ品質ページ（定期スキャンで検出された出退勤記録の一覧）"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    try:
+        admin_user = current_principal()
+        
+        if not admin_user or not admin_user.is_admin:
+            flash('管理者権限が必要です。', 'error')
+            return redirect(url_for('index'))
+        admin_user_id = workspace_admin_id(admin_user.team_id)
+        
+        # 種類の指定（未指定時は全種類）、新しい記録から最大500件
+        kind = request.args.get('kind')
+        if kind not in ISSUE_KINDS:
+            kind = None
+        query = db.session.query(AttendanceIssue, User).join(User, User.id == AttendanceIssue.user_id).filter(
+            AttendanceIssue.team_id == admin_user.team_id)
+        if kind:
+            query = query.filter(AttendanceIssue.kind == kind)
+        issues = []
+        for issue, user in query.order_by(AttendanceIssue.timestamp.desc()).limit(500):
+            # ユーザー詳細ページで対象の記録の前後（長時間の勤務は退勤まで）を表示する期間
+            day = issue.timestamp.replace(tzinfo=timezone.utc).astimezone(JST_TZ).date()
+            days_after = int((issue.hours or 0) // 24) + 1
+            issues.append((issue, user, (day - timedelta(days=1)).isoformat(),
+                           (day + timedelta(days=days_after)).isoformat()))
+        
+        return render_template('admin_data_quality.html',
+                             issues=issues,
+                             summary=issue_summary(admin_user.team_id),
+                             issue_kinds=ISSUE_KINDS,
+                             kind=kind,
+                             admin_user_id=admin_user_id)
+    except Exception as e:
+        logger.error(f"Error in admin_data_quality route: {e}")
+        flash('データの取得中にエラーが発生しました。', 'error')
+        return redirect(url_for('admin'))
+
 @app.route('/admin/accounting', methods=['GET', 'POST'])
 def admin_accounting():
     """管理者用決算ページ"""
@@ -1101,13 +1690,13 @@ def admin_accounting():
         return redirect(url_for('login'))
     
     try:
-        # 管理者チェック
-        user = User.query.get(session['user_id'])
-        admin_user_id = os.environ.get('ADMIN_USER_ID')
+        # 管理者チェック（キャッシュ済みの場合はDBを参照しない）
+        user = current_principal()
         
-        if not user or user.slack_user_id != admin_user_id:
+        if not user or not user.is_admin:
             flash('管理者権限が必要です。', 'error')
             return redirect(url_for('index'))
+        admin_user_id = workspace_admin_id(user.team_id)
         
         # 期間パラメータを取得
         start_date = request.form.get('start_date') or request.args.get('start_date')
@@ -1126,25 +1715,38 @@ def admin_accounting():
             last_day = (next_month - timedelta(days=1)).day
             end_date = f"{now_jst.year}-{now_jst.month:02d}-{last_day:02d}"
         
+        # 配分方法（配分基準・丸め方）
+        weighting = request.form.get('weighting', 'cumulative')
+        rounding = request.form.get('rounding', 'round')
+        if weighting not in WEIGHTINGS or rounding not in ROUNDINGS:
+            flash('配分方法の指定が正しくありません。', 'error')
+            weighting, rounding = 'cumulative', 'round'
+        
+        # 参加者別の労働時間（期間ごとにキャッシュ、収益額を変えた再計算ではスキャンしない）
+        hour_vector = get_hour_vector(start_date, end_date, user.team_id)
+        
         # POSTリクエストの場合（収益計算実行）
         calculated_data = None
         if request.method == 'POST':
             try:
                 revenue = float(request.form.get('revenue', 0))
-                if revenue <= 0:
+                if not math.isfinite(revenue) or revenue <= 0:
                     flash('正の収益額を入力してください。', 'error')
                 else:
-                    calculated_data = calculate_revenue_distribution(revenue, start_date, end_date)
+                    calculated_data = distribute(hour_vector, revenue, weighting, rounding)
                     flash('収益配分を計算しました。', 'success')
             except ValueError:
                 flash('正しい数値を入力してください。', 'error')
         
-        # 累積労働時間データを取得（表示用）
-        user_work_data = get_cumulative_work_hours(end_date)
+        # 累積労働時間データ（表示用）
+        user_work_data = hour_vector.cumulative_work_data()
         
         return render_template('admin_accounting.html',
                              user_work_data=user_work_data,
                              calculated_data=calculated_data,
+                             hour_vector=hour_vector.to_payload(),
+                             weighting=weighting,
+                             rounding=rounding,
                              admin_user_id=admin_user_id,
                              start_date=start_date,
                              end_date=end_date)
@@ -1153,54 +1755,348 @@ def admin_accounting():
         flash('データの取得中にエラーが発生しました。', 'error')
         return redirect(url_for('admin'))
 
+@app.route('/admin/accounting/hours')
+def admin_accounting_hours():
+    """管理者用：対象期間の参加者別労働時間（クライアント側での配分シミュレーション用のJSON）"""
+    user = current_principal()
+    if not user:
+        return jsonify({'error': 'ログインが必要です'}), 401
+    if not user.is_admin:
+        return jsonify({'error': '管理者権限が必要です'}), 403
+    
+    try:
+        return versioned_json(user.team_id, user.id, lambda: get_hour_vector(
+            request.args.get('start_date'), request.args.get('end_date'), user.team_id).to_payload())
+    except ValueError:
+        return jsonify({'error': '日付の形式が正しくありません'}), 400
+    except Exception as e:
+        logger.error(f"Error getting accounting hours: {e}")
+        return jsonify({'error': 'データの取得中にエラーが発生しました'}), 500
+
+@app.route('/admin/accounting/scenarios', methods=['POST'])
+def admin_accounting_scenarios():
+    """
+    管理者用：複数の収益額・配分方法の配分をまとめて計算
+
+    リクエスト: {"start_date": "...", "end_date": "...",
+                 "scenarios": [{"revenue": 1000000, "weighting": "cumulative", "rounding": "round"}, ...]}
+    """
+    user = current_principal()
+    if not user:
+        return jsonify({'error': 'ログインが必要です'}), 401
+    if not user.is_admin:
+        return jsonify({'error': '管理者権限が必要です'}), 403
+    
+    try:
+        data = request.get_json()
+        scenarios = data.get('scenarios') if data else None
+        if not scenarios:
+            return jsonify({'error': 'シナリオを指定してください'}), 400
+        
+        hour_vector = get_hour_vector(data.get('start_date'), data.get('end_date'), user.team_id)
+        try:
+            results = evaluate_scenarios(hour_vector, scenarios)
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'シナリオの指定が正しくありません'}), 400
+        
+        payload = hour_vector.to_payload()
+        return jsonify({
+            'version': payload['version'],
+            'start_date': payload['start_date'],
+            'end_date': payload['end_date'],
+            'users': payload['users'],
+            'results': results
+        })
+    except ValueError:
+        return jsonify({'error': '日付の形式が正しくありません'}), 400
+    except Exception as e:
+        logger.error(f"Error evaluating accounting scenarios: {e}")
+        return jsonify({'error': '計算中にエラーが発生しました'}), 500
+
 # Slack イベントエンドポイント
 @app.route('/slack/events', methods=['POST'])
 def slack_events():
     """Slack イベントを処理"""
-    return handler.handle(request)
+    return get_slack_handler().handle(request)
 
 # ヘルスチェックエンドポイント（デプロイ最適化）
+# readiness の疎通確認は専用接続で行い、結果を一定間隔キャッシュする
+readiness_probe = ReadinessProbe()
+
+@app.route('/health/live')
+def liveness_check():
+    """ライブネスチェック（プロセスが応答できるかのみ確認、DBには接続しない）"""
+    return jsonify({'status': 'alive'}), 200
+
 @app.route('/health')
+@app.route('/health/ready')
 def health_check():
-    """ヘルスチェックエンドポイント"""
+    """レディネスチェック（キャッシュ済みのDB疎通確認とプール・キューの状況）"""
     try:
-        # データベース接続確認
-        db.session.execute('SELECT 1')
-        return jsonify({'status': 'healthy', 'database': 'connected'}), 200
+        healthy, database_status = readiness_probe.check(
+            db.engine.url,
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('connect_args')
+        )
+        body = {
+            'status': 'healthy' if healthy else 'unhealthy',
+            **database_status,
+            'pool': pool_status(db.engine),
+            'queues': queue_depths()
+        }
+        return jsonify(body), 200 if healthy else 503
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 503
 
+@app.route('/admin/diagnostics')
+def admin_diagnostics():
+    """管理者用：応答したワーカープロセスの各機能の内部状況（認証なしの /health には含めない）"""
+    user = current_principal()
+    if not user:
+        return jsonify({'error': 'ログインが必要です'}), 401
+    if not user.is_admin:
+        return jsonify({'error': '管理者権限が必要です'}), 403
+    
+    try:
+        return jsonify({
+            'pid': os.getpid(),
+            'replica': replica_router.status(),
+            'attendance_range_cache': attendance_range_cache.stats(),
+            'outbox': outbox_dispatcher.stats(),
+            'home_tab': home_publisher.stats(),
+            'slash_commands': slash_responder.stats(),
+            'slack_outbound': slack_sender.stats(),
+            'punch_batch': punch_batcher.stats(),
+            'sqlite_writer': single_writer.stats(),
+            'compression': response_compressor.stats(),
+            'static_assets': static_assets.stats(),
+            'presence_table': presence_table.stats(),
+            'tracing': {'enabled': tracer.enabled, 'exported': tracer.exporter.exported if tracer.exporter else 0}
+        }), 200
+    except Exception as e:
+        logger.error(f"Error getting diagnostics: {e}")
+        return jsonify({'error': 'データの取得中にエラーが発生しました'}), 500
+
 # Favicon エンドポイント（404エラー対策）
 @app.route('/favicon.ico')
 def favicon():
     """Faviconエンドポイント（404エラー対策）"""
     return '', 204
 
+# 性能の計測コマンド（flask bench <名前>）
+app.cli.add_command(bench_cli)
+
 # データベース初期化コマンド
 @app.cli.command()
 def init_db():
     """データベースを初期化"""
     try:
         db.create_all()
+        run_migrations()
+        for team_id in WORKSPACES:
+            ensure_data_version(team_id)
+        mark_schema_current()
         logger.info('データベースが初期化されました。')
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
         raise
 
+# 集計の事前計算コマンド（夜間のcronなどから実行）
+@app.cli.command('precompute-aggregates')
+@click.option('--full', is_flag=True, help='事前計算済みの値を使わずに全記録から計算し直す')
+def precompute_aggregates_command(full):
+    """累積労働時間を当日の開始時点まで事前計算して集計テーブルに保存"""
+    for team_id, stats in precompute_aggregates(full=full).items():
+        click.echo(f"{team_id}: {stats}")
+
+# 出退勤記録の列指向ファイルへの書き出しコマンド
+@app.cli.command('export-attendance')
+@click.option('--team-id', default=None, help='ワークスペースID（省略時は全ワークスペース）')
+@click.option('--include-current', is_flag=True, help='当月（記録が増え続ける月）も書き出す')
+@click.option('--export-dir', default=None, help='書き出し先（省略時は ATTENDANCE_EXPORT_DIR）')
+def export_attendance_command(team_id, include_current, export_dir):
+    """出退勤記録・出勤〜退勤の組を月別のParquetファイルに書き出す（新しい月と変更のあった月のみ）"""
+    for team, stats in export_attendance([team_id] if team_id else None, include_current, export_dir).items():
+        click.echo(f"{team}: wrote {len(stats['written'])} months ({', '.join(stats['written']) or '-'}), "
+                   f"unchanged {stats['unchanged']}, rows {stats['rows']}, sessions {stats['sessions']}")
+
+# 書き出したファイルによるオフライン集計コマンド
+@app.cli.command('offline-hours')
+@click.option('--team-id', default=DEFAULT_TEAM_ID, help='ワークスペースID')
+@click.option('--export-dir', default=None, help='書き出し先（省略時は ATTENDANCE_EXPORT_DIR）')
+@click.option('--start-date', required=True, help='期間の開始日（YYYY-MM-DD、日本時間）')
+@click.option('--end-date', required=True, help='期間の終了日（YYYY-MM-DD、日本時間、累積労働時間の基準日）')
+@click.option('--compare', is_flag=True, help='データベースでの集計結果と比較する（データベースに接続）')
+def offline_hours_command(team_id, export_dir, start_date, end_date, compare):
+    """書き出したファイルだけで期間・累積の労働時間を集計（データベースに接続しない）"""
+    started = time.perf_counter()
+    analytics = OfflineAnalytics(export_dir or attendance_export_dir, team_id)
+    start_datetime = JST_TZ.localize(datetime.fromisoformat(start_date)).astimezone(timezone.utc)
+    end_datetime = JST_TZ.localize(datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59)).astimezone(timezone.utc)
+    period = analytics.period_work_hours(start_datetime, end_datetime)
+    cumulative = analytics.cumulative_work_hours(end_datetime)
+    elapsed = (time.perf_counter() - started) * 1000
+    months = analytics.months
+    if not months or end_date[:7] > months[-1]:
+        click.echo(f"warning: exported months end at {months[-1] if months else '-'} (run flask export-attendance)")
+    period_by_user = {row['user'].id: row['period_hours'] for row in period}
+    for row in cumulative:
+        click.echo(f"{row['user'].display_name}: period {period_by_user[row['user'].id]}h, "
+                   f"cumulative {row['cumulative_hours']}h")
+    click.echo(f"offline: {len(cumulative)} users, {elapsed:.1f}ms")
+    if compare:
+        started = time.perf_counter()
+        online_period = {row['user'].id: row['period_hours'] for row in get_period_work_hours(start_date, end_date, team_id)}
+        online_cumulative = {row['user'].id: row['cumulative_hours'] for row in get_cumulative_work_hours(end_date, team_id)}
+        elapsed = (time.perf_counter() - started) * 1000
+        offline_cumulative = {row['user'].id: row['cumulative_hours'] for row in cumulative}
+        click.echo(f"database: {elapsed:.1f}ms, period match: {online_period == period_by_user}, "
+                   f"cumulative match: {online_cumulative == offline_cumulative}")
+
+@app.cli.command('trace-summary')
+@click.option('--file', 'path', default=None, help='スパンの出力ファイル（省略時は TRACE_FILE または instance/traces.jsonl）')
+@click.option('--root', 'root_name', default=None, help='集計するトレースの起点（例: /slack/events）')
+def trace_summary_command(path, root_name):
+    """出力したスパンをリクエストの種類ごとに集計（p50・p95と、1リクエストあたりの区間別の平均時間）"""
+    path = path or (tracer.exporter.path if tracer.exporter else None)
+    if not path or not os.path.exists(path):
+        click.echo(f"trace file not found: {path} (set TRACING_ENABLED=true and TRACE_EXPORTER=file)")
+        return
+    for name, entry in summarize_traces(path, root_name).items():
+        click.echo(f"{name}: {entry['count']} traces, p50 {entry['p50_ms']}ms, p95 {entry['p95_ms']}ms")
+        for child, average_ms in entry['children'].items():
+            click.echo(f"  {child}: {average_ms}ms")
+
+@app.cli.command('scan-data-quality')
+@click.option('--team-id', default=None, help='ワークスペースID（省略時は全ワークスペース）')
+@click.option('--full', is_flag=True, help='前回のスキャン結果を使わずに全記録を読み込む')
+def scan_data_quality_command(team_id, full):
+    """出退勤記録の問題（出勤の重複・出勤のない退勤・長時間の勤務・未来/過去の打刻）を検出して保存"""
+    results = {team_id: scan_data_quality(team_id, full=full)} if team_id else scan_all_data_quality(full=full)
+    for team, stats in results.items():
+        click.echo(f"{team}: {stats}")
+        for kind, count in issue_summary(team)['counts'].items():
+            click.echo(f"  {kind}: {count}")
+
+# 週別労働時間の再構築コマンド
+@app.cli.command('rebuild-weekly-hours')
+def rebuild_weekly_hours_command():
+    """全出退勤記録から週別労働時間の集計テーブルを作り直す"""
+    count = rebuild_weekly_hours(calculate_work_hours_from_records)
+    weekly_timeline.reset()
+    click.echo(f"{count} weekly rows rebuilt")
+
+# 打刻漏れスイープの手動実行コマンド
+@app.cli.command('sweep-open-sessions')
+@click.option('--policy', type=click.Choice(['mark', 'close']), default=None, help='対応方針（省略時は OPEN_SESSION_POLICY）')
+@click.option('--notify/--no-notify', default=True, help='Slackで本人に通知する')
+def sweep_open_sessions_command(policy, notify):
+    """退勤打刻漏れを検出して処理"""
+    count = sweep_open_sessions(slack_sender if notify else None, policy=policy)
+    if notify:
+        slack_sender.flush()
+    click.echo(f"{count} open sessions processed")
+
+def is_schema_current():
+    """保存済みのスキーマバージョンが現在のモデル定義と一致するか確認"""
+    try:
+        marker = db.session.get(SchemaVersion, 1)
+        return marker is not None and marker.version == compute_schema_version()
+    except Exception:
+        # 目印テーブルが未作成の場合など
+        db.session.rollback()
+        return False
+
+def mark_schema_current():
+    """現在のスキーマバージョンを目印として保存"""
+    marker = db.session.get(SchemaVersion, 1)
+    if marker is None:
+        marker = SchemaVersion(id=1, version=compute_schema_version())
+        db.session.add(marker)
+    else:
+        marker.version = compute_schema_version()
+    db.session.commit()
+
+# 定期ジョブ（いずれか1つのワーカーでのみ実行）
+scheduler = PeriodicScheduler(app)
+if os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true':
+    scheduler.add_job('open_session_sweep',
+                      float(os.environ.get('OPEN_SESSION_SWEEP_INTERVAL', 900)),
+                      lambda: sweep_open_sessions(slack_sender))
+    # 日付が変わった後の最初の実行で前日分までを加算（それ以外の実行は無効化されたユーザーのみ計算）
+    precompute_interval = float(os.environ.get('PRECOMPUTE_INTERVAL', 3600))
+    if precompute_interval > 0:
+        scheduler.add_job('precompute_aggregates', precompute_interval, precompute_aggregates, run_at_start=True)
+    # 出退勤記録のデータ品質スキャン（変更イベントの保持期間内に実行すれば変更のあったユーザーのみ読み込む）
+    data_quality_interval = float(os.environ.get('DATA_QUALITY_SCAN_INTERVAL', 3600))
+    if data_quality_interval > 0:
+        scheduler.add_job('data_quality_scan', data_quality_interval, scan_all_data_quality)
+    scheduler.add_job('prune_outbox', 3600, prune_outbox)
+    # 出勤中のユーザーの共有メモリ上の表の再構築（アプリ外でのデータベースの変更の反映）
+    if presence_table.enabled:
+        scheduler.add_job('rebuild_presence', float(os.environ.get('PRESENCE_REBUILD_INTERVAL', 3600)),
+                          rebuild_presence_table)
+    # 出退勤記録の列指向ファイルへの定期的な書き出し（ATTENDANCE_EXPORT_INTERVAL 秒ごと、既定は無効）
+    export_interval = float(os.environ.get('ATTENDANCE_EXPORT_INTERVAL', 0))
+    if export_interval > 0:
+        scheduler.add_job('export_attendance', export_interval, export_attendance)
+
+def start_background_jobs():
+    """ワーカープロセスでの初期化（preload時に作成された接続の破棄と定期ジョブの開始）"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+    replica_router.dispose()
+    scheduler.start()
+    outbox_dispatcher.start()
+
 # アプリケーション初期化関数
+_app_initialized = False
+
 def create_app():
-    """アプリケーションファクトリー関数"""
+    """アプリケーションファクトリー関数（複数回呼ばれても初期化は一度だけ）"""
+    global _app_initialized
+    if _app_initialized:
+        return app
+    
     try:
         with app.app_context():
-            # データベーステーブルの作成（存在しない場合のみ）
-            db.create_all()
-            logger.info("Database tables created/verified successfully")
+            if is_schema_current():
+                # スキーマが最新の場合はテーブル確認を省略
+                logger.info("Schema version marker matched, skipping table verification")
+            else:
+                # データベーステーブルの作成（存在しない場合のみ）
+                db.create_all()
+                # 既存テーブルへのカラム・インデックス追加（ワークスペースIDなど）
+                run_migrations()
+                if db.session.query(WeeklyHours.id).first() is None and db.session.query(Attendance.id).first() is not None:
+                    # 週別労働時間の集計テーブルを初回導入時に作成
+                    logger.info(f"Weekly hours backfilled: {rebuild_weekly_hours(calculate_work_hours_from_records)} rows")
+                mark_schema_current()
+                logger.info("Database tables created/verified successfully")
+            # SLACK_WORKSPACES に後から追加されたワークスペースの行はスキーマが最新でも作成
+            # （行がないとデータバージョンが増えず、キャッシュ・ETag が更新されない）
+            for team_id in WORKSPACES:
+                ensure_data_version(team_id)
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         # データベース接続エラーでもアプリケーションは起動を続行
         pass
     
+    if presence_table.enabled:
+        # preload 時はマスタープロセスで構築し、fork した全ワーカーが同じ表を参照
+        try:
+            with app.app_context():
+                logger.info(f"Presence table rebuilt: {rebuild_presence_table()} members")
+        except Exception as e:
+            # 構築できない場合は次の定期実行まで各ワーカーがデータベースから取得
+            logger.error(f"Failed to rebuild presence table: {e}")
+            presence_table.invalidate()
+    
+    if not fast_startup:
+        # 通常モードではSlackアプリを起動時に生成（トークン検証を含む）
+        get_slack_app()
+    
+    _app_initialized = True
     return app
 
 # Gunicorn用の初期化（本番環境）
@@ -1210,9 +2106,11 @@ if __name__ != '__main__':
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
     create_app()
+    logger.info(f"Application loaded in {(time.perf_counter() - _import_started_at) * 1000:.1f}ms")
 
 if __name__ == '__main__':
     # 開発環境での直接実行
     create_app()
+    start_background_jobs()
     port = int(os.environ.get('PORT', 5000))  # PORT環境変数を使用
-    app.run(debug=True, host='0.0.0.0', port=port) 
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=port) 
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from datetime import datetime, timezone
+from models import db, User, Attendance, WeeklyHours
+from weekly_stats import week_start_of
+from background_worker import BackgroundWorker
+from timezones import JST_TZ
+
+logger = logging.getLogger(__name__)
+
+# ホームタブに表示する直近の打刻数
+HOME_RECENT_PUNCHES = 5
+
+def _jst(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(JST_TZ)
+
+def build_home_summary(user, now=None):
+    """
+    ホームタブの表示内容（今日の状況・今週の労働時間・直近の打刻）を取得
+
+    今週の労働時間は週別労働時間の集計テーブル（weekly_hours）の値を使い、出退勤記録からは再計算しない。
+    """
+    now = now or datetime.now(timezone.utc)
+    today_start = JST_TZ.localize(datetime.combine(_jst(now).date(), datetime.min.time())).astimezone(timezone.utc)
+    recent = Attendance.query.filter(
+        Attendance.team_id == user.team_id,
+        Attendance.user_id == user.id
+    ).order_by(Attendance.timestamp.desc()).limit(HOME_RECENT_PUNCHES).all()
+    week_hours = db.session.query(WeeklyHours.hours).filter_by(
+        team_id=user.team_id, user_id=user.id, week_start=week_start_of(now)
+    ).scalar()
+    # 直近の打刻のうち今日の最新の記録で今日の状況を判定
+    latest_today = next((a for a in recent if _jst(a.timestamp) >= today_start), None)
+    return {
+        'display_name': user.display_name,
+        'status': latest_today.type if latest_today else None,
+        'status_at': _jst(latest_today.timestamp).strftime('%H:%M') if latest_today else None,
+        'week_hours': round(week_hours or 0, 2),
+        'recent': [(_jst(a.timestamp).strftime('%m/%d %H:%M'), a.type) for a in recent]
+    }
+
+def build_home_view(summary):
+    """ホームタブのビュー（Block Kit）を生成"""
+    if summary['status'] == '出勤':
+        status = f"🌅 出勤中（{summary['status_at']}〜）"
+    elif summary['status'] == '退勤':
+        status = f"🌙 退勤済み（{summary['status_at']}）"
+    else:
+        status = "まだ出勤していません"
+    recent = '\n'.join(f"• {at} {kind}" for at, kind in summary['recent']) or '打刻はまだありません'
+    return {
+        'type': 'home',
+        'blocks': [
+            {'type': 'header', 'text': {'type': 'plain_text', 'text': f"{summary['display_name']} さんの出退勤"}},
+            {'type': 'section', 'fields': [
+                {'type': 'mrkdwn', 'text': f"*今日の状況*\n{status}"},
+                {'type': 'mrkdwn', 'text': f"*今週の労働時間*\n{summary['week_hours']}時間"}
+            ]},
+            {'type': 'divider'},
+            {'type': 'section', 'text': {'type': 'mrkdwn', 'text': f"*直近の打刻*\n{recent}"}},
+            {'type': 'context', 'elements': [
+                {'type': 'mrkdwn', 'text': 'DMで「出勤」「退勤」と送信すると打刻できます。記録の修正はWeb画面から行えます。'}
+            ]}
+        ]
+    }
+
+class HomeTabPublisher:
+    """
+    ユーザーごとのホームタブ（views.publish）の更新キュー
+
+    出退勤記録の変更をコミットしたワーカーが該当ユーザーの更新を予約し、最後の予約から HOME_PUBLISH_DEBOUNCE 秒
+    （既定2秒）後に1回だけ公開する（連続する打刻は1回の公開にまとめる。予約が続く場合も最初の予約から
+    その5倍の時間までに公開）。前回公開したビューと同じ内容の場合は公開しない。
+    ホームタブを開いたユーザーは、このワーカーで公開済みでない場合のみ公開する。
+
+    公開スレッドはプロセス（gunicornワーカー）ごとに初回の予約時に起動する。
+    """
+
+    def __init__(self, app, client_factory, debounce=None):
+        self.app = app
+        self.client_factory = client_factory
+        self.debounce = debounce if debounce is not None else float(os.environ.get('HOME_PUBLISH_DEBOUNCE', 2.0))
+        self.max_delay = self.debounce * 5
+        self._cond = threading.Condition()
+        self._due = {}          # (team_id, user_id) -> (公開予定時刻, 最初の予約時刻)
+        self._opened = set()    # ホームタブを開いた未解決のユーザー (team_id, slack_user_id)
+        self._published = {}    # (team_id, slack_user_id) -> 公開したビューのハッシュ
+        self._in_flight = 0
+        self._worker = BackgroundWorker(self._run, 'home-tab-publisher')
+        self.published = 0
+        self.unchanged = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def schedule(self, team_id, user_id):
+        """ユーザーのホームタブの更新を予約（予約済みの場合は公開予定時刻を延長）"""
+        now = time.monotonic()
+        with self._cond:
+            key = (team_id, user_id)
+            first = now
+            if key in self._due:
+                self.coalesced += 1
+                first = self._due[key][1]
+            self._due[key] = (min(now + self.debounce, first + self.max_delay), first)
+            self._worker.ensure_started()
+            self._cond.notify()
+
+    def on_commit(self, events):
+        """コミットされた出退勤記録の変更イベントのユーザーの更新を予約"""
+        for team_id, user_id in {(change.team_id, change.user_id) for change in events}:
+            self.schedule(team_id, user_id)
+
+    def opened(self, team_id, slack_user_id):
+        """ホームタブが開かれた（このワーカーで公開済みの場合は何もしない、DBを参照しない）"""
+        with self._cond:
+            if (team_id, slack_user_id) in self._published:
+                return False
+            self._opened.add((team_id, slack_user_id))
+            self._worker.ensure_started()
+            self._cond.notify()
+        return True
+
+    def qsize(self):
+        with self._cond:
+            return len(self._due) + len(self._opened)
+
+    def flush(self, timeout=10):
+        """予約済みの公開がなくなるまで待機（テスト・終了処理用、公開予定時刻を待たずに公開）"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._due = {key: (0, first) for key, (_, first) in self._due.items()}
+            self._cond.notify()
+            while self._due or self._opened or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._due) + len(self._opened),
+                'published': self.published,
+                'unchanged': self.unchanged,
+                'coalesced': self.coalesced,
+                'failed': self.failed
+            }
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due = [key for key, (at, _) in self._due.items() if at <= now]
+                if due or self._opened:
+                    for key in due:
+                        del self._due[key]
+                    opened, self._opened = self._opened, set()
+                    self._in_flight += 1
+                    return due, opened
+                wait = min((at for at, _ in self._due.values()), default=None)
+                self._cond.wait(None if wait is None else wait - now)
+
+    def _run(self):
+        while True:
+            due, opened = self._next_batch()
+            try:
+                with self.app.app_context():
+                    try:
+                        users = [db.session.get(User, user_id) for _, user_id in due]
+                        for team_id, slack_user_id in opened:
+                            users.append(User.query.filter_by(team_id=team_id, slack_user_id=slack_user_id).first())
+                        for user in {user.id: user for user in users if user is not None}.values():
+                            self._publish(user)
+                    except Exception as e:
+                        logger.error(f"Error building home tabs: {e}")
+                    finally:
+                        db.session.remove()
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _publish(self, user):
+        from slack_sdk.errors import SlackApiError
+
+        view = build_home_view(build_home_summary(user))
+        digest = hashlib.sha1(json.dumps(view, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+        key = (user.team_id, user.slack_user_id)
+        with self._cond:
+            if self._published.get(key) == digest:
+                self.unchanged += 1
+                return
+        try:
+            self.client_factory(user.team_id).views_publish(user_id=user.slack_user_id, view=view)
+            with self._cond:
+                self._published[key] = digest
+                self.published += 1
+        except SlackApiError as e:
+            with self._cond:
+                self._published.pop(key, None)
+                self.failed += 1
+            logger.error(f"Error publishing home tab for {user.slack_user_id}: {e}")
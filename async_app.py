@@ -0,0 +1,298 @@
+import os
+import re
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app import (app as flask_app, create_app, start_background_jobs, message_team_id, presence_text,
+                 select_currently_working, profile_from_user_info, default_profile, precompute_boundary,
+                 without_bolt_env_defaults, handle_app_home_opened, handle_attendance_command,
+                 SLASH_COMMAND, PRESENCE_PATTERN, HELP_TEXT, JST_TZ)
+from models import db, User, Attendance
+from cache import data_version_bump_statement
+from workspaces import MULTI_WORKSPACE, WORKSPACES, resolve_team_id
+
+logger = logging.getLogger(__name__)
+
+# Slackイベントを受け付けるパス（Flask側の /slack/events・POST / と同じ）
+SLACK_EVENT_PATHS = ('/slack/events', '/')
+
+def async_database_url(url):
+    """同期用のデータベースURLを asyncio 用のドライバーのURLに変換"""
+    if url.drivername.startswith('postgresql'):
+        return url.set(drivername='postgresql+asyncpg')
+    if url.drivername.startswith('sqlite'):
+        return url.set(drivername='sqlite+aiosqlite')
+    raise ValueError(f"Unsupported database for asyncio: {url.drivername}")
+
+class AsyncDatabase:
+    """
+    Flask アプリケーションと同じデータベースへの asyncio 用セッション
+
+    SQLite はデータベース単位のロックのため、並行する書き込みはロック待ちと再試行で遅くなる。
+    SQLite の場合は書き込みトランザクションをプロセス内で直列化する（読み取りは並行）。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.session = async_sessionmaker(engine, expire_on_commit=False)
+        self.serialize_writes = engine.dialect.name == 'sqlite'
+        self._write_lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def writing(self):
+        """書き込み用のセッション（SQLite の場合は他の書き込みの完了を待つ）"""
+        if self.serialize_writes:
+            async with self._write_lock, self.session() as session:
+                yield session
+        else:
+            async with self.session() as session:
+                yield session
+
+def create_async_database():
+    """Flask アプリケーションの設定から asyncio 用のデータベースを作成"""
+    with flask_app.app_context():
+        # SQLiteの相対パスは Flask-SQLAlchemy が instance フォルダ基準に解決したURLを使う
+        url = async_database_url(db.engine.url)
+    if url.drivername.startswith('postgresql'):
+        engine = create_async_engine(
+            url,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            pool_size=int(os.environ.get('ASYNC_DB_POOL_SIZE', 10)),
+            max_overflow=20,
+            pool_timeout=30,
+            connect_args={'ssl': 'require', 'timeout': 30}
+        )
+    else:
+        engine = create_async_engine(url, connect_args={'timeout': 30})
+    return AsyncDatabase(engine)
+
+async def fetch_slack_profile_async(client, slack_user_id):
+    """Slack APIからユーザーの表示名とメールアドレスを取得（取得できない場合は None）"""
+    from slack_sdk.errors import SlackApiError
+
+    try:
+        response = await client.users_info(user=slack_user_id)
+        if not response.get('ok'):
+            logger.error(f"Slack API error: {response.get('error')}")
+            return None
+        return profile_from_user_info(response['user'])
+    except SlackApiError as e:
+        logger.error(f"Error fetching user info: {e}")
+        return default_profile(slack_user_id)
+
+async def record_punch_async(database, client, team_id, slack_user_id, kind):
+    """
+    打刻を記録して確定した打刻時刻を返す（ユーザー情報を取得できない場合は None）
+
+    未登録ユーザーのプロフィール取得（Slack API）は書き込みトランザクションの外で行う。
+    """
+    query = select(User.id).where(User.team_id == team_id, User.slack_user_id == slack_user_id)
+    profile = None
+    async with database.session() as session:
+        user_id = await session.scalar(query)
+    if user_id is None:
+        profile = await fetch_slack_profile_async(client, slack_user_id)
+        if profile is None:
+            return None
+
+    async with database.writing() as session:
+        if user_id is None:
+            user = User(team_id=team_id, slack_user_id=slack_user_id,
+                        display_name=profile['display_name'], email=profile['email'])
+            try:
+                async with session.begin_nested():
+                    session.add(user)
+                user_id = user.id
+                logger.info(f"Created new user: {slack_user_id}")
+            except IntegrityError:
+                # 同じユーザーの打刻が並行して届き、先に作成された場合
+                user_id = await session.scalar(query)
+        timestamp = datetime.now(timezone.utc)
+        session.add(Attendance(team_id=team_id, user_id=user_id, type=kind, timestamp=timestamp))
+        await session.execute(data_version_bump_statement(team_id))
+        # 週別労働時間などのコミット時のイベントは同期用のセッションと同様に実行される
+        await session.commit()
+        return timestamp
+
+async def get_currently_working_members_async(database, team_id):
+    """現在出勤中のメンバーを取得（当日の記録のみ参照）"""
+    async with database.session() as session:
+        rows = await session.execute(
+            select(User, Attendance.type, Attendance.timestamp)
+            .join(Attendance, Attendance.user_id == User.id)
+            .where(Attendance.team_id == team_id, Attendance.timestamp >= precompute_boundary())
+            .order_by(Attendance.timestamp.desc())
+        )
+        return select_currently_working(rows.all())
+
+class AsyncSlackClientPool:
+    """ワークスペースごとの auth.test 結果を保持し、AsyncApp の authorize 関数として使用するプール"""
+
+    def __init__(self, client):
+        self.client = client
+        self._auth_results = {}
+
+    async def authorize(self, enterprise_id, team_id, logger):
+        from slack_bolt.authorization import AuthorizeResult
+
+        workspace_id = resolve_team_id(team_id)
+        if workspace_id is None:
+            logger.warning(f"Event from unregistered workspace: {team_id}")
+            return None
+        result = self._auth_results.get(workspace_id)
+        if result is None:
+            token = WORKSPACES[workspace_id].bot_token
+            result = AuthorizeResult.from_auth_test_response(
+                auth_test_response=await self.client.auth_test(token=token),
+                bot_token=token
+            )
+            self._auth_results[workspace_id] = result
+        return result
+
+def build_async_slack_app(database):
+    """asyncio 版の Slack Bolt アプリケーションを生成してイベントリスナーを登録"""
+    from slack_bolt.async_app import AsyncApp
+    from slack_sdk.web.async_client import AsyncWebClient
+    from slack_sdk.http_retry.builtin_async_handlers import AsyncRateLimitErrorRetryHandler
+
+    # SLACK_API_BASE_URL でローカルの疑似Slackサーバーなどに差し替え可能
+    client = AsyncWebClient(
+        token=None if MULTI_WORKSPACE else os.environ.get('SLACK_BOT_TOKEN'),
+        base_url=os.environ.get('SLACK_API_BASE_URL', AsyncWebClient.BASE_URL),
+        retry_handlers=[AsyncRateLimitErrorRetryHandler(max_retry_count=3)]
+    )
+    with without_bolt_env_defaults():
+        if MULTI_WORKSPACE:
+            # 複数ワークスペース運用時はイベントのチームIDからボットトークンを選択
+            slack_app = AsyncApp(
+                client=client,
+                authorize=AsyncSlackClientPool(client).authorize,
+                signing_secret=os.environ.get('SLACK_SIGNING_SECRET')
+            )
+        else:
+            # AsyncApp は auth.test を初回イベント受信時に実行する
+            slack_app = AsyncApp(
+                client=client,
+                signing_secret=os.environ.get('SLACK_SIGNING_SECRET')
+            )
+
+    async def handle_punch(message, say, context, client, kind):
+        team_id = message_team_id(message, context)
+        if team_id is None:
+            logger.warning(f"Ignored {kind} from unregistered workspace: {message.get('team')}")
+            return
+        user_id = message['user']
+        try:
+            timestamp = await record_punch_async(database, client, team_id, user_id, kind)
+            if timestamp is None:
+                logger.error(f"Failed to get or create user: {user_id}")
+                await say("申し訳ありませんが、ユーザー情報の取得に失敗しました。")
+                return
+            jst_timestamp = timestamp.astimezone(JST_TZ)
+            await say(f"{kind}打刻を受け付けました！ {jst_timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
+            logger.info(f"{kind} recorded for user: {user_id}")
+        except Exception as e:
+            logger.error(f"Error handling {kind}: {e}")
+            await say(f"申し訳ありませんが、{kind}打刻の処理中にエラーが発生しました。")
+
+    async def handle_presence(message, say, context):
+        team_id = message_team_id(message, context)
+        if team_id is None:
+            logger.warning(f"Ignored presence query from unregistered workspace: {message.get('team')}")
+            return
+        await say(presence_text(await get_currently_working_members_async(database, team_id)))
+
+    async def handle_checkin(message, say, context, client):
+        await handle_punch(message, say, context, client, '出勤')
+
+    async def handle_checkout(message, say, context, client):
+        await handle_punch(message, say, context, client, '退勤')
+
+    async def handle_help(message, say):
+        await say(HELP_TEXT)
+
+    async def handle_home_opened(event, context):
+        # 公開の予約のみ（DB・Slack APIは公開スレッドで実行）
+        handle_app_home_opened(event, context)
+
+    async def handle_command(ack, command, context):
+        # 照会は同期版と同じ処理をスレッドで実行（重い照会は応答後に response_url へ返信）
+        def answer():
+            replies = []
+            with flask_app.app_context():
+                handle_attendance_command(replies.append, command, context)
+            return replies[0]
+        await ack(await asyncio.to_thread(answer))
+
+    async def handle_app_mention(event, say):
+        text = event.get('text', '').lower()
+        if any(keyword in text for keyword in ['ヘルプ', 'help']):
+            await say(HELP_TEXT)
+        else:
+            await say("こんにちは！出退勤管理ボットです。`ヘルプ`と送信すると使い方を確認できます。")
+
+    # 同期版（app._build_slack_app）と同じ順序で登録（最初に一致したリスナーのみ実行される）
+    slack_app.message(PRESENCE_PATTERN)(handle_presence)
+    slack_app.message(re.compile(r'(出勤|おはよう)', re.IGNORECASE))(handle_checkin)
+    slack_app.message(re.compile(r'(退勤|おつかれ)', re.IGNORECASE))(handle_checkout)
+    slack_app.message(re.compile(r'(ヘルプ|help)', re.IGNORECASE))(handle_help)
+    slack_app.event("app_mention")(handle_app_mention)
+    slack_app.event("app_home_opened")(handle_home_opened)
+    slack_app.command(SLASH_COMMAND)(handle_command)
+
+    logger.info("Async Slack Bolt app initialized")
+    return slack_app
+
+class SlackAsgiApp:
+    """
+    Slackイベントを asyncio で処理し、それ以外のリクエストを Flask アプリケーションに渡すASGIアプリケーション
+
+    打刻・ユーザー解決・在席確認を AsyncApp / AsyncWebClient と SQLAlchemy の asyncio 拡張
+    （PostgreSQL は asyncpg、SQLite は aiosqlite）で処理し、1プロセスで多数のイベントを並行して処理する。
+    Flask への受け渡しには a2wsgi を使用する（未インストールの場合はSlackイベントのみ処理）。
+
+        uvicorn async_app:asgi_app --host 0.0.0.0 --port $PORT
+    """
+
+    def __init__(self, slack_app, wsgi_app):
+        from slack_bolt.adapter.asgi.async_handler import AsyncSlackRequestHandler
+
+        self.slack_handler = AsyncSlackRequestHandler(slack_app, path=SLACK_EVENT_PATHS[0])
+        try:
+            from a2wsgi import WSGIMiddleware
+            self.wsgi = WSGIMiddleware(wsgi_app)
+        except ImportError:
+            logger.warning("a2wsgi is not installed; only Slack events are served")
+            self.wsgi = None
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # テーブル確認と定期ジョブの開始（同期処理のためスレッドで実行）
+                await asyncio.to_thread(create_app)
+                await asyncio.to_thread(start_background_jobs)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in SLACK_EVENT_PATHS:
+            await self.slack_handler(dict(scope, path=SLACK_EVENT_PATHS[0]), receive, send)
+            return
+        if self.wsgi is None:
+            await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await self.wsgi(scope, receive, send)
+
+asgi_app = SlackAsgiApp(build_async_slack_app(create_async_database()), flask_app)
@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from flask import g, session
+from sqlalchemy import event
+from models import db, User
+from workspaces import get_workspace
+
+logger = logging.getLogger(__name__)
+
+def workspace_admin_id(team_id):
+    """ワークスペースの管理者のSlackユーザーID"""
+    workspace = get_workspace(team_id)
+    return workspace.admin_user_id if workspace else None
+
+@dataclass(frozen=True)
+class Principal:
+    """ログイン中のユーザー（認証済み主体）の情報"""
+    id: int
+    team_id: str
+    slack_user_id: str
+    display_name: str
+    is_admin: bool
+
+class PrincipalCache:
+    """
+    ユーザーID -> Principal の短期キャッシュ
+
+    同一プロセス内の更新・削除は SQLAlchemy のイベントで即時に無効化し、
+    他のワーカーでの変更は TTL で反映する。
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else float(os.environ.get('PRINCIPAL_CACHE_TTL', 60))
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= self.ttl:
+                del self._entries[user_id]
+                return None
+            return entry[1]
+
+    def set(self, principal):
+        with self._lock:
+            self._entries[principal.id] = (time.monotonic(), principal)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+principal_cache = PrincipalCache()
+
+def load_principal(user_id):
+    """ユーザーIDから Principal を取得（キャッシュにない場合のみDBを参照）"""
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    admin_user_id = workspace_admin_id(user.team_id)
+    principal = Principal(
+        id=user.id,
+        team_id=user.team_id,
+        slack_user_id=user.slack_user_id,
+        display_name=user.display_name,
+        is_admin=admin_user_id is not None and user.slack_user_id == admin_user_id
+    )
+    principal_cache.set(principal)
+    return principal
+
+def current_principal():
+    """現在のセッションの Principal を取得（未ログインまたはユーザー削除済みの場合は None）"""
+    if 'principal' not in g:
+        user_id = session.get('user_id')
+        g.principal = load_principal(user_id) if user_id is not None else None
+    return g.principal
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_principal(mapper, connection, target):
+    """ユーザーの更新・削除時にキャッシュを無効化"""
+    principal_cache.invalidate(target.id)
@@ -0,0 +1,22 @@
+import os
+import threading
+
+class BackgroundWorker:
+    """
+    処理を1本のデーモンスレッドで動かす
+
+    gunicorn の preload_app ではマスタープロセスで開始したスレッドが fork 後のワーカーに引き継がれないため、
+    ensure_started はプロセスが変わっていればスレッドを作り直す（呼び出し側のロック内で呼ぶ）。
+    """
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self._thread.start()
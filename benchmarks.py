@@ -0,0 +1,470 @@
+import os
+import re
+import sys
+import time
+import click
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from flask import Flask, current_app
+from flask.cli import AppGroup
+from models import db, User, Attendance
+from cache import ensure_data_version
+from health import TimedQueuePool
+from auth import workspace_admin_id
+from precompute import accumulate_work_hours
+from punch_batcher import PunchBatcher
+from slack_sender import SlackMessageSender
+from sqlite_profile import SingleWriter, install_sqlite_pragmas, sqlite_busy_timeout
+from workspaces import DEFAULT_TEAM_ID
+
+# 性能の計測コマンド（flask bench <名前>、本番の処理には含めない）
+# app の関数はコマンドの実行時に読み込む（app から登録されるため）
+bench_cli = AppGroup('bench', help='性能の計測コマンド')
+
+# 打刻集中時のスループットのベンチマークコマンド
+@bench_cli.command('punch-burst')
+@click.option('--punches', default=300, help='打刻数')
+@click.option('--users', default=60, help='ユーザー数')
+@click.option('--threads', default=30, help='同時に打刻するスレッド数')
+def bench_punch_burst(punches, users, threads):
+    """一時的なSQLiteデータベースで打刻の集中を再現し、1件ずつのコミットとグループコミットを比較"""
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from app import _record_punch_direct, _record_punch_batched
+
+    for mode in ('direct', 'group'):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bench_app = Flask(__name__)
+            bench_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+            bench_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+                'poolclass': TimedQueuePool, 'pool_size': threads, 'pool_timeout': 30
+            }
+            db.init_app(bench_app)
+            with bench_app.app_context():
+                db.create_all()
+                ensure_data_version()
+                db.session.add_all(User(slack_user_id=f'UBENCH{i:04d}', display_name=f'Bench {i}') for i in range(users))
+                db.session.commit()
+            batcher = PunchBatcher(bench_app)
+
+            def punch(i):
+                with bench_app.app_context():
+                    slack_user_id = f'UBENCH{i % users:04d}'
+                    kind = '出勤' if (i // users) % 2 == 0 else '退勤'
+                    if mode == 'direct':
+                        return _record_punch_direct(DEFAULT_TEAM_ID, slack_user_id, kind)
+                    return _record_punch_batched(DEFAULT_TEAM_ID, slack_user_id, kind, batcher)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                results = list(pool.map(punch, range(punches)))
+            elapsed = time.perf_counter() - started
+            with bench_app.app_context():
+                recorded = Attendance.query.count()
+                db.engine.dispose()
+            click.echo(f"{mode}: {punches / elapsed:.1f} punches/s ({elapsed * 1000:.1f}ms, "
+                       f"confirmed {sum(1 for r in results if r is not None)}, recorded {recorded})")
+            if mode == 'group':
+                click.echo(f"  batches: {batcher.stats()}")
+
+# 起動時間のベンチマークコマンド
+@bench_cli.command('startup')
+@click.option('--runs', default=5, help='計測回数')
+def bench_startup(runs):
+    """アプリケーションのインポート時間を計測（通常モードと起動最適化モードを比較）"""
+    import statistics
+    import subprocess
+
+    script = 'import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)'
+    for mode in ('false', 'true'):
+        env = dict(os.environ, FAST_STARTUP=mode)
+        timings = []
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, '-c', script], env=env,
+                                    capture_output=True, text=True, cwd=current_app.root_path)
+            if result.returncode != 0:
+                click.echo(f"FAST_STARTUP={mode}: import failed ({result.stderr.strip().splitlines()[-1:]})")
+                break
+            timings.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+        if timings:
+            click.echo(f"FAST_STARTUP={mode}: median {statistics.median(timings):.1f}ms "
+                       f"(min {min(timings):.1f}ms, max {max(timings):.1f}ms, runs {len(timings)})")
+
+# 出退勤記録の保存形式のベンチマークコマンド
+@bench_cli.command('attendance-storage')
+@click.option('--rows', default=200000, help='出退勤記録数')
+@click.option('--users', default=100, help='ユーザー数')
+def bench_attendance_storage(rows, users):
+    """一時的なSQLiteデータベースで旧形式（文字列の種別・日時）と変換後の形式のサイズと読み込み速度を比較"""
+    import random
+    import tempfile
+    from sqlalchemy import create_engine, select, Table, MetaData, Column, Integer, String, DateTime
+    from migrations import compact_attendance_columns
+
+    # 変換前の attendance テーブル
+    legacy_ddl = [
+        'CREATE TABLE attendance (id INTEGER NOT NULL PRIMARY KEY, team_id VARCHAR(20) DEFAULT \'default\' NOT NULL, '
+        'user_id INTEGER NOT NULL, type VARCHAR(10) NOT NULL, timestamp DATETIME, created_at DATETIME, updated_at DATETIME)',
+        'CREATE INDEX ix_attendance_team_timestamp ON attendance (team_id, timestamp)',
+        'CREATE INDEX ix_attendance_team_user_timestamp ON attendance (team_id, user_id, timestamp)',
+    ]
+    legacy_table = Table('attendance', MetaData(), Column('id', Integer, primary_key=True), Column('team_id', String),
+                         Column('user_id', Integer), Column('type', String), Column('timestamp', DateTime))
+
+    def measure(engine, table, label):
+        with engine.connect() as connection:
+            connection.exec_driver_sql('VACUUM')
+            sizes = dict(connection.exec_driver_sql(
+                "SELECT name, SUM(pgsize) FROM dbstat WHERE name LIKE '%attendance%' GROUP BY name").all())
+            # 全件の読み込みと労働時間の計算（全ユーザーの累積労働時間の再計算に相当）
+            started = time.perf_counter()
+            records_by_user = defaultdict(list)
+            for record in connection.execute(
+                    select(table.c.user_id, table.c.type, table.c.timestamp).order_by(table.c.user_id, table.c.timestamp)):
+                records_by_user[record.user_id].append(record)
+            totals = {user_id: round(accumulate_work_hours(records)[0], 6) for user_id, records in records_by_user.items()}
+            scan_ms = (time.perf_counter() - started) * 1000
+            # インデックスを使う期間の読み込み（ユーザーごとの直近30日）
+            since = datetime.now(timezone.utc) - timedelta(days=30)
+            started = time.perf_counter()
+            for user_id in range(1, users + 1):
+                connection.execute(select(table.c.type, table.c.timestamp).where(
+                    table.c.team_id == DEFAULT_TEAM_ID, table.c.user_id == user_id, table.c.timestamp >= since
+                ).order_by(table.c.timestamp)).all()
+            range_ms = (time.perf_counter() - started) * 1000
+        table_size = sizes.pop('attendance', 0)
+        click.echo(f"{label}: table {table_size / 1024:.0f}KiB, indexes {sum(sizes.values()) / 1024:.0f}KiB "
+                   f"({', '.join(f'{name} {size / 1024:.0f}KiB' for name, size in sorted(sizes.items()))}), "
+                   f"full scan {scan_ms:.1f}ms, range queries {range_ms:.1f}ms")
+        return totals
+
+    random.seed(0)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    records = []
+    for i in range(rows):
+        timestamp = now - timedelta(seconds=random.randint(0, 365 * 86400))
+        stamp = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
+        records.append((DEFAULT_TEAM_ID, i % users + 1, '出勤' if random.random() < 0.5 else '退勤', stamp, stamp, stamp))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+        with engine.begin() as connection:
+            for ddl in legacy_ddl:
+                connection.exec_driver_sql(ddl)
+            connection.exec_driver_sql(
+                'INSERT INTO attendance (team_id, user_id, type, timestamp, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', records)
+        before = measure(engine, legacy_table, 'before')
+        started = time.perf_counter()
+        changes = compact_attendance_columns(engine)
+        click.echo(f"migration: {changes} in {(time.perf_counter() - started) * 1000:.1f}ms")
+        after = measure(engine, Attendance.__table__, 'after')
+        click.echo(f"work hours match: {before == after}")
+        engine.dispose()
+
+# Slack返信キューのベンチマークコマンド
+@bench_cli.command('slack-sender')
+@click.option('--messages', default=30, help='送信するメッセージ数')
+@click.option('--channels', default=5, help='送信先チャンネル数')
+def bench_slack_sender(messages, channels):
+    """疑似Slackサーバーに対してバースト送信を行い、レート制限への対応を確認"""
+    from slack_sdk import WebClient
+    from fake_slack import FakeSlackServer
+
+    server = FakeSlackServer().start()
+    try:
+        client = WebClient(token='xoxb-fake', base_url=server.base_url)
+        sender = SlackMessageSender(lambda team_id: client)
+        started = time.perf_counter()
+        for i in range(messages):
+            sender.send(f'C{i % channels:03d}', f'message {i}', team_id=DEFAULT_TEAM_ID)
+        enqueued = time.perf_counter() - started
+        sender.flush(timeout=messages * 2)
+        elapsed = time.perf_counter() - started
+        click.echo(f"enqueue: {enqueued * 1000:.2f}ms for {messages} messages")
+        click.echo(f"delivered: {len(server.messages)}/{messages} in {elapsed:.2f}s, "
+                   f"429 responses: {server.rate_limited}, sender stats: {sender.stats()}")
+    finally:
+        server.stop()
+
+# SQLite運用設定のベンチマークコマンド
+@bench_cli.command('sqlite')
+@click.option('--workers', default=4, help='書き込み・読み取りを行うプロセス数（gunicornワーカーに相当）')
+@click.option('--threads', default=4, help='プロセスごとのスレッド数')
+@click.option('--seconds', default=5.0, help='計測時間（秒）')
+@click.option('--rows', default=50000, help='事前に登録する出退勤記録数')
+@click.option('--users', default=50, help='ユーザー数')
+@click.option('--write-ratio', default=0.2, help='操作のうち書き込み（打刻）の割合')
+def bench_sqlite(workers, threads, seconds, rows, users, write_ratio):
+    """一時的なSQLiteデータベースで複数プロセスの同時読み書きを行い、既定の設定と運用設定のスループットを比較"""
+    import random
+    import tempfile
+    import multiprocessing
+    from sqlalchemy import create_engine, select, insert
+    from sqlalchemy.exc import OperationalError
+    from concurrent.futures import ThreadPoolExecutor
+    from models import DataVersion
+    from cache import data_version_bump_statement
+
+    attendance = Attendance.__table__
+
+    def run_worker(url, profile, lock_path, seed, results):
+        # default: PRAGMAなし（ロールバックジャーナル・sqlite3 の既定のタイムアウト5秒）、書き込みの直列化なし
+        # pragmas: PRAGMAとタイムアウトのみ、production: さらに書き込みを直列化
+        tuned = profile != 'default'
+        engine = create_engine(url, connect_args={'timeout': sqlite_busy_timeout()} if tuned else {},
+                               pool_size=threads, max_overflow=0)
+        if tuned:
+            install_sqlite_pragmas(engine)
+        writer = SingleWriter(lock_path, enabled=profile == 'production')
+        deadline = time.monotonic() + seconds
+
+        def loop(index):
+            rng = random.Random(seed * 100 + index)
+            counts = {'reads': 0, 'writes': 0, 'locked': 0, 'write_ms': []}
+            while time.monotonic() < deadline:
+                user_id = rng.randint(1, users)
+                started = time.perf_counter()
+                try:
+                    if rng.random() < write_ratio:
+                        # 打刻（出退勤記録の追加とデータバージョンの増加を1トランザクションで）
+                        with writer.serialize(), engine.begin() as connection:
+                            connection.execute(insert(attendance).values(
+                                team_id=DEFAULT_TEAM_ID, user_id=user_id, type=rng.choice(('出勤', '退勤')),
+                                timestamp=datetime.now(timezone.utc), created_at=datetime.now(timezone.utc),
+                                updated_at=datetime.now(timezone.utc)))
+                            connection.execute(data_version_bump_statement(DEFAULT_TEAM_ID))
+                        counts['writes'] += 1
+                        counts['write_ms'].append((time.perf_counter() - started) * 1000)
+                    else:
+                        # 出退勤一覧の表示（ユーザーの直近30日の記録）
+                        since = datetime.now(timezone.utc) - timedelta(days=30)
+                        with engine.connect() as connection:
+                            connection.execute(select(attendance.c.type, attendance.c.timestamp).where(
+                                attendance.c.team_id == DEFAULT_TEAM_ID, attendance.c.user_id == user_id,
+                                attendance.c.timestamp >= since).order_by(attendance.c.timestamp)).all()
+                        counts['reads'] += 1
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    counts['locked'] += 1
+            return counts
+
+        with ThreadPoolExecutor(threads) as pool:
+            for counts in pool.map(loop, range(threads)):
+                results.put(counts)
+        engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    random.seed(0)
+    now = datetime.now(timezone.utc)
+    seed_rows = [
+        {'team_id': DEFAULT_TEAM_ID, 'user_id': i % users + 1, 'type': '出勤' if i % 2 == 0 else '退勤',
+         'timestamp': now - timedelta(seconds=random.randint(0, 180 * 86400)), 'created_at': now, 'updated_at': now}
+        for i in range(rows)
+    ]
+    for profile in ('default', 'pragmas', 'production'):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+            engine = create_engine(url)
+            with engine.begin() as connection:
+                db.metadata.create_all(connection, tables=[User.__table__, attendance, DataVersion.__table__])
+                connection.execute(insert(User.__table__), [
+                    {'team_id': DEFAULT_TEAM_ID, 'slack_user_id': f'UBENCH{i:04d}', 'display_name': f'Bench {i}'}
+                    for i in range(users)
+                ])
+                connection.execute(insert(DataVersion.__table__).values(team_id=DEFAULT_TEAM_ID, version=0))
+                connection.execute(insert(attendance), seed_rows)
+            engine.dispose()
+
+            results = context.Queue()
+            processes = [context.Process(target=run_worker, args=(url, profile, f"{tmpdir}/bench.db-writer.lock", i, results))
+                         for i in range(workers)]
+            started = time.perf_counter()
+            for process in processes:
+                process.start()
+            totals = {'reads': 0, 'writes': 0, 'locked': 0, 'write_ms': []}
+            for _ in range(workers * threads):
+                counts = results.get()
+                for key in totals:
+                    totals[key] += counts[key]
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - started
+            write_ms = sorted(totals['write_ms']) or [0]
+            click.echo(f"{profile}: {totals['reads'] / elapsed:.0f} reads/s, {totals['writes'] / elapsed:.0f} writes/s, "
+                       f"locked errors {totals['locked']}, write p50 {write_ms[len(write_ms) // 2]:.1f}ms "
+                       f"p99 {write_ms[int(len(write_ms) * 0.99)]:.1f}ms")
+
+# 管理者ページの再読み込みの転送量の計測コマンド
+@bench_cli.command('admin-refresh')
+@click.option('--team-id', default=DEFAULT_TEAM_ID, help='ワークスペースID（管理者ユーザーが登録済みであること）')
+@click.option('--refreshes', default=10, help='再読み込みの回数')
+def bench_admin_refresh(team_id, refreshes):
+    """管理者ページ（1分ごとに再読み込み）の初回表示と再読み込み1回あたりの転送バイト数を、圧縮・ハッシュ付きURLの有無で比較"""
+    import gzip
+    from compression import brotli
+    from app import response_compressor, static_assets
+
+    asset_pattern = re.compile(r'(?:href|src)="(/(?:static|assets)/[^"]+)"')
+
+    def decoded(response):
+        data = response.get_data()
+        if response.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        elif response.headers.get('Content-Encoding') == 'br':
+            data = brotli.decompress(data)
+        return data.decode()
+
+    def transferred(response):
+        # ステータス行・ヘッダー・本文（圧縮後）のバイト数
+        headers = sum(len(key) + len(value) + 4 for key, value in response.headers.items())
+        return len(f"HTTP/1.1 {response.status}\r\n") + headers + 2 + len(response.get_data())
+
+    with current_app.app_context():
+        admin = User.query.filter_by(team_id=team_id, slack_user_id=workspace_admin_id(team_id)).first()
+    if admin is None:
+        click.echo(f"admin user of {team_id} is not registered")
+        return
+    saved = (response_compressor.enabled, static_assets.enabled)
+    try:
+        for label, enabled in (('before', False), ('after', True)):
+            response_compressor.enabled = static_assets.enabled = enabled
+            with current_app.test_client() as client:
+                with client.session_transaction() as browser_session:
+                    browser_session['user_id'] = admin.id
+                    browser_session['slack_user_id'] = admin.slack_user_id
+                headers = {'Accept-Encoding': 'gzip, deflate, br'}
+                cache = {}  # ブラウザのキャッシュ（URL -> (ETag, Last-Modified, Cache-Control)）
+                totals = []
+                for load in range(refreshes + 1):
+                    page = client.get('/admin', headers=headers)
+                    total, requests_made = transferred(page), 1
+                    for url in asset_pattern.findall(decoded(page)):
+                        cached = cache.get(url)
+                        if cached and 'immutable' in (cached[2] or ''):
+                            continue  # 無期限キャッシュは再読み込みでも要求しない
+                        conditional = dict(headers)
+                        if cached and cached[0]:
+                            conditional['If-None-Match'] = cached[0]
+                        if cached and cached[1]:
+                            conditional['If-Modified-Since'] = cached[1]
+                        asset = client.get(url, headers=conditional)
+                        total += transferred(asset)
+                        requests_made += 1
+                        if asset.status_code == 200:
+                            cache[url] = (asset.headers.get('ETag'), asset.headers.get('Last-Modified'),
+                                          asset.headers.get('Cache-Control'))
+                        asset.close()
+                    totals.append((total, requests_made))
+            refresh_bytes = sum(total for total, _ in totals[1:]) / max(refreshes, 1)
+            refresh_requests = sum(count for _, count in totals[1:]) / max(refreshes, 1)
+            click.echo(f"{label}: first load {totals[0][0]} bytes ({totals[0][1]} requests), "
+                       f"per refresh {refresh_bytes:.0f} bytes ({refresh_requests:.0f} requests)")
+    finally:
+        response_compressor.enabled, static_assets.enabled = saved
+
+# Slackイベント処理のロードテストコマンド
+@bench_cli.command('slack-events')
+@click.option('--events', default=300, help='送信するイベント数')
+@click.option('--users', default=60, help='打刻するユーザー数')
+@click.option('--concurrency', default=30, help='同時に送信するリクエスト数')
+def bench_slack_events(events, users, concurrency):
+    """署名付きの打刻イベントを送信し、同期版（gunicorn）と asyncio 版（uvicorn）のSlackイベント処理を比較"""
+    import hashlib
+    import hmac
+    import json
+    import socket
+    import sqlite3
+    import statistics
+    import subprocess
+    import tempfile
+    import urllib.request
+    from concurrent.futures import ThreadPoolExecutor
+    from fake_slack import FakeSlackServer
+
+    signing_secret = 'bench-signing-secret'
+    server = FakeSlackServer(rate_per_channel=100, burst=100).start()
+    commands = {
+        'sync': [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', '{bind}', 'app:app'],
+        'async': [sys.executable, '-m', 'uvicorn', 'async_app:asgi_app', '--workers', '1',
+                  '--host', '127.0.0.1', '--port', '{port}', '--log-level', 'warning']
+    }
+
+    def signed_request(url, i):
+        body = json.dumps({
+            'type': 'event_callback', 'team_id': 'T000', 'api_app_id': 'ABENCH', 'event_id': f'EvBENCH{i:06d}',
+            'event': {'type': 'message', 'channel_type': 'im', 'channel': f'D{i % users:05d}', 'team': 'T000',
+                      'user': f'UBENCH{i % users:04d}', 'text': '出勤' if (i // users) % 2 == 0 else '退勤',
+                      'ts': f'{time.time():.6f}'}
+        })
+        timestamp = str(int(time.time()))
+        signature = 'v0=' + hmac.new(signing_secret.encode(), f'v0:{timestamp}:{body}'.encode(),
+                                     hashlib.sha256).hexdigest()
+        return urllib.request.Request(url, data=body.encode(), method='POST', headers={
+            'Content-Type': 'application/json',
+            'X-Slack-Request-Timestamp': timestamp,
+            'X-Slack-Signature': signature
+        })
+
+    try:
+        for mode, command in commands.items():
+            with tempfile.TemporaryDirectory() as tmpdir:
+                db_path = os.path.join(tmpdir, 'bench.db')
+                with socket.socket() as sock:
+                    sock.bind(('127.0.0.1', 0))
+                    port = sock.getsockname()[1]
+                env = {key: value for key, value in os.environ.items() if key != 'SLACK_WORKSPACES'}
+                env.update(DATABASE_URL=f'sqlite:///{db_path}', SLACK_API_BASE_URL=server.base_url,
+                           SLACK_SIGNING_SECRET=signing_secret, SLACK_BOT_TOKEN='xoxb-bench',
+                           SCHEDULER_ENABLED='false', FAST_STARTUP='true', PORT=str(port))
+                subprocess.run([sys.executable, '-c', 'from app import create_app; create_app()'],
+                               env=env, cwd=current_app.root_path, check=True, capture_output=True)
+                process = subprocess.Popen([arg.format(bind=f'127.0.0.1:{port}', port=port) for arg in command],
+                                           env=env, cwd=current_app.root_path,
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    base_url = f'http://127.0.0.1:{port}'
+                    deadline = time.monotonic() + 30
+                    while True:
+                        try:
+                            urllib.request.urlopen(f'{base_url}/health/live', timeout=1).read()
+                            break
+                        except OSError:
+                            if time.monotonic() > deadline or process.poll() is not None:
+                                raise click.ClickException(f"{mode}: server did not start")
+                            time.sleep(0.2)
+
+                    replies_before = len(server.messages)
+                    latencies = []
+
+                    def send(i):
+                        started = time.perf_counter()
+                        with urllib.request.urlopen(signed_request(f'{base_url}/slack/events', i), timeout=30) as response:
+                            response.read()
+                        latencies.append((time.perf_counter() - started) * 1000)
+
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(concurrency) as pool:
+                        list(pool.map(send, range(events)))
+                    acked = time.perf_counter() - started
+
+                    # 応答（ack）後に処理される場合があるため、全打刻の記録を待つ
+                    recorded = 0
+                    while time.perf_counter() - started < 60:
+                        with sqlite3.connect(db_path) as connection:
+                            recorded = connection.execute('SELECT COUNT(*) FROM attendance').fetchone()[0]
+                        if recorded >= events:
+                            break
+                        time.sleep(0.05)
+                    completed = time.perf_counter() - started
+                    latencies.sort()
+                    click.echo(f"{mode}: ack {events / acked:.1f} events/s, latency p50 {statistics.median(latencies):.1f}ms "
+                               f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f}ms; "
+                               f"recorded {recorded}/{events} in {completed:.2f}s "
+                               f"({recorded / completed:.1f} punches/s), replies {len(server.messages) - replies_before}")
+                finally:
+                    process.terminate()
+                    process.wait(timeout=30)
+    finally:
+        server.stop()
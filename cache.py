@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from markupsafe import Markup
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from models import db, DataVersion
+from workspaces import DEFAULT_TEAM_ID
+
+logger = logging.getLogger(__name__)
+
+def ensure_data_version(team_id=DEFAULT_TEAM_ID):
+    """ワークスペースのデータバージョンの行が存在しない場合は作成"""
+    if db.session.query(DataVersion.id).filter_by(team_id=team_id).first() is None:
+        db.session.add(DataVersion(team_id=team_id, version=0))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 同時に起動した別のプロセスが先に作成した場合
+            db.session.rollback()
+
+def get_data_version(team_id=DEFAULT_TEAM_ID):
+    """ワークスペースの現在のデータバージョンを取得（全ワーカー共通、1行の参照のみ）"""
+    try:
+        version = db.session.execute(
+            db.select(DataVersion.version).where(DataVersion.team_id == team_id)
+        ).scalar()
+        return version or 0
+    except Exception as e:
+        logger.error(f"Error reading data version: {e}")
+        db.session.rollback()
+        return None
+
+def bump_data_version(team_id=DEFAULT_TEAM_ID):
+    """
+    ワークスペースのデータバージョンを増加させる
+
+    書き込み処理の commit 前に呼び出し、同一トランザクションで反映する。
+    他のワークスペースのキャッシュには影響しない。
+    """
+    db.session.execute(data_version_bump_statement(team_id))
+
+def data_version_bump_statement(team_id=DEFAULT_TEAM_ID):
+    """データバージョンを増加させるUPDATE文（asyncio用のセッションなど db.session 以外での実行用）"""
+    return update(DataVersion).where(DataVersion.team_id == team_id).values(version=DataVersion.version + 1)
+
+class FragmentCache:
+    """
+    描画済みHTMLフラグメントのキャッシュ
+
+    キーは (ワークスペースID, フラグメント名, データバージョン, 追加キー) で、データバージョンが
+    変わると自動的に再描画される。念のため一定時間（TTL）で期限切れにする。
+    """
+
+    def __init__(self, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None else float(os.environ.get('FRAGMENT_CACHE_TTL', 300))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, team_id, name, version, render_func, extra_key=None):
+        """キャッシュ済みのフラグメントを返す（なければ render_func で描画して保存）"""
+        if version is None:
+            # バージョンが取得できない場合はキャッシュを使わない
+            return Markup(render_func())
+
+        key = (team_id, name, version, extra_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        html = Markup(render_func())
+        with self._lock:
+            self._entries[key] = (now, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        """キャッシュを全て破棄"""
+        with self._lock:
+            self._entries.clear()
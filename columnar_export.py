@@ -0,0 +1,291 @@
+import os
+import json
+import hashlib
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import func
+from models import User, Attendance
+from precompute import accumulate_work_hours
+from timezones import JST_TZ, naive_utc
+
+logger = logging.getLogger(__name__)
+
+# オフライン集計の結果のユーザー（DBの User の代わり、テンプレートと同じ属性名）
+ExportedUser = namedtuple('ExportedUser', ['id', 'slack_user_id', 'display_name', 'email'])
+ExportedRecord = namedtuple('ExportedRecord', ['type', 'timestamp'])
+
+MANIFEST = 'manifest.json'
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+    except ImportError:
+        raise RuntimeError("pyarrow is required for columnar export (pip install -r requirements-export.txt)")
+    return pyarrow
+
+def _month_key(day):
+    return f"{day.year:04d}-{day.month:02d}"
+
+def month_bounds(month):
+    """月（YYYY-MM、日本時間）の開始・終了日時（UTC、タイムゾーンなし）"""
+    year, number = map(int, month.split('-'))
+    start = JST_TZ.localize(datetime(year, number, 1))
+    end = JST_TZ.localize(datetime(year + number // 12, number % 12 + 1, 1))
+    return (start.astimezone(timezone.utc).replace(tzinfo=None),
+            end.astimezone(timezone.utc).replace(tzinfo=None))
+
+def months_between(first, last):
+    """first から last まで（両端を含む）の月（YYYY-MM）のリスト"""
+    months = []
+    year, number = map(int, first.split('-'))
+    while f"{year:04d}-{number:02d}" <= last:
+        months.append(f"{year:04d}-{number:02d}")
+        year, number = year + number // 12, number % 12 + 1
+    return months
+
+def _jst_month(timestamp):
+    return _month_key(naive_utc(timestamp).replace(tzinfo=timezone.utc).astimezone(JST_TZ))
+
+class ColumnarExporter:
+    """
+    出退勤記録の月別（日本時間）の列指向ファイル（Parquet）への書き出し
+
+    ワークスペースごとに以下を書き出す（月のディレクトリは Hive 形式のパーティション）。
+
+        <export_dir>/<team_id>/attendance/month=YYYY-MM/part-0.parquet  出退勤記録（ユーザー情報付き）
+        <export_dir>/<team_id>/sessions/month=YYYY-MM/part-0.parquet    出勤〜退勤の組（退勤した月）と労働時間
+        <export_dir>/<team_id>/users.parquet                            ユーザー一覧
+        <export_dir>/<team_id>/manifest.json                            書き出した月の件数・最終更新日時
+
+    書き出し済みの月は件数と最終更新日時が変わっていない場合は読み込まず、新しい月と
+    記録が修正された月（および月末時点の出勤中の状態が変わった翌月）だけを書き出す。
+    当月は記録が増え続けるため、include_current を指定した場合のみ書き出す。
+    """
+
+    def __init__(self, export_dir, read_db):
+        self.export_dir = export_dir
+        self.read_db = read_db
+
+    def _team_dir(self, team_id):
+        return os.path.join(self.export_dir, team_id)
+
+    def load_manifest(self, team_id):
+        path = os.path.join(self._team_dir(team_id), MANIFEST)
+        if not os.path.exists(path):
+            return {'months': {}}
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self, team_id, manifest):
+        path = os.path.join(self._team_dir(team_id), MANIFEST)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+
+    def _write_table(self, table, path):
+        pa = _require_pyarrow()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pa.parquet.write_table(table, f"{path}.tmp", compression='zstd')
+        os.replace(f"{path}.tmp", path)
+
+    def _month_stats(self, team_id, month):
+        start, end = month_bounds(month)
+        rows, updated_at = self.read_db.query(func.count(Attendance.id), func.max(Attendance.updated_at)).filter(
+            Attendance.team_id == team_id,
+            Attendance.timestamp >= start,
+            Attendance.timestamp < end
+        ).one()
+        return rows, updated_at.isoformat() if updated_at else None
+
+    def _open_checkins_before(self, team_id, before):
+        """before 時点で退勤していない出勤（ユーザーごとの直前の記録が出勤の場合、その日時）"""
+        latest = self.read_db.query(
+            Attendance.user_id, func.max(Attendance.timestamp).label('timestamp')
+        ).filter(Attendance.team_id == team_id, Attendance.timestamp < before).group_by(Attendance.user_id).subquery()
+        rows = self.read_db.query(Attendance.user_id, Attendance.timestamp).join(
+            latest, (Attendance.user_id == latest.c.user_id) & (Attendance.timestamp == latest.c.timestamp)
+        ).filter(Attendance.team_id == team_id, Attendance.type == '出勤')
+        return {user_id: naive_utc(timestamp) for user_id, timestamp in rows}
+
+    @staticmethod
+    def _state_digest(open_checkins):
+        payload = sorted((user_id, timestamp.isoformat()) for user_id, timestamp in open_checkins.items())
+        return hashlib.sha1(json.dumps(payload).encode()).hexdigest()[:16]
+
+    def export(self, team_id, include_current=False, now=None):
+        """
+        ワークスペースの未書き出し・変更のあった月を書き出す
+
+        Returns:
+            dict: 書き出した月・変更がなかった月の数などの統計
+        """
+        pa = _require_pyarrow()
+        now = now or datetime.now(timezone.utc)
+        current = _month_key(now.astimezone(JST_TZ))
+        manifest = self.load_manifest(team_id)
+        stats = {'written': [], 'unchanged': 0, 'rows': 0, 'sessions': 0}
+
+        first = self.read_db.query(func.min(Attendance.timestamp)).filter(Attendance.team_id == team_id).scalar()
+        self._export_users(team_id)
+        if first is None:
+            self._save_manifest(team_id, manifest)
+            return stats
+        last = current if include_current else _month_key(
+            (now.astimezone(JST_TZ).replace(day=1) - timedelta(days=1)))
+
+        open_checkins = None  # 直前の月を書き出した場合のみ、その月末時点の出勤中の状態
+        force = False         # 前月の月末時点の状態が変わった（翌月の労働時間の組が変わる）
+        for month in months_between(_jst_month(first), last):
+            rows, updated_at = self._month_stats(team_id, month)
+            entry = manifest['months'].get(month)
+            if not force and entry is not None and entry['rows'] == rows and entry['max_updated_at'] == updated_at:
+                stats['unchanged'] += 1
+                open_checkins = None
+                continue
+            start, end = month_bounds(month)
+            if open_checkins is None:
+                open_checkins = self._open_checkins_before(team_id, start)
+            open_checkins, written = self._export_month(team_id, month, start, end, open_checkins)
+            digest = self._state_digest(open_checkins)
+            force = entry is None or entry.get('end_state') != digest
+            manifest['months'][month] = {
+                'rows': rows, 'max_updated_at': updated_at, 'sessions': written, 'end_state': digest,
+                'exported_at': now.isoformat()
+            }
+            stats['written'].append(month)
+            stats['rows'] += rows
+            stats['sessions'] += written
+        manifest['exported_at'] = now.isoformat()
+        manifest['pyarrow'] = pa.__version__
+        self._save_manifest(team_id, manifest)
+        return stats
+
+    def _export_users(self, team_id):
+        pa = _require_pyarrow()
+        users = self.read_db.query(User).filter_by(team_id=team_id).order_by(User.id).all()
+        self._write_table(pa.table({
+            'id': pa.array([user.id for user in users], pa.int64()),
+            'slack_user_id': pa.array([user.slack_user_id for user in users], pa.string()),
+            'display_name': pa.array([user.display_name for user in users], pa.string()),
+            'email': pa.array([user.email for user in users], pa.string())
+        }), os.path.join(self._team_dir(team_id), 'users.parquet'))
+
+    def _export_month(self, team_id, month, start, end, open_checkins):
+        """1か月分の記録と出勤〜退勤の組を書き出す（月末時点の出勤中の状態と組の数を返す）"""
+        pa = _require_pyarrow()
+        records = self.read_db.query(
+            Attendance.id, Attendance.user_id, User.slack_user_id, User.display_name,
+            Attendance.type, Attendance.timestamp, Attendance.created_at, Attendance.updated_at
+        ).join(User, User.id == Attendance.user_id).filter(
+            Attendance.team_id == team_id,
+            Attendance.timestamp >= start,
+            Attendance.timestamp < end
+        ).order_by(Attendance.user_id, Attendance.timestamp, Attendance.id).all()
+
+        timestamp_type = pa.timestamp('us', tz='UTC')
+        columns = list(zip(*records)) if records else [()] * 8
+        self._write_table(pa.table({
+            'id': pa.array(columns[0], pa.int64()),
+            'user_id': pa.array(columns[1], pa.int64()),
+            'slack_user_id': pa.array(columns[2], pa.string()).dictionary_encode(),
+            'display_name': pa.array(columns[3], pa.string()).dictionary_encode(),
+            'type': pa.array(columns[4], pa.string()).dictionary_encode(),
+            'timestamp': pa.array([naive_utc(ts) for ts in columns[5]], timestamp_type),
+            'created_at': pa.array([ts and naive_utc(ts) for ts in columns[6]], timestamp_type),
+            'updated_at': pa.array([ts and naive_utc(ts) for ts in columns[7]], timestamp_type)
+        }), os.path.join(self._team_dir(team_id), 'attendance', f"month={month}", 'part-0.parquet'))
+
+        # 労働時間の計算（accumulate_work_hours）と同じ規則で出勤〜退勤の組を作る
+        open_checkins = dict(open_checkins)
+        sessions = []
+        for record in records:
+            timestamp = naive_utc(record.timestamp)
+            if record.type == '出勤':
+                open_checkins[record.user_id] = timestamp
+            elif record.type == '退勤' and record.user_id in open_checkins:
+                checkin = open_checkins.pop(record.user_id)
+                sessions.append((record.user_id, checkin, timestamp, (timestamp - checkin).total_seconds() / 3600))
+        columns = list(zip(*sessions)) if sessions else [()] * 4
+        self._write_table(pa.table({
+            'user_id': pa.array(columns[0], pa.int64()),
+            'checkin_at': pa.array(columns[1], timestamp_type),
+            'checkout_at': pa.array(columns[2], timestamp_type),
+            'hours': pa.array(columns[3], pa.float64())
+        }), os.path.join(self._team_dir(team_id), 'sessions', f"month={month}", 'part-0.parquet'))
+        return open_checkins, len(sessions)
+
+class OfflineAnalytics:
+    """
+    書き出した列指向ファイルだけを使う労働時間の集計（本番のデータベースに接続しない）
+
+    期間の労働時間は get_period_work_hours と同じく期間内の記録だけを accumulate_work_hours で加算し、
+    累積労働時間は get_cumulative_work_hours と同じ値を出勤〜退勤の組の労働時間の合計で求める
+    （終了日時までに退勤した組の合計は、全記録を加算した値と等しい）。読み込むのは対象の月のみ。
+    """
+
+    def __init__(self, export_dir, team_id):
+        self.team_dir = os.path.join(export_dir, team_id)
+        with open(os.path.join(self.team_dir, MANIFEST), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+
+    @property
+    def months(self):
+        """書き出し済みの月（YYYY-MM）"""
+        return sorted(self.manifest['months'])
+
+    def users(self):
+        pa = _require_pyarrow()
+        table = pa.parquet.read_table(os.path.join(self.team_dir, 'users.parquet'))
+        return [ExportedUser(**row) for row in table.to_pylist()]
+
+    def _read(self, name, months, columns, filter_expression=None):
+        pa = _require_pyarrow()
+        months = [month for month in months if month in self.manifest['months']]
+        if not months:
+            return None
+        dataset = pa.dataset.dataset(os.path.join(self.team_dir, name), format='parquet', partitioning='hive')
+        expression = pa.dataset.field('month').isin(months)
+        if filter_expression is not None:
+            expression = expression & filter_expression
+        return dataset.to_table(columns=columns, filter=expression)
+
+    def _covering_months(self, start, end):
+        first = _jst_month(start) if start is not None else (self.months[0] if self.months else '0000-01')
+        return [month for month in self.months if first <= month <= _jst_month(end)]
+
+    def period_work_hours(self, start_datetime, end_datetime):
+        """期間内（UTC、両端を含む）のユーザーごとの労働時間（get_period_work_hours と同じ形式）"""
+        pa = _require_pyarrow()
+        start, end = naive_utc(start_datetime), naive_utc(end_datetime)
+        field = pa.dataset.field('timestamp')
+        table = self._read('attendance', self._covering_months(start, end), ['user_id', 'type', 'timestamp'],
+                           (field >= pa.scalar(start, pa.timestamp('us', tz='UTC')))
+                           & (field <= pa.scalar(end, pa.timestamp('us', tz='UTC'))))
+        records_by_user = {}
+        if table is not None:
+            table = table.sort_by([('user_id', 'ascending'), ('timestamp', 'ascending')])
+            columns = table.to_pydict()
+            for user_id, kind, timestamp in zip(columns['user_id'], columns['type'], columns['timestamp']):
+                records_by_user.setdefault(user_id, []).append(ExportedRecord(kind, timestamp))
+        result = []
+        for user in self.users():
+            records = records_by_user.get(user.id)
+            hours = round(accumulate_work_hours(records)[0], 2) if records else 0
+            result.append({'user': user, 'period_hours': hours})
+        return result
+
+    def cumulative_work_hours(self, end_datetime):
+        """終了日時（UTC）までの累積労働時間（get_cumulative_work_hours と同じ形式・並び順）"""
+        pa = _require_pyarrow()
+        end = naive_utc(end_datetime)
+        table = self._read('sessions', self._covering_months(None, end), ['user_id', 'hours'],
+                           pa.dataset.field('checkout_at') <= pa.scalar(end, pa.timestamp('us', tz='UTC')))
+        totals = {}
+        if table is not None and table.num_rows:
+            grouped = table.group_by('user_id').aggregate([('hours', 'sum')])
+            totals = dict(zip(grouped['user_id'].to_pylist(), grouped['hours_sum'].to_pylist()))
+        result = [{'user': user, 'cumulative_hours': round(totals.get(user.id, 0.0), 2)} for user in self.users()]
+        return sorted(result, key=lambda x: x['cumulative_hours'], reverse=True)
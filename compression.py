@@ -0,0 +1,88 @@
+import os
+import gzip
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli 未インストール時は gzip のみ
+    brotli = None
+
+# 圧縮するレスポンスの種類（画像などは圧縮済みのため対象外）
+COMPRESSIBLE_MIMETYPES = ('text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript',
+                          'image/svg+xml')
+
+def accepted_encoding(accept_encodings):
+    """クライアントが受け付ける圧縮形式（br > gzip、どちらも受け付けない場合は None）"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress(data, encoding, level=None):
+    """本文を圧縮（level 省略時は gzip 6 / brotli 5、静的ファイルの事前圧縮は最大レベル）"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level if level is not None else 5)
+    # mtime を固定して同じ内容から同じ圧縮結果を得る
+    return gzip.compress(data, compresslevel=level if level is not None else 6, mtime=0)
+
+class ResponseCompressor:
+    """
+    HTML・JSONなどのレスポンスを Accept-Encoding に応じて圧縮（after_request）
+
+    COMPRESS_MIN_SIZE バイト（既定1024）未満の本文、圧縮済み・ストリーミング・ファイル送信の
+    レスポンスは圧縮しない。圧縮した場合は ETag を弱いETagにする（圧縮前と同じ内容を表す）。
+    COMPRESS_RESPONSES=false で無効化できる（リバースプロキシで圧縮する場合など）。
+    """
+
+    def __init__(self, app=None, min_size=None, level=None):
+        self.min_size = min_size if min_size is not None else int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+        self.level = level if level is not None else (
+            int(os.environ['COMPRESS_LEVEL']) if os.environ.get('COMPRESS_LEVEL') else None)
+        self.enabled = os.environ.get('COMPRESS_RESPONSES', 'true').lower() == 'true'
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from flask import request
+
+        @app.after_request
+        def _compress_response(response):
+            return self.process(request, response)
+
+    def process(self, request, response):
+        if not self.enabled or request.method == 'HEAD':
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        encoding = accepted_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        compressed = compress(data, encoding, self.level)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        self.compressed += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(compressed)
+        return response
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'encodings': ['br', 'gzip'] if brotli is not None else ['gzip'],
+            'compressed': self.compressed,
+            'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None
+        }
@@ -0,0 +1,208 @@
+import os
+import time
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import func
+from models import db, Attendance, AttendanceIssue, AttendanceOutbox, DataQualityScan
+from outbox import outbox_retention_days, outbox_gap_timeout
+
+logger = logging.getLogger(__name__)
+
+# 検出する問題の種類（労働時間の集計で無視・上書きされる、または集計結果を大きく歪める記録）
+ISSUE_KINDS = {
+    'double_checkin': '退勤のない出勤（次の出勤で上書き）',
+    'orphan_checkout': '出勤のない退勤（集計で無視）',
+    'long_session': '長時間の勤務',
+    'future_punch': '記録した日時より未来の打刻',
+    'past_punch': '記録した日時より大幅に過去の打刻',
+}
+
+# 長時間の勤務とみなす出勤から退勤までの時間
+MAX_SESSION_HOURS = float(os.environ.get('DATA_QUALITY_MAX_SESSION_HOURS', 24))
+# 記録した日時（created_at）から打刻の日時がこの範囲を外れる場合に未来・過去の打刻とみなす
+FUTURE_PUNCH_HOURS = float(os.environ.get('DATA_QUALITY_FUTURE_HOURS', 24))
+PAST_PUNCH_DAYS = float(os.environ.get('DATA_QUALITY_PAST_DAYS', 90))
+# スキャン時に一度に読み込む出退勤記録の件数・対象ユーザー数
+SCAN_BATCH_SIZE = int(os.environ.get('DATA_QUALITY_BATCH_SIZE', 5000))
+USER_CHUNK_SIZE = 500
+
+# 検出した問題（attendance_id は対象の記録、長時間の勤務・出勤の重複は出勤の記録）
+DetectedIssue = namedtuple('DetectedIssue', ['user_id', 'attendance_id', 'kind', 'timestamp', 'hours'])
+
+def detect_issues(rows):
+    """
+    ユーザー・日時の順に並んだ出退勤記録から問題を検出（記録を1件ずつ読み進めるジェネレーター）
+
+    出勤と退勤の対応付けは労働時間の集計（accumulate_work_hours）と同じ規則で行う。
+
+    Args:
+        rows: id・user_id・type・timestamp・created_at を持つ行
+    """
+    future = timedelta(hours=FUTURE_PUNCH_HOURS)
+    past = timedelta(days=PAST_PUNCH_DAYS)
+    user_id = None
+    open_checkin = None
+    for row in rows:
+        if row.user_id != user_id:
+            user_id, open_checkin = row.user_id, None
+        if row.created_at is not None:
+            if row.timestamp - row.created_at > future:
+                yield DetectedIssue(user_id, row.id, 'future_punch', row.timestamp, None)
+            elif row.created_at - row.timestamp > past:
+                yield DetectedIssue(user_id, row.id, 'past_punch', row.timestamp, None)
+        if row.type == '出勤':
+            if open_checkin is not None:
+                yield DetectedIssue(user_id, open_checkin.id, 'double_checkin', open_checkin.timestamp, None)
+            open_checkin = row
+        elif row.type == '退勤':
+            if open_checkin is None:
+                yield DetectedIssue(user_id, row.id, 'orphan_checkout', row.timestamp, None)
+                continue
+            hours = (row.timestamp - open_checkin.timestamp).total_seconds() / 3600
+            if hours > MAX_SESSION_HOURS:
+                yield DetectedIssue(user_id, open_checkin.id, 'long_session', open_checkin.timestamp, round(hours, 2))
+            open_checkin = None
+
+def _stream_records(team_id, user_ids=None, batch_size=None):
+    """出退勤記録をユーザー・日時の順に batch_size 件ずつ読み込む（全件をメモリに載せない）"""
+    query = db.session.query(
+        Attendance.id, Attendance.user_id, Attendance.type, Attendance.timestamp, Attendance.created_at
+    ).filter(Attendance.team_id == team_id)
+    if user_ids is not None:
+        query = query.filter(Attendance.user_id.in_(user_ids))
+    return query.order_by(Attendance.user_id, Attendance.timestamp, Attendance.id).yield_per(
+        batch_size or SCAN_BATCH_SIZE)
+
+def _settled_outbox_id(team_id, after_id, settled_before):
+    """
+    スキャン済みとして記録できる変更イベントのID（settled_before より前に追加されたイベントの最大ID）
+
+    イベントのIDはコミット前に割り当てられ、並行するトランザクションは id の順にコミットされるとは限らない。
+    追加から OUTBOX_GAP_TIMEOUT 秒以内のイベントは、それより小さいIDのイベントが後からコミットされる
+    可能性があるため、次回のスキャンでも読み込む（OutboxDispatcher の欠番の扱いと同じ）。
+    """
+    settled = db.session.query(func.max(AttendanceOutbox.id)).filter(
+        AttendanceOutbox.team_id == team_id,
+        AttendanceOutbox.id > after_id,
+        AttendanceOutbox.created_at < settled_before
+    ).scalar()
+    return settled if settled is not None else after_id
+
+def _changed_user_ids(team_id, after_id):
+    """スキャン済みより新しい変更イベントのユーザー"""
+    return {user_id for (user_id,) in db.session.query(AttendanceOutbox.user_id).filter(
+        AttendanceOutbox.team_id == team_id,
+        AttendanceOutbox.id > after_id
+    ).distinct()}
+
+def _apply(team_id, detected, user_ids=None):
+    """
+    検出結果と保存済みの問題の差分を反映（継続している問題は検出日時を保持）
+
+    Returns:
+        tuple: (追加件数, 解消件数)
+    """
+    query = AttendanceIssue.query.filter(AttendanceIssue.team_id == team_id)
+    if user_ids is not None:
+        query = query.filter(AttendanceIssue.user_id.in_(user_ids))
+    existing = {(issue.attendance_id, issue.kind): issue for issue in query}
+    detected = {(issue.attendance_id, issue.kind): issue for issue in detected}
+    now = datetime.now(timezone.utc)
+    resolved = [issue for key, issue in existing.items() if key not in detected]
+    for issue in resolved:
+        db.session.delete(issue)
+    added = 0
+    for key, issue in detected.items():
+        current = existing.get(key)
+        if current is not None:
+            current.user_id, current.timestamp, current.hours = issue.user_id, issue.timestamp, issue.hours
+            continue
+        db.session.add(AttendanceIssue(team_id=team_id, user_id=issue.user_id, attendance_id=issue.attendance_id,
+                                       kind=issue.kind, timestamp=issue.timestamp, hours=issue.hours,
+                                       detected_at=now))
+        added += 1
+    return added, len(resolved)
+
+def scan_data_quality(team_id, full=False, now=None, batch_size=None):
+    """
+    出退勤記録の問題を検出して attendance_issue に保存
+
+    前回のスキャン以降の変更イベント（attendance_outbox）があるユーザーの記録だけを読み込む。
+    初回・full 指定時と、前回のスキャンが変更イベントの保持期間より前の場合は全記録を読み込む。
+
+    Returns:
+        dict: スキャンの種類・読み込んだ記録数・問題の件数などの統計
+    """
+    started = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    now_naive = now.astimezone(timezone.utc).replace(tzinfo=None)
+    state = DataQualityScan.query.filter_by(team_id=team_id).first()
+    retention_cutoff = now_naive - timedelta(days=outbox_retention_days())
+    settled_before = now_naive - timedelta(seconds=outbox_gap_timeout())
+    if state is not None and not full and state.scanned_at >= retention_cutoff:
+        # 記録より先にイベントのIDを確定させる（読み込み後にコミットされたイベントは次回のスキャンで読み込む）
+        outbox_id = _settled_outbox_id(team_id, state.outbox_id, settled_before)
+        user_ids = _changed_user_ids(team_id, state.outbox_id)
+        mode = 'incremental'
+    else:
+        user_ids = None
+        outbox_id = _settled_outbox_id(team_id, 0, settled_before)
+        mode = 'full'
+
+    records = 0
+    detected = []
+
+    def counted(rows):
+        nonlocal records
+        for row in rows:
+            records += 1
+            yield row
+
+    if user_ids is None:
+        detected.extend(detect_issues(counted(_stream_records(team_id, batch_size=batch_size))))
+        added, resolved = _apply(team_id, detected)
+    else:
+        added = resolved = 0
+        ordered = sorted(user_ids)
+        for i in range(0, len(ordered), USER_CHUNK_SIZE):
+            chunk = ordered[i:i + USER_CHUNK_SIZE]
+            chunk_issues = list(detect_issues(counted(_stream_records(team_id, chunk, batch_size))))
+            chunk_added, chunk_resolved = _apply(team_id, chunk_issues, chunk)
+            detected.extend(chunk_issues)
+            added += chunk_added
+            resolved += chunk_resolved
+
+    if state is None:
+        state = DataQualityScan(team_id=team_id, full_scanned_at=now_naive)
+        db.session.add(state)
+    state.outbox_id = outbox_id
+    state.scanned_at = now_naive
+    if mode == 'full':
+        state.full_scanned_at = now_naive
+    db.session.commit()
+
+    stats = {
+        'mode': mode,
+        'users': len(user_ids) if user_ids is not None else None,
+        'records': records,
+        'detected': len(detected),
+        'added': added,
+        'resolved': resolved,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+    if added or resolved:
+        logger.info(f"Data quality scan for {team_id}: {stats}")
+    return stats
+
+def issue_summary(team_id):
+    """ワークスペースの問題の件数（種類ごと）と最後のスキャン日時"""
+    counts = dict(db.session.query(AttendanceIssue.kind, func.count(AttendanceIssue.id)).filter(
+        AttendanceIssue.team_id == team_id).group_by(AttendanceIssue.kind).all())
+    state = DataQualityScan.query.filter_by(team_id=team_id).first()
+    return {
+        'counts': {kind: counts.get(kind, 0) for kind in ISSUE_KINDS},
+        'total': sum(counts.values()),
+        'scanned_at': state.scanned_at if state else None,
+        'full_scanned_at': state.full_scanned_at if state else None
+    }
@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+class FakeSlackServer:
+    """
+    ローカルで動作する疑似Slack Web APIサーバー（テスト・負荷確認用）
+
+    chat.postMessage / views.publish / users.info / auth.test に応答し（GET・POST）、chat.postMessage は
+    チャンネルごとに1秒あたり rate_per_channel 件を超えると 429 と Retry-After を返す。
+    WebClient(base_url=server.base_url) のように接続先を差し替えて使用する。
+    """
+
+    def __init__(self, rate_per_channel=1.0, burst=3, retry_after=1, host='127.0.0.1', port=0):
+        self.rate_per_channel = rate_per_channel
+        self.burst = burst
+        self.retry_after = retry_after
+        self.messages = []
+        self.views = []
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._allowance = {}
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-slack', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _allow(self, channel):
+        """チャンネルごとのレート制限を判定"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._allowance.get(channel, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate_per_channel)
+            if tokens < 1:
+                self._allowance[channel] = (tokens, now)
+                self.rate_limited += 1
+                return False
+            self._allowance[channel] = (tokens - 1, now)
+            return True
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _params(self):
+                if '?' in self.path:
+                    # GET で送られるメソッド（users.info など）はクエリ文字列で受け取る
+                    return {key: values[0] for key, values in parse_qs(self.path.split('?', 1)[1]).items()}
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode() if length else ''
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    return json.loads(body or '{}')
+                return {key: values[0] for key, values in parse_qs(body).items()}
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                method = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+                params = self._params()
+                if method == 'chat.postMessage':
+                    channel = params.get('channel')
+                    if not server._allow(channel):
+                        self._reply(429, {'ok': False, 'error': 'ratelimited'},
+                                    {'Retry-After': str(server.retry_after)})
+                        return
+                    with server._lock:
+                        server.messages.append({'channel': channel, 'text': params.get('text')})
+                    self._reply(200, {'ok': True, 'channel': channel, 'ts': f"{time.time():.6f}"})
+                elif method == 'views.publish':
+                    view = params.get('view')
+                    with server._lock:
+                        server.views.append({'user_id': params.get('user_id'),
+                                             'view': json.loads(view) if isinstance(view, str) else view})
+                    self._reply(200, {'ok': True, 'view': {'id': 'V000'}})
+                elif method == 'users.info':
+                    user_id = params.get('user', 'U000')
+                    self._reply(200, {'ok': True, 'user': {
+                        'id': user_id, 'name': user_id.lower(), 'real_name': f'User {user_id}',
+                        'profile': {'email': f'{user_id.lower()}@example.com'}
+                    }})
+                elif method == 'auth.test':
+                    self._reply(200, {'ok': True, 'team_id': 'T000', 'user_id': 'UBOT', 'bot_id': 'BBOT'})
+                else:
+                    self._reply(200, {'ok': True})
+
+            do_GET = do_POST
+
+        return Handler
@@ -36,4 +36,9 @@ max_worker_connections = 1000
 forwarded_allow_ips = "*"  # Renderプロキシからの接続を許可
 
 # Application
-module = "app:app" 
\ No newline at end of file
+module = "app:app"
+
+def post_fork(server, worker):
+    """ワーカー起動時の初期化（preload された接続の破棄と定期ジョブの開始）"""
+    from app import start_background_jobs
+    start_background_jobs() 
\ No newline at end of file
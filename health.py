@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+import logging
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+class TimedQueuePool(QueuePool):
+    """接続取得の待ち時間を計測するコネクションプール"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self._wait_lock:
+                self.wait_count += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+def pool_status(engine):
+    """コネクションプールの利用状況を辞書形式で返す"""
+    pool = engine.pool
+    status = {'class': pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        with pool._wait_lock:
+            average = pool.wait_total / pool.wait_count if pool.wait_count else 0
+            status.update({
+                'checkouts': pool.wait_count,
+                'wait_avg_ms': round(average * 1000, 3),
+                'wait_max_ms': round(pool.wait_max * 1000, 3),
+            })
+    return status
+
+# バックグラウンドキューの深さを返す関数の登録先（名前 -> 関数）
+_queue_depth_providers = {}
+
+def register_queue(name, depth_func):
+    """readiness に表示するバックグラウンドキューを登録"""
+    _queue_depth_providers[name] = depth_func
+
+def queue_depths():
+    """登録済みバックグラウンドキューの深さを取得"""
+    depths = {}
+    for name, depth_func in _queue_depth_providers.items():
+        try:
+            depths[name] = depth_func()
+        except Exception as e:
+            logger.error(f"Error reading queue depth for {name}: {e}")
+            depths[name] = None
+    return depths
+
+class ReadinessProbe:
+    """
+    データベース疎通確認を一定間隔でキャッシュするプローブ
+
+    本体のコネクションプールとは別の専用接続（1本）を使用するため、
+    ロードバランサーのヘルスチェックが通常のリクエストと接続を奪い合わない。
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else float(os.environ.get('HEALTH_CHECK_INTERVAL', 5))
+        self._lock = threading.Lock()
+        self._engine = None
+        self._checked_at = 0.0
+        self._result = {'database': 'unknown'}
+        self._healthy = False
+
+    def _get_engine(self, url, connect_args):
+        if self._engine is None:
+            self._engine = create_engine(
+                url,
+                pool_size=1,
+                max_overflow=0,
+                pool_timeout=2,
+                pool_pre_ping=True,
+                pool_recycle=3600,
+                connect_args=connect_args
+            )
+        return self._engine
+
+    def check(self, url, connect_args=None):
+        """キャッシュ済みの疎通確認結果を返す（期限切れの場合のみ再確認）"""
+        now = time.monotonic()
+        if now - self._checked_at < self.interval:
+            return self._healthy, self._result
+
+        # 他のスレッドが確認中の場合は前回の結果を返す（まだ結果がない初回の確認中は、その完了を待つ）
+        if not self._lock.acquire(blocking=self._checked_at == 0.0):
+            return self._healthy, self._result
+
+        try:
+            # 待っている間に他のスレッドが確認を終えていれば、その結果を返す
+            if time.monotonic() - self._checked_at < self.interval:
+                return self._healthy, self._result
+            started = time.perf_counter()
+            try:
+                with self._get_engine(url, connect_args or {}).connect() as connection:
+                    connection.execute(text('SELECT 1'))
+                self._healthy = True
+                self._result = {
+                    'database': 'connected',
+                    'latency_ms': round((time.perf_counter() - started) * 1000, 2)
+                }
+            except Exception as e:
+                logger.error(f"Readiness check failed: {e}")
+                self._healthy = False
+                self._result = {'database': 'disconnected', 'error': str(e)}
+            self._checked_at = time.monotonic()
+            self._result['checked_at'] = time.time()
+            return self._healthy, self._result
+        finally:
+            self._lock.release()
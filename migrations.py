@@ -0,0 +1,199 @@
+import logging
+from sqlalchemy import inspect, text, Integer, String
+from sqlalchemy.schema import CreateTable
+from models import db, User, Attendance, PUNCH_KINDS
+
+logger = logging.getLogger(__name__)
+
+# モデルから削除されたテーブル（以前のバージョンで作成されたものを削除する）
+# - attendance_day_change: 日別キャッシュの無効化用（出退勤記録の変更イベントの outbox に置き換え）
+OBSOLETE_TABLES = ['attendance_day_change']
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+def add_missing_columns():
+    """
+    既存テーブルに不足しているカラムを追加（db.create_all は既存テーブルを変更しないため）
+
+    追加できるのは NULL 許容またはサーバー側デフォルト値を持つカラムのみ。
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    logger.error(f"Cannot add NOT NULL column without default: {table.name}.{column.name}")
+                    continue
+                ddl = f"ALTER TABLE {_quote(table.name)} ADD COLUMN {_quote(column.name)} " \
+                      f"{column.type.compile(db.engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT '{column.server_default.arg}'"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                connection.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+def create_missing_indexes():
+    """モデルに定義されているが未作成のインデックスを作成"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.engine)
+                created.append(index.name)
+    return created
+
+def _has_sqlite_slack_user_unique():
+    # 旧スキーマの UNIQUE(slack_user_id) は名前のない自動インデックス（origin = 'u'）として作成されている
+    # （カラム定義内の UNIQUE は inspector.get_unique_constraints に現れないため PRAGMA で調べる）
+    with db.engine.connect() as connection:
+        for index in connection.execute(text("PRAGMA index_list('user')")).mappings():
+            if index['unique'] and index['origin'] == 'u':
+                columns = [row['name'] for row in
+                           connection.execute(text(f"PRAGMA index_info('{index['name']}')")).mappings()]
+                if columns == ['slack_user_id']:
+                    return True
+    return False
+
+def _rebuild_sqlite_user_table():
+    """
+    SQLite の user テーブルを現在のモデル定義で作り直す（SQLiteは制約を削除できないため、コピーして置き換える）
+
+    外部キーの制約は無効（SQLiteの既定、sqlite_pragmas では有効にしない）の前提で user を削除する。
+    """
+    table = User.__table__
+    ddl = str(CreateTable(table).compile(db.engine)).replace(
+        f'CREATE TABLE {_quote(table.name)} ', 'CREATE TABLE user_rebuild ', 1
+    )
+    existing_columns = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    names = ', '.join(column.name for column in table.columns if column.name in existing_columns)
+    with db.engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS user_rebuild'))
+        connection.execute(text(ddl))
+        connection.execute(text(f'INSERT INTO user_rebuild ({names}) SELECT {names} FROM {_quote(table.name)}'))
+        # 他のテーブルの外部キーはテーブル名で参照するため、置き換え後もそのまま有効
+        connection.execute(text(f'DROP TABLE {_quote(table.name)}'))
+        connection.execute(text(f'ALTER TABLE user_rebuild RENAME TO {_quote(table.name)}'))
+        for index in table.indexes:
+            index.create(bind=connection)
+
+def drop_legacy_constraints():
+    """
+    複数ワークスペース対応で不要になった制約を削除
+
+    slack_user_id 単独の一意制約（ワークスペース + slack_user_id の一意インデックスに置き換え）を削除する。
+    PostgreSQL は制約を削除し、SQLite は user テーブルを作り直す。
+    """
+    inspector = inspect(db.engine)
+    if 'user' not in inspector.get_table_names():
+        return []
+    if db.engine.dialect.name == 'sqlite':
+        if not _has_sqlite_slack_user_unique():
+            return []
+        _rebuild_sqlite_user_table()
+        return ['user.slack_user_id unique']
+    if db.engine.dialect.name != 'postgresql':
+        return []
+    dropped = []
+    with db.engine.begin() as connection:
+        result = connection.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conname = 'user_slack_user_id_key'"
+        )).first()
+        if result:
+            connection.execute(text('ALTER TABLE "user" DROP CONSTRAINT user_slack_user_id_key'))
+            dropped.append('user_slack_user_id_key')
+    return dropped
+
+def drop_obsolete_tables():
+    """モデルから削除されたテーブルを削除（インデックスも合わせて削除される）"""
+    existing_tables = set(inspect(db.engine).get_table_names())
+    dropped = [name for name in OBSOLETE_TABLES if name in existing_tables]
+    with db.engine.begin() as connection:
+        for name in dropped:
+            connection.execute(text(f"DROP TABLE {_quote(name)}"))
+    return dropped
+
+def _punch_kind_case(column):
+    return 'CASE ' + column + ''.join(f" WHEN '{name}' THEN {code}" for name, code in PUNCH_KINDS.items()) + ' END'
+
+def _sqlite_epoch_micros(column):
+    # 'YYYY-MM-DD HH:MM:SS.ffffff'（SQLAlchemy の SQLite 用の日時の保存形式）を UNIX エポックからのマイクロ秒に変換
+    return (f"CASE WHEN {column} IS NULL THEN NULL ELSE "
+            f"CAST(strftime('%s', {column}) AS INTEGER) * 1000000 "
+            f"+ CAST(substr({column} || '000000', 21, 6) AS INTEGER) END")
+
+def compact_attendance_columns(engine=None):
+    """
+    出退勤記録の種別（文字列）と日時を省サイズの形式に変換（models.PunchKind / EpochTimestamp）
+
+    PostgreSQL は種別のカラムの型を SMALLINT に変更する（日時は元から8バイトのため変更しない）。
+    SQLite はカラムの型を変更できないため、新しい形式のテーブルにコピーして置き換える。
+    変換済みの場合は何もしない。
+    """
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    if 'attendance' not in inspector.get_table_names():
+        return []
+    columns = {column['name']: column['type'] for column in inspector.get_columns('attendance')}
+    legacy_kind = isinstance(columns['type'], String)
+
+    if engine.dialect.name == 'postgresql':
+        if not legacy_kind:
+            return []
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"ALTER TABLE attendance ALTER COLUMN type TYPE SMALLINT USING ({_punch_kind_case('type')})"
+            ))
+        return ['attendance.type']
+
+    if engine.dialect.name != 'sqlite':
+        return []
+    legacy_timestamps = [name for name in ('timestamp', 'created_at', 'updated_at')
+                         if not isinstance(columns[name], Integer)]
+    if not legacy_kind and not legacy_timestamps:
+        return []
+    table = Attendance.__table__
+    ddl = str(CreateTable(table).compile(engine)).replace('CREATE TABLE attendance ', 'CREATE TABLE attendance_compact ', 1)
+    select_columns = []
+    for column in table.columns:
+        if column.name == 'type' and legacy_kind:
+            select_columns.append(_punch_kind_case('type'))
+        elif column.name in legacy_timestamps:
+            select_columns.append(_sqlite_epoch_micros(column.name))
+        else:
+            select_columns.append(column.name)
+    names = ', '.join(column.name for column in table.columns)
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS attendance_compact'))
+        connection.execute(text(ddl))
+        connection.execute(text(
+            f"INSERT INTO attendance_compact ({names}) SELECT {', '.join(select_columns)} FROM attendance"
+        ))
+        # 他のテーブルの外部キーはテーブル名で参照するため、置き換え後もそのまま有効
+        connection.execute(text('DROP TABLE attendance'))
+        connection.execute(text('ALTER TABLE attendance_compact RENAME TO attendance'))
+        for index in table.indexes:
+            index.create(bind=connection)
+    return ['attendance'] + [f'attendance.{name}' for name in ['type'] * legacy_kind + legacy_timestamps]
+
+def run_migrations():
+    """既存データベースをモデル定義に追従させる（何度実行しても安全）"""
+    changes = (add_missing_columns() + compact_attendance_columns() + drop_legacy_constraints()
+               + drop_obsolete_tables() + create_missing_indexes())
+    if changes:
+        logger.info(f"Schema migrated: {changes}")
+    return changes
@@ -1,18 +1,100 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+import hashlib
+from workspaces import DEFAULT_TEAM_ID
 
 db = SQLAlchemy()
 
+# ワークスペースID（SlackのチームID）のカラム定義
+# 全てのテーブルで先頭キーとし、クエリ・キャッシュをワークスペース単位に閉じる
+def team_id_column():
+    return db.Column(db.String(20), nullable=False, default=DEFAULT_TEAM_ID, server_default=DEFAULT_TEAM_ID)
+
+# 出退勤の種別の保存値（Python側は従来どおり '出勤' / '退勤' の文字列で扱う）
+PUNCH_KINDS = {'出勤': 1, '退勤': 2}
+PUNCH_KIND_NAMES = {code: name for name, code in PUNCH_KINDS.items()}
+
+class PunchKind(db.TypeDecorator):
+    """出退勤の種別を SMALLINT で保存する型（比較・取得は文字列のまま）"""
+    impl = db.SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        if isinstance(value, int):
+            # 変換済みのコード（一括登録など）は既知の値のみ受け付ける
+            if value not in PUNCH_KIND_NAMES:
+                raise ValueError(f"Unknown punch kind code: {value}")
+            return value
+        if value not in PUNCH_KINDS:
+            raise ValueError(f"Unknown punch kind: {value}")
+        return PUNCH_KINDS[value]
+
+    def result_processor(self, dialect, coltype):
+        # 全件の読み込みで行ごとに呼ばれるため、辞書の参照のみで変換
+        names = dict(PUNCH_KIND_NAMES)
+        # 変換前（旧形式）の値はそのまま返す
+        names.update((name, name) for name in PUNCH_KINDS)
+
+        def process(value):
+            return None if value is None else names[value]
+        return process
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+class EpochTimestamp(db.TypeDecorator):
+    """
+    UTC の日時を保存する型（取得値はタイムゾーンなしのUTC）
+
+    SQLite では日時が約26バイトの文字列で保存されるため、UNIXエポックからのマイクロ秒（整数）で保存する。
+    PostgreSQL の timestamp は内部的に8バイトの整数のため、そのまま日時型を使用する。
+    """
+    impl = db.DateTime
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'sqlite':
+            return dialect.type_descriptor(db.BigInteger())
+        return dialect.type_descriptor(db.DateTime())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'sqlite':
+            return value
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return (value - _EPOCH) // _MICROSECOND
+
+    def result_processor(self, dialect, coltype):
+        if dialect.name != 'sqlite':
+            return super().result_processor(dialect, coltype)
+
+        def process(value):
+            if value is None:
+                return None
+            if isinstance(value, str):
+                # 変換前（旧形式）の値
+                return datetime.fromisoformat(value)
+            return _EPOCH + _MICROSECOND * value
+        return process
+
 class User(db.Model):
     """Slackユーザー情報を保存するモデル"""
     id = db.Column(db.Integer, primary_key=True)
-    slack_user_id = db.Column(db.String(20), unique=True, nullable=False)
+    team_id = team_id_column()
+    slack_user_id = db.Column(db.String(20), nullable=False)
     display_name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
     # リレーションシップ
     attendances = db.relationship('Attendance', backref='user', lazy=True, cascade='all, delete-orphan')
+    weekly_hours = db.relationship('WeeklyHours', backref='user', lazy=True, cascade='all, delete-orphan')
+    hours_snapshots = db.relationship('HoursSnapshot', backref='user', lazy=True, cascade='all, delete-orphan')
+    attendance_issues = db.relationship('AttendanceIssue', backref='user', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (db.Index('ix_user_team_slack_user', 'team_id', 'slack_user_id', unique=True),)
     
     def __repr__(self):
         return f'<User {self.display_name}>'
@@ -20,11 +102,22 @@ class User(db.Model):
 class Attendance(db.Model):
     """出退勤記録を保存するモデル"""
     id = db.Column(db.Integer, primary_key=True)
+    team_id = team_id_column()
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    type = db.Column(db.String(10), nullable=False)  # '出勤' or '退勤'
-    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    type = db.Column(PunchKind, nullable=False)  # '出勤' or '退勤'
+    timestamp = db.Column(EpochTimestamp, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(EpochTimestamp, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(EpochTimestamp, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    
+    # リレーションシップ
+    open_session_alerts = db.relationship('OpenSessionAlert', backref='attendance', lazy=True,
+                                          cascade='all, delete-orphan',
+                                          foreign_keys='OpenSessionAlert.attendance_id')
+    
+    __table_args__ = (
+        db.Index('ix_attendance_team_timestamp', 'team_id', 'timestamp'),
+        db.Index('ix_attendance_team_user_timestamp', 'team_id', 'user_id', 'timestamp'),
+    )
     
     def __repr__(self):
         return f'<Attendance {self.type} - {self.timestamp}>'
@@ -38,4 +131,134 @@ class Attendance(db.Model):
             'timestamp': self.timestamp.isoformat(),
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        } 
\ No newline at end of file
+        }
+
+class OpenSessionAlert(db.Model):
+    """退勤打刻漏れの可能性がある出勤記録（定期スイープで検出）"""
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = team_id_column()
+    attendance_id = db.Column(db.Integer, db.ForeignKey('attendance.id'), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    action = db.Column(db.String(10), nullable=False)  # 'marked'（検出のみ） or 'closed'（自動退勤）
+    closing_attendance_id = db.Column(db.Integer, db.ForeignKey('attendance.id'), nullable=True)
+    detected_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    notified_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (db.Index('ix_open_session_alert_team_detected', 'team_id', 'detected_at'),)
+    
+    def __repr__(self):
+        return f'<OpenSessionAlert {self.attendance_id} {self.action}>'
+
+class WeeklyHours(db.Model):
+    """ユーザーごとの週別労働時間（出退勤記録の更新時に差分で再計算される集計テーブル）"""
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = team_id_column()
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    week_start = db.Column(db.Date, nullable=False)  # 週の開始日（月曜日）
+    hours = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        db.Index('ix_weekly_hours_team_user_week', 'team_id', 'user_id', 'week_start', unique=True),
+        db.Index('ix_weekly_hours_team_updated', 'team_id', 'updated_at'),
+    )
+    
+    def __repr__(self):
+        return f'<WeeklyHours {self.user_id} {self.week_start} {self.hours}>'
+
+class AttendanceOutbox(db.Model):
+    """出退勤記録の変更イベント（変更と同一トランザクションで追加、id の順に各ワーカーへ配信）"""
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = team_id_column()
+    user_id = db.Column(db.Integer, nullable=False)  # 削除されたユーザーのイベントも残すため外部キーにしない
+    attendance_id = db.Column(db.Integer, nullable=False)
+    day = db.Column(db.Date, nullable=False)  # 変更された記録の日付（日本時間）
+    kind = db.Column(db.String(10), nullable=False)  # 'insert' / 'update' / 'delete'
+    version = db.Column(db.Integer, nullable=False)  # コミット時のデータバージョン
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (db.Index('ix_attendance_outbox_created', 'created_at'),)
+    
+    def __repr__(self):
+        return f'<AttendanceOutbox {self.id} {self.kind} {self.user_id} {self.day}>'
+
+class HoursSnapshot(db.Model):
+    """ユーザーごとの累積労働時間の事前計算結果（as_of より前の出退勤記録の集計、定期ジョブで更新）"""
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = team_id_column()
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    as_of = db.Column(db.DateTime, nullable=False)  # 集計の境界（UTC、この日時より前の記録を集計）
+    total_hours = db.Column(db.Float, nullable=False, default=0)  # 丸める前の累積労働時間
+    open_checkin_at = db.Column(db.DateTime, nullable=True)  # 境界の時点で退勤していない出勤の日時
+    computed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (db.Index('ix_hours_snapshot_team_user', 'team_id', 'user_id', unique=True),)
+    
+    def __repr__(self):
+        return f'<HoursSnapshot {self.user_id} {self.as_of} {self.total_hours}>'
+
+class AttendanceIssue(db.Model):
+    """労働時間の集計で無視・上書きされる出退勤記録（データ品質の定期スキャンで検出）"""
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = team_id_column()
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    attendance_id = db.Column(db.Integer, nullable=False)  # 記録の削除後も再スキャンまで残るため外部キーにしない
+    kind = db.Column(db.String(20), nullable=False)  # data_quality.ISSUE_KINDS のキー
+    timestamp = db.Column(db.DateTime, nullable=False)  # 対象の記録の日時（UTC）
+    hours = db.Column(db.Float, nullable=True)  # 24時間を超える勤務の時間
+    detected_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        db.Index('ix_attendance_issue_attendance_kind', 'attendance_id', 'kind', unique=True),
+        db.Index('ix_attendance_issue_team_user', 'team_id', 'user_id'),
+        db.Index('ix_attendance_issue_team_timestamp', 'team_id', 'timestamp'),
+    )
+    
+    def __repr__(self):
+        return f'<AttendanceIssue {self.kind} {self.attendance_id}>'
+
+class DataQualityScan(db.Model):
+    """データ品質スキャンの進捗（ワークスペースごと、スキャン済みの変更イベントのID）"""
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = team_id_column()
+    outbox_id = db.Column(db.Integer, nullable=False, default=0)
+    scanned_at = db.Column(db.DateTime, nullable=False)
+    full_scanned_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (db.Index('ix_data_quality_scan_team', 'team_id', unique=True),)
+    
+    def __repr__(self):
+        return f'<DataQualityScan {self.team_id} {self.outbox_id}>'
+
+class SchemaVersion(db.Model):
+    """スキーマバージョンの目印を保存するモデル（起動時のスキーマ確認省略用）"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.String(64), nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
+
+class DataVersion(db.Model):
+    """出退勤・ユーザーデータの更新ごとに増加するバージョン（ワークスペースごと、キャッシュ無効化用）"""
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = team_id_column()
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # 最後に増加した時刻（リードレプリカの遅延の見積もりに使用）
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (db.Index('ix_data_version_team', 'team_id', unique=True),)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.team_id} {self.version}>'
+
+def compute_schema_version():
+    """モデル定義（テーブル・カラム・インデックス）からスキーマバージョンを算出"""
+    digest = hashlib.sha1()
+    for table in sorted(db.metadata.sorted_tables, key=lambda t: t.name):
+        digest.update(table.name.encode())
+        for column in table.columns:
+            digest.update(f'{column.name}:{column.type}:{column.nullable}'.encode())
+        for index in sorted(table.indexes, key=lambda i: i.name or ''):
+            digest.update(f'{index.name}:{",".join(c.name for c in index.columns)}'.encode())
+    return digest.hexdigest()[:16]
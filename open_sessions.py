@@ -0,0 +1,110 @@
+import os
+import logging
+from datetime import datetime, timezone, timedelta
+from collections import defaultdict
+from sqlalchemy import func, and_
+from models import db, User, Attendance, OpenSessionAlert
+from timezones import JST_TZ
+
+logger = logging.getLogger(__name__)
+
+# 出勤からこの時間を過ぎても退勤がない場合に打刻漏れとみなす
+OPEN_SESSION_THRESHOLD_HOURS = float(os.environ.get('OPEN_SESSION_THRESHOLD_HOURS', 16))
+# 打刻漏れへの対応方針（'mark': 検出・通知のみ, 'close': 自動で退勤を記録）
+OPEN_SESSION_POLICY = os.environ.get('OPEN_SESSION_POLICY', 'mark')
+# 自動退勤時に記録する勤務時間（出勤からの時間）
+OPEN_SESSION_CLOSE_AFTER_HOURS = float(os.environ.get('OPEN_SESSION_CLOSE_AFTER_HOURS', 8))
+
+def open_session_cutoff(now=None):
+    """打刻漏れとみなす出勤時刻の境界（UTC）"""
+    now = now or datetime.now(timezone.utc)
+    return now - timedelta(hours=OPEN_SESSION_THRESHOLD_HOURS)
+
+def find_open_sessions(cutoff):
+    """
+    未検出の打刻漏れ（最新の記録が境界より古い出勤のユーザー）を1クエリで取得
+
+    Returns:
+        list: (Attendance, User) のリスト
+    """
+    latest = db.session.query(
+        Attendance.user_id,
+        func.max(Attendance.timestamp).label('latest_timestamp')
+    ).group_by(Attendance.user_id).subquery()
+
+    return db.session.query(Attendance, User).join(
+        latest,
+        and_(Attendance.user_id == latest.c.user_id,
+             Attendance.timestamp == latest.c.latest_timestamp)
+    ).join(User, User.id == Attendance.user_id).outerjoin(
+        OpenSessionAlert, OpenSessionAlert.attendance_id == Attendance.id
+    ).filter(
+        Attendance.type == '出勤',
+        Attendance.timestamp < cutoff,
+        OpenSessionAlert.id.is_(None)
+    ).all()
+
+def sweep_open_sessions(sender=None, policy=None, now=None):
+    """
+    打刻漏れを検出して方針に従って処理し、ユーザーごとにまとめて通知
+
+    Args:
+        sender: Slack送信キュー（None の場合は通知しない）
+        policy: 'mark' または 'close'（省略時は OPEN_SESSION_POLICY）
+
+    Returns:
+        int: 検出件数
+    """
+    from cache import bump_data_version
+
+    policy = policy or OPEN_SESSION_POLICY
+    now = now or datetime.now(timezone.utc)
+    open_sessions = find_open_sessions(open_session_cutoff(now))
+    if not open_sessions:
+        return 0
+
+    alerts_by_user = defaultdict(list)
+    for attendance, user in open_sessions:
+        alert = OpenSessionAlert(team_id=user.team_id, attendance_id=attendance.id, user_id=user.id,
+                                 action='marked', detected_at=now)
+        if policy == 'close':
+            closing = Attendance(
+                team_id=user.team_id,
+                user_id=user.id,
+                type='退勤',
+                timestamp=attendance.timestamp + timedelta(hours=OPEN_SESSION_CLOSE_AFTER_HOURS)
+            )
+            db.session.add(closing)
+            db.session.flush()
+            alert.action = 'closed'
+            alert.closing_attendance_id = closing.id
+        db.session.add(alert)
+        alerts_by_user[user].append((attendance, alert))
+
+    for team_id in {user.team_id for user in alerts_by_user}:
+        bump_data_version(team_id)
+    db.session.commit()
+    logger.info(f"Open session sweep: {len(open_sessions)} sessions {policy} for {len(alerts_by_user)} users")
+
+    if sender is not None:
+        for user, items in alerts_by_user.items():
+            sender.send(user.slack_user_id, format_open_session_notice(items), team_id=user.team_id)
+            for _, alert in items:
+                alert.notified_at = now
+        db.session.commit()
+
+    return len(open_sessions)
+
+def format_open_session_notice(items):
+    """ユーザー1人分の打刻漏れ通知メッセージを作成"""
+    lines = ['⚠️ 退勤打刻がない出勤記録があります。']
+    for attendance, alert in items:
+        checkin = attendance.timestamp.replace(tzinfo=timezone.utc).astimezone(JST_TZ)
+        if alert.action == 'closed':
+            checkout = (attendance.timestamp + timedelta(hours=OPEN_SESSION_CLOSE_AFTER_HOURS)).replace(
+                tzinfo=timezone.utc).astimezone(JST_TZ)
+            lines.append(f"• {checkin.strftime('%Y-%m-%d %H:%M')} の出勤 → {checkout.strftime('%H:%M')} で自動的に退勤を記録しました")
+        else:
+            lines.append(f"• {checkin.strftime('%Y-%m-%d %H:%M')} の出勤")
+    lines.append('必要に応じてWeb画面から記録を修正してください。')
+    return '\n'.join(lines)
@@ -0,0 +1,263 @@
+import os
+import time
+import threading
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import event, inspect, func
+from sqlalchemy.orm import Session
+from models import db, Attendance, AttendanceOutbox, DataVersion
+from background_worker import BackgroundWorker
+from timezones import JST_TZ
+
+logger = logging.getLogger(__name__)
+
+# 購読者に渡す変更イベント（セッションに依存しない）
+ChangeEvent = namedtuple('ChangeEvent', ['id', 'team_id', 'user_id', 'attendance_id', 'day', 'kind', 'version'])
+
+def _jst_day(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(JST_TZ).date()
+
+def _changed_days(obj):
+    """出退勤記録の変更前後の日付（日本時間）"""
+    timestamps = [obj.timestamp]
+    state = inspect(obj)
+    if state.persistent or state.deleted:
+        history = state.attrs.timestamp.history
+        timestamps.extend(history.deleted or ())
+        timestamps.extend(history.unchanged or ())
+    return {_jst_day(ts) for ts in timestamps if ts is not None}
+
+def install_outbox_hooks(on_commit=None):
+    """
+    出退勤記録の追加・更新・削除時に、同一トランザクションで attendance_outbox へ変更イベントを追加するイベントを登録
+
+    イベントのデータバージョンはコミット直前の値（書き込み処理は commit 前に bump_data_version を呼び出す）。
+    日付をまたぐ更新は変更前後の日付ごとにイベントを追加する。
+
+    Args:
+        on_commit: イベントを含むトランザクションのコミット後に、そのイベント（ChangeEvent のリスト）を渡して呼び出す関数
+                   （コミットしたワーカーでのみ呼ばれる。配信スレッドの起床などに使用）
+    """
+
+    @event.listens_for(Session, 'before_flush')
+    def _collect_outbox_events(session, flush_context, instances):
+        pending = session.info.setdefault('attendance_outbox', [])
+        for obj in session.new:
+            if isinstance(obj, Attendance):
+                pending.append(('insert', obj, None))
+        for obj in session.dirty:
+            if isinstance(obj, Attendance) and session.is_modified(obj):
+                pending.append(('update', obj, _changed_days(obj)))
+        for obj in session.deleted:
+            if isinstance(obj, Attendance):
+                pending.append(('delete', obj, _changed_days(obj)))
+
+    @event.listens_for(Session, 'before_commit')
+    def _append_outbox_events(session):
+        session.flush()
+        pending = session.info.pop('attendance_outbox', None)
+        if not pending:
+            return
+        # 追加された記録のIDと team_id はフラッシュ後に確定する
+        events = {}
+        for kind, obj, days in pending:
+            for day in days or _changed_days(obj):
+                key = (obj.id, day)
+                # 同一トランザクション内で追加して削除した場合などは最初と最後の操作でまとめる
+                if key in events and events[key][0] == 'insert':
+                    kind = 'insert' if kind != 'delete' else None
+                events[key] = (kind, obj.team_id, obj.user_id)
+        versions = {}
+        rows = []
+        for (attendance_id, day), (kind, team_id, user_id) in events.items():
+            if kind is None:
+                continue
+            if team_id not in versions:
+                versions[team_id] = session.execute(
+                    db.select(DataVersion.version).where(DataVersion.team_id == team_id)
+                ).scalar() or 0
+            rows.append(AttendanceOutbox(team_id=team_id, user_id=user_id, attendance_id=attendance_id,
+                                         day=day, kind=kind, version=versions[team_id]))
+        session.add_all(rows)
+        session.flush()
+        session.info['attendance_outbox_committing'] = [
+            ChangeEvent(row.id, row.team_id, row.user_id, row.attendance_id, row.day, row.kind, row.version)
+            for row in rows
+        ]
+
+    @event.listens_for(Session, 'after_commit')
+    def _notify_outbox_events(session):
+        events = session.info.pop('attendance_outbox_committing', None)
+        if events and on_commit is not None:
+            try:
+                on_commit(events)
+            except Exception as e:
+                logger.error(f"Error in outbox commit callback: {e}")
+
+    @event.listens_for(Session, 'after_rollback')
+    def _discard_outbox_events(session):
+        session.info.pop('attendance_outbox', None)
+        session.info.pop('attendance_outbox_committing', None)
+
+class OutboxDispatcher:
+    """
+    attendance_outbox の変更イベントをワーカー内の購読者へ配信
+
+    各ワーカーは配信済みのイベントIDを保持し、それより新しいイベントを id の順に読み込んで配信する。
+    自ワーカーのコミット直後（notify）と OUTBOX_POLL_INTERVAL 秒ごとに配信スレッドが読み込むほか、
+    最新の状態が必要な処理は catch_up でデータバージョンに追いつくまで同期的に読み込める。
+
+    並行するトランザクションは id の順にコミットされるとは限らないため、未コミットの可能性がある
+    欠番は OUTBOX_GAP_TIMEOUT 秒まで待ち、その間に届いたイベントも重複なく配信する。
+    """
+
+    def __init__(self, app, poll_interval=None, batch_size=None, gap_timeout=None):
+        self.app = app
+        self.poll_interval = poll_interval if poll_interval is not None else float(
+            os.environ.get('OUTBOX_POLL_INTERVAL', 1.0))
+        self.batch_size = batch_size if batch_size is not None else int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+        self.gap_timeout = gap_timeout if gap_timeout is not None else outbox_gap_timeout()
+        self._subscribers = []
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._worker = BackgroundWorker(self._run, 'outbox-dispatcher')
+        self._cursor = None      # これ以下のIDはすべて配信済み（または欠番として確定）
+        self._seen = set()       # cursor より大きい配信済みのID
+        self._gap_since = None   # cursor の直後の欠番を最初に検出した時刻
+        self._versions = {}      # team_id -> 配信済みのイベントの最大データバージョン
+        self.delivered = 0
+        self.skipped_gaps = 0
+        self.errors = 0
+
+    def subscribe(self, callback):
+        """購読者を登録（callback は ChangeEvent のリストを受け取る）"""
+        self._subscribers.append(callback)
+        return callback
+
+    def notify(self):
+        """自ワーカーでイベントがコミットされたことを配信スレッドに通知"""
+        self._wakeup.set()
+
+    def start(self):
+        """配信スレッドを開始（fork後のワーカープロセスではスレッドを作り直す）"""
+        if self.poll_interval <= 0:
+            return
+        self._worker.ensure_started()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.poll()
+                except Exception as e:
+                    logger.error(f"Error dispatching outbox events: {e}")
+
+    def catch_up(self, team_id, version):
+        """ワークスペースのデータバージョン（version）までのイベントを配信済みにする"""
+        if version is None or self._versions.get(team_id, -1) >= version:
+            return
+        self.poll()
+        with self._lock:
+            # 同一トランザクションのイベントはバージョンと同時に可視になるため、以降は再読み込み不要
+            self._versions[team_id] = max(self._versions.get(team_id, -1), version)
+
+    def poll(self):
+        """未配信のイベントをすべて読み込んで配信（配信したイベント数を返す）"""
+        delivered = 0
+        # リクエスト処理中のセッションに影響しないよう、読み込みは専用のセッションで行う
+        with self._lock, Session(db.engine) as session:
+            if self._cursor is None:
+                # 起動時点までのイベントは購読者の初期状態に反映済み（キャッシュは空から始まる）
+                self._cursor = session.query(func.max(AttendanceOutbox.id)).scalar() or 0
+                return 0
+            high = max(self._seen) if self._seen else self._cursor
+            if high > self._cursor:
+                # 欠番の間に後からコミットされたイベント
+                rows = session.query(AttendanceOutbox).filter(
+                    AttendanceOutbox.id > self._cursor,
+                    AttendanceOutbox.id < high
+                ).order_by(AttendanceOutbox.id).all()
+                delivered += self._deliver_rows([row for row in rows if row.id not in self._seen])
+            while True:
+                rows = session.query(AttendanceOutbox).filter(
+                    AttendanceOutbox.id > high
+                ).order_by(AttendanceOutbox.id).limit(self.batch_size).all()
+                delivered += self._deliver_rows(rows)
+                if len(rows) < self.batch_size:
+                    break
+                high = rows[-1].id
+            self._advance_cursor()
+        return delivered
+
+    def _deliver_rows(self, rows):
+        if not rows:
+            return 0
+        self._deliver([
+            ChangeEvent(row.id, row.team_id, row.user_id, row.attendance_id, row.day, row.kind, row.version)
+            for row in rows
+        ])
+        self._seen.update(row.id for row in rows)
+        return len(rows)
+
+    def _deliver(self, events):
+        for callback in self._subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Outbox subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+        for change in events:
+            self._versions[change.team_id] = max(self._versions.get(change.team_id, -1), change.version)
+        self.delivered += len(events)
+
+    def _advance_cursor(self):
+        while self._seen:
+            if self._cursor + 1 in self._seen:
+                self._cursor += 1
+                self._seen.discard(self._cursor)
+                self._gap_since = None
+                continue
+            # 欠番（未コミットまたはロールバックされたトランザクション）は一定時間後に確定とみなす
+            now = time.monotonic()
+            if self._gap_since is None:
+                self._gap_since = now
+            if now - self._gap_since < self.gap_timeout:
+                return
+            next_seen = min(self._seen)
+            self.skipped_gaps += next_seen - self._cursor - 1
+            self._cursor = next_seen - 1
+            self._gap_since = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cursor': self._cursor,
+                'pending_gaps': len(self._seen),
+                'delivered': self.delivered,
+                'skipped_gaps': self.skipped_gaps,
+                'errors': self.errors,
+                'subscribers': len(self._subscribers)
+            }
+
+def outbox_gap_timeout():
+    """未コミットの可能性がある欠番を待つ時間（OUTBOX_GAP_TIMEOUT 秒、既定30秒）"""
+    return float(os.environ.get('OUTBOX_GAP_TIMEOUT', 30))
+
+def outbox_retention_days():
+    """変更イベントの保持期間（OUTBOX_RETENTION_DAYS 日、既定7日）"""
+    return float(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
+
+def prune_outbox(retention_days=None):
+    """保持期間（OUTBOX_RETENTION_DAYS 日、既定7日）を過ぎた変更イベントを削除"""
+    retention_days = retention_days if retention_days is not None else outbox_retention_days()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    deleted = AttendanceOutbox.query.filter(AttendanceOutbox.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} outbox events")
+    return deleted
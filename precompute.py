@@ -0,0 +1,176 @@
+import time
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import Session
+from models import db, User, Attendance, HoursSnapshot
+from timezones import naive_utc
+
+logger = logging.getLogger(__name__)
+
+def accumulate_work_hours(records, total_hours=0.0, open_checkin=None):
+    """
+    出退勤記録を時系列順に加算（日跨ぎ対応）
+
+    途中状態（累積労働時間, 退勤していない出勤の日時）から続けて加算できるため、
+    事前計算した累積値に以降の記録だけを足し込める。
+
+    Returns:
+        tuple: (丸める前の累積労働時間, 退勤していない出勤の日時 または None)
+    """
+    for record in sorted(records, key=lambda x: x.timestamp):
+        if record.type == '出勤':
+            # 既に出勤中の場合は、前の出勤記録を更新
+            open_checkin = record.timestamp
+        elif record.type == '退勤' and open_checkin is not None:
+            total_hours += (record.timestamp - open_checkin).total_seconds() / 3600
+            open_checkin = None  # 退勤したのでリセット
+    return total_hours, open_checkin
+
+def precompute_hours_snapshots(team_id, as_of, full=False):
+    """
+    as_of より前の出退勤記録からユーザーごとの累積労働時間を事前計算して保存
+
+    既存のスナップショットがある場合はその境界以降の記録だけを加算する
+    （スナップショットがない・無効化された・境界が as_of より後のユーザーは全記録から計算）。
+
+    Args:
+        as_of: 集計の境界（UTC）
+        full: 既存のスナップショットを使わずに全記録から計算し直す
+
+    Returns:
+        dict: 処理したユーザー数などの統計
+    """
+    as_of = naive_utc(as_of)
+    started = time.perf_counter()
+    snapshots = {snapshot.user_id: snapshot for snapshot in HoursSnapshot.query.filter_by(team_id=team_id)}
+    stats = {'users': 0, 'current': 0, 'incremental': 0, 'full': 0, 'records': 0}
+    for (user_id,) in db.session.query(User.id).filter_by(team_id=team_id):
+        stats['users'] += 1
+        snapshot = snapshots.get(user_id)
+        if snapshot is not None and snapshot.as_of == as_of and not full:
+            stats['current'] += 1
+            continue
+
+        query = db.session.query(Attendance.type, Attendance.timestamp).filter(
+            Attendance.team_id == team_id,
+            Attendance.user_id == user_id,
+            Attendance.timestamp < as_of
+        )
+        if snapshot is not None and snapshot.as_of < as_of and not full:
+            query = query.filter(Attendance.timestamp >= snapshot.as_of)
+            total_hours, open_checkin = snapshot.total_hours, snapshot.open_checkin_at
+            stats['incremental'] += 1
+        else:
+            total_hours, open_checkin = 0.0, None
+            stats['full'] += 1
+        records = query.all()
+        stats['records'] += len(records)
+        total_hours, open_checkin = accumulate_work_hours(records, total_hours, open_checkin)
+
+        if snapshot is None:
+            snapshot = HoursSnapshot(team_id=team_id, user_id=user_id)
+            db.session.add(snapshot)
+        snapshot.as_of = as_of
+        snapshot.total_hours = total_hours
+        snapshot.open_checkin_at = open_checkin
+        snapshot.computed_at = datetime.now(timezone.utc)
+    db.session.commit()
+    stats['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
+
+def load_records_after_snapshots(read_db, team_id, user_ids, until, since=None):
+    """
+    事前計算済みの累積労働時間と、それ以降（until まで、None の場合は未来の日時を含む全記録）の出退勤記録を読み込む
+
+    スナップショットのないユーザーのみ全記録を読み込むため、読み込む記録数は履歴の長さではなく
+    境界（通常は当日の開始）以降の記録数で決まる。
+
+    Args:
+        until: 累積労働時間の集計終了日時（UTC、None の場合は終了日時を指定しない）
+        since: これ以降の記録も併せて読み込む（期間の労働時間の計算用、UTC）
+
+    Returns:
+        tuple: (user_id -> HoursSnapshot, user_id -> 時系列順の出退勤記録のリスト)
+    """
+    snapshot_query = read_db.query(HoursSnapshot).filter(HoursSnapshot.team_id == team_id)
+    query = read_db.query(Attendance).filter(Attendance.team_id == team_id)
+    if until is not None:
+        until = naive_utc(until)
+        snapshot_query = snapshot_query.filter(HoursSnapshot.as_of <= until)
+        query = query.filter(Attendance.timestamp <= until)
+    snapshots = {snapshot.user_id: snapshot for snapshot in snapshot_query}
+    boundaries = [snapshot.as_of for snapshot in snapshots.values()]
+    if since is not None:
+        boundaries.append(naive_utc(since))
+    missing = [user_id for user_id in user_ids if user_id not in snapshots]
+
+    if boundaries:
+        scan_from = Attendance.timestamp >= min(boundaries)
+        query = query.filter(or_(scan_from, Attendance.user_id.in_(missing)) if missing else scan_from)
+    records_by_user = {user_id: [] for user_id in user_ids}
+    for record in query.order_by(Attendance.user_id, Attendance.timestamp).yield_per(1000):
+        records_by_user.setdefault(record.user_id, []).append(record)
+    return snapshots, records_by_user
+
+def cumulative_hours_from(snapshot, records):
+    """事前計算済みの累積労働時間に、境界以降の出退勤記録を加算（snapshot が None の場合は全記録から計算）"""
+    if snapshot is None:
+        total_hours, _ = accumulate_work_hours(records)
+    else:
+        total_hours, _ = accumulate_work_hours(
+            [r for r in records if naive_utc(r.timestamp) >= snapshot.as_of],
+            snapshot.total_hours, snapshot.open_checkin_at
+        )
+    return round(total_hours, 2)
+
+def _stale_before(obj):
+    """出退勤記録の変更前後の日時のうち最も古いもの（それより後の境界のスナップショットが無効になる）"""
+    timestamps = [obj.timestamp]
+    state = inspect(obj)
+    if state.persistent or state.deleted:
+        history = state.attrs.timestamp.history
+        timestamps.extend(history.deleted or ())
+        timestamps.extend(history.unchanged or ())
+    timestamps = [naive_utc(ts) for ts in timestamps if ts is not None]
+    return min(timestamps) if timestamps else None
+
+def install_snapshot_invalidation_hooks(boundary_func):
+    """
+    境界より前の出退勤記録の追加・更新・削除時に、コミット前に該当ユーザーのスナップショットを削除するイベントを登録
+
+    削除されたユーザーは次回の事前計算まで全記録から計算される。
+
+    Args:
+        boundary_func: 現在の集計の境界（UTC）を返す関数（これ以降の記録の変更はスナップショットに影響しない）
+    """
+
+    @event.listens_for(Session, 'before_flush')
+    def _collect_stale_snapshots(session, flush_context, instances):
+        boundary = None
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if not isinstance(obj, Attendance) or obj.user_id is None:
+                continue
+            stale_before = _stale_before(obj)
+            if stale_before is None:
+                continue
+            if boundary is None:
+                boundary = naive_utc(boundary_func())
+            # 当日の打刻（通常の打刻）はスナップショットに影響しない
+            if stale_before < boundary:
+                stale = session.info.setdefault('hours_snapshot_stale', {})
+                stale[obj.user_id] = min(stale.get(obj.user_id, stale_before), stale_before)
+
+    @event.listens_for(Session, 'before_commit')
+    def _delete_stale_snapshots(session):
+        session.flush()
+        stale = session.info.pop('hours_snapshot_stale', None)
+        for user_id, stale_before in (stale or {}).items():
+            session.query(HoursSnapshot).filter(
+                HoursSnapshot.user_id == user_id,
+                HoursSnapshot.as_of > stale_before
+            ).delete(synchronize_session=False)
+
+    @event.listens_for(Session, 'after_rollback')
+    def _discard_stale_snapshots(session):
+        session.info.pop('hours_snapshot_stale', None)
@@ -0,0 +1,224 @@
+import os
+import mmap
+import time
+import struct
+import threading
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+# 出勤中のメンバーとして返すユーザー情報（テンプレート・返信では display_name のみ使用）
+PresenceUser = namedtuple('PresenceUser', ['id', 'slack_user_id', 'display_name'])
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# ヘッダー: 識別子, 最大件数, 件数, 世代（書き込み中は奇数）, 構築したプロセスID, 溢れ
+_HEADER = struct.Struct('<8sIIQiI')
+_MAGIC = b'PRESNC01'
+# 1件: ワークスペースID, ユーザーID, 出勤日時（UNIXエポックからのマイクロ秒、UTC）, SlackユーザーID, 表示名（UTF-8）
+_ENTRY = struct.Struct('<20sqq20s96s')
+
+def _encode(text, size):
+    data = (text or '').encode('utf-8')[:size]
+    # 途中で切れた文字を除く
+    return data.decode('utf-8', 'ignore').encode('utf-8')
+
+class PresenceTable:
+    """
+    出勤中のユーザーの共有メモリ上の表（全ワーカーでデータベースに問い合わせずに参照）
+
+    最新の打刻が出勤のユーザーだけを固定長の行で保持する。ファイル（既定は /dev/shm）をメモリマップし、
+    gunicorn の全ワーカーが同じ表を参照する。書き込みはワーカー間でファイルロック（flock）をかけて
+    1つずつ行い、読み取りはロックせずに世代番号が書き込みの前後で変わっていないことを確認する（seqlock）。
+
+    データベースからの取得もロック中に行うため、後からコミットされた変更が古い内容で上書きされない。
+    未構築・溢れ・読み取りの競合が続いた場合は members() が None を返す（呼び出し元はデータベースから取得する）。
+    """
+
+    def __init__(self, path, capacity=None, enabled=True):
+        self.path = path
+        self.capacity = capacity if capacity is not None else int(os.environ.get('PRESENCE_CAPACITY', 4096))
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._mm = None
+        self._fd = None
+        self._pid = None
+        self.reads = 0
+        self.fallbacks = 0
+        self.writes = 0
+
+    def _map(self):
+        # fork後のワーカープロセスではロック用のファイル記述子を開き直す（マップは共有のまま引き継ぐ）
+        if self._mm is not None and self._pid == os.getpid():
+            return self._mm
+        size = _HEADER.size + self.capacity * _ENTRY.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if self._mm is None:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+            magic, capacity = _HEADER.unpack_from(mm, 0)[:2]
+            if magic != _MAGIC or capacity != self.capacity:
+                # 未初期化または形式の異なるファイルは未構築の状態にする
+                _HEADER.pack_into(mm, 0, _MAGIC, self.capacity, 0, 0, 0, 0)
+            self._mm = mm
+        self._fd = fd
+        self._pid = os.getpid()
+        return self._mm
+
+    def _lock_file(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock_file(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _write(self, modify, builder=None):
+        """
+        全件を読み込み、modify で変更した結果を書き戻す（世代番号を書き込み中は奇数にする）
+
+        Args:
+            builder: 作り直す場合の構築したプロセスID（空の表を modify に渡す）
+        """
+        with self._lock:
+            mm = self._map()
+            self._lock_file()
+            try:
+                _, _, count, generation, built_by, overflow = _HEADER.unpack_from(mm, 0)
+                entries = {} if builder is not None else {
+                    (team_id, user_id): rest for team_id, user_id, *rest in self._entries(mm, count)}
+                modify(entries)
+                if builder is not None:
+                    built_by, overflow = builder, 0
+                if len(entries) > self.capacity:
+                    overflow = 1
+                generation |= 1
+                _HEADER.pack_into(mm, 0, _MAGIC, self.capacity, count, generation, built_by, overflow)
+                packed = list(entries.items())[:self.capacity]
+                for i, ((team_id, user_id), (checkin_micros, slack_user_id, display_name)) in enumerate(packed):
+                    _ENTRY.pack_into(mm, _HEADER.size + i * _ENTRY.size, team_id.encode('ascii'), user_id,
+                                     checkin_micros, slack_user_id, display_name)
+                _HEADER.pack_into(mm, 0, _MAGIC, self.capacity, len(packed), generation + 1, built_by, overflow)
+                self.writes += 1
+            finally:
+                self._unlock_file()
+
+    @staticmethod
+    def _entries(mm, count):
+        for team_id, user_id, checkin_micros, slack_user_id, display_name in _ENTRY.iter_unpack(
+                mm[_HEADER.size:_HEADER.size + count * _ENTRY.size]):
+            yield team_id.rstrip(b'\0').decode('ascii'), user_id, checkin_micros, slack_user_id, display_name
+
+    @staticmethod
+    def _entry_values(checkin_time, slack_user_id, display_name):
+        return ((checkin_time.replace(tzinfo=None) - _EPOCH) // _MICROSECOND,
+                _encode(slack_user_id, 20), _encode(display_name, 96))
+
+    def rebuild(self, load_rows):
+        """
+        出勤中のユーザーで表を作り直す（起動時・定期実行）
+
+        Args:
+            load_rows: (ワークスペースID, ユーザーID, 出勤日時（UTC）, SlackユーザーID, 表示名) の列を返す関数
+        """
+        if not self.enabled:
+            return
+
+        def replace(entries):
+            for team_id, user_id, checkin_time, slack_user_id, display_name in load_rows():
+                entries[(team_id, user_id)] = self._entry_values(checkin_time, slack_user_id, display_name)
+        self._write(replace, builder=os.getpid())
+
+    def refresh(self, keys, load_latest):
+        """
+        ユーザーの最新の打刻を反映（出勤なら追加・更新、退勤・記録なしなら削除）
+
+        Args:
+            keys: (ワークスペースID, ユーザーID) の列
+            load_latest: (ワークスペースID, ユーザーID) から (種別, 日時（UTC）, SlackユーザーID, 表示名)
+                         または None を返す関数
+        """
+        if not self.enabled:
+            return
+
+        def apply(entries):
+            for team_id, user_id in keys:
+                latest = load_latest(team_id, user_id)
+                if latest is not None and latest[0] == '出勤':
+                    entries[(team_id, user_id)] = self._entry_values(latest[1], latest[2], latest[3])
+                else:
+                    entries.pop((team_id, user_id), None)
+        self._write(apply)
+
+    def invalidate(self):
+        """表を未構築の状態にする（変更を反映できなかった場合、次の再構築まで各ワーカーはデータベースから取得）"""
+        if not self.enabled:
+            return
+
+        def clear(entries):
+            entries.clear()
+        self._write(clear, builder=0)
+
+    def members(self, team_id):
+        """
+        ワークスペースの出勤中のユーザー（読み取りは共有メモリのみ）
+
+        Returns:
+            list: (PresenceUser, 出勤日時（UTC、タイムゾーンなし）) のリスト。参照できない場合は None
+        """
+        if not self.enabled:
+            return None
+        mm = self._map()
+        for _ in range(100):
+            _, _, count, generation, built_by, overflow = _HEADER.unpack_from(mm, 0)
+            if not built_by or overflow:
+                break
+            if generation & 1:
+                time.sleep(0)  # 書き込み中のスレッドに実行を譲る
+                continue
+            data = mm[_HEADER.size:_HEADER.size + count * _ENTRY.size]
+            if _HEADER.unpack_from(mm, 0)[3] != generation:
+                continue
+            self.reads += 1
+            team = team_id.encode('ascii')
+            return [
+                (PresenceUser(user_id, slack_user_id.rstrip(b'\0').decode('utf-8'),
+                              display_name.rstrip(b'\0').decode('utf-8')),
+                 _EPOCH + _MICROSECOND * checkin_micros)
+                for entry_team, user_id, checkin_micros, slack_user_id, display_name in _ENTRY.iter_unpack(data)
+                if entry_team.rstrip(b'\0') == team
+            ]
+        self.fallbacks += 1
+        return None
+
+    def generation(self):
+        """表の世代番号（変更のたびに増加、描画結果のキャッシュキー用）"""
+        if not self.enabled:
+            return 0
+        return _HEADER.unpack_from(self._map(), 0)[3]
+
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        _, _, count, generation, built_by, overflow = _HEADER.unpack_from(self._map(), 0)
+        return {
+            'enabled': True,
+            'path': self.path,
+            'entries': count,
+            'capacity': self.capacity,
+            'built_by': built_by or None,
+            'overflow': bool(overflow),
+            'generation': generation,
+            'reads': self.reads,
+            'fallbacks': self.fallbacks,
+            'writes': self.writes
+        }
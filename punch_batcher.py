@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from models import db, User, Attendance
+from tracing import tracer
+from background_worker import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PunchRequest:
+    """送信待ちの打刻（profile は未登録ユーザーの場合のみ、Slackから取得した表示名とメールアドレス）"""
+    team_id: str
+    slack_user_id: str
+    kind: str
+    timestamp: object
+    profile: dict = None
+    future: Future = field(default_factory=Future)
+    trace: object = field(default_factory=tracer.capture)  # 呼び出し元のトレース
+    queued_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+def commit_punches(requests):
+    """
+    複数の打刻を1トランザクションで記録（未登録ユーザーの作成を含む）
+
+    Returns:
+        list: 打刻ごとの出退勤記録ID（requests と同じ並び）
+    """
+    from cache import bump_data_version
+
+    users = {}
+    slack_user_ids_by_team = {}
+    for request in requests:
+        slack_user_ids_by_team.setdefault(request.team_id, set()).add(request.slack_user_id)
+    for team_id, slack_user_ids in slack_user_ids_by_team.items():
+        for user in User.query.filter(User.team_id == team_id, User.slack_user_id.in_(slack_user_ids)):
+            users[(team_id, user.slack_user_id)] = user
+
+    for request in requests:
+        key = (request.team_id, request.slack_user_id)
+        if key not in users:
+            profile = request.profile or {}
+            users[key] = User(
+                team_id=request.team_id,
+                slack_user_id=request.slack_user_id,
+                display_name=profile.get('display_name') or f'User_{request.slack_user_id[-4:]}',
+                email=profile.get('email', '')
+            )
+            db.session.add(users[key])
+    db.session.flush()
+
+    attendances = [
+        Attendance(
+            team_id=request.team_id,
+            user_id=users[(request.team_id, request.slack_user_id)].id,
+            type=request.kind,
+            timestamp=request.timestamp
+        )
+        for request in requests
+    ]
+    db.session.add_all(attendances)
+    db.session.flush()
+    attendance_ids = [attendance.id for attendance in attendances]
+    for team_id in slack_user_ids_by_team:
+        bump_data_version(team_id)
+    db.session.commit()
+    return attendance_ids
+
+class PunchBatcher:
+    """
+    打刻のグループコミット用キュー
+
+    打刻を最大 max_rows 件、または最初の打刻から max_wait 秒までまとめて1回のコミットで記録する。
+    呼び出し元は記録の完了（コミット）まで待機し、記録IDを受け取る。
+    一括記録に失敗した場合は1件ずつ記録し直し、失敗した打刻の呼び出し元にのみ例外を返す。
+    writer（sqlite_profile.SingleWriter）を指定した場合は、他の書き込みの完了を待ってから記録する。
+    """
+
+    def __init__(self, app, max_rows=None, max_wait=None, writer=None):
+        self.app = app
+        self.writer = writer
+        self.max_rows = max_rows if max_rows is not None else int(os.environ.get('PUNCH_BATCH_MAX_ROWS', 50))
+        self.max_wait = max_wait if max_wait is not None else float(
+            os.environ.get('PUNCH_BATCH_MAX_WAIT_MS', 5)) / 1000
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._worker = BackgroundWorker(self._run, 'punch-batcher')
+        self.batches = 0
+        self.punches = 0
+        self.max_batch = 0
+        self.fallbacks = 0
+
+    def submit(self, team_id, slack_user_id, kind, timestamp, profile=None):
+        """打刻をキューに追加（Future で記録IDを返す）"""
+        request = PunchRequest(team_id, slack_user_id, kind, timestamp, profile)
+        with self._cond:
+            self._queue.append(request)
+            self._worker.ensure_started()
+            self._cond.notify()
+        return request.future
+
+    def record(self, team_id, slack_user_id, kind, timestamp, profile=None, timeout=10):
+        """
+        打刻をキューに追加してコミットまで待機（記録IDを返す）
+
+        timeout 秒以内に記録が始まらなかった打刻は取り消して TimeoutError を送出する（後から記録されない）。
+        記録が始まっている打刻はコミットの結果を待つ。
+        """
+        future = self.submit(team_id, slack_user_id, kind, timestamp, profile)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise
+            return future.result()
+
+    def qsize(self):
+        """記録待ちの打刻数"""
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        """一括記録の統計"""
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'batches': self.batches,
+                'punches': self.punches,
+                'max_batch': self.max_batch,
+                'average_batch': round(self.punches / self.batches, 2) if self.batches else 0,
+                'fallbacks': self.fallbacks
+            }
+
+    def _serialize(self):
+        return self.writer.serialize() if self.writer is not None else nullcontext()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # 最初の打刻から max_wait 秒、または max_rows 件に達するまで待つ
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._queue.popleft() for _ in range(min(self.max_rows, len(self._queue)))]
+            # 待機を打ち切って取り消された打刻は記録しない
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                return batch
+            self.batches += 1
+            self.punches += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            with self.app.app_context():
+                try:
+                    started_at = datetime.now(timezone.utc)
+                    started = time.perf_counter()
+                    try:
+                        with self._serialize():
+                            attendance_ids = commit_punches(batch)
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.warning(f"Batch commit of {len(batch)} punches failed, retrying one by one: {e}")
+                        with self._cond:
+                            self.fallbacks += 1
+                        self._commit_individually(batch)
+                        continue
+                    # コミット後の処理は失敗しても記録し直さない（重複して記録しない）
+                    try:
+                        self._record_traces(batch, started_at, (time.perf_counter() - started) * 1000)
+                    except Exception as e:
+                        logger.error(f"Error recording punch batch traces: {e}")
+                    for request, attendance_id in zip(batch, attendance_ids):
+                        request.future.set_result(attendance_id)
+                finally:
+                    db.session.remove()
+
+    @staticmethod
+    def _record_traces(batch, started_at, commit_ms):
+        """一括記録の待ち時間とコミット時間を各打刻のトレースに記録"""
+        for request in batch:
+            tracer.record(request.trace, 'punch.batch_wait', request.queued_at,
+                          (started_at - request.queued_at).total_seconds() * 1000)
+            tracer.record(request.trace, 'punch.batch_commit', started_at, commit_ms, **{'punch.batch_size': len(batch)})
+
+    def _commit_individually(self, batch):
+        for request in batch:
+            try:
+                with self._serialize():
+                    attendance_id = commit_punches([request])[0]
+                request.future.set_result(attendance_id)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error recording punch for {request.slack_user_id}: {e}")
+                request.future.set_exception(e)
@@ -0,0 +1,131 @@
+import os
+import threading
+import logging
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone, timedelta
+from models import db, Attendance
+from timezones import JST_TZ, naive_utc
+
+logger = logging.getLogger(__name__)
+
+# 一覧表示用の出退勤記録（セッションに依存しないため、リクエストをまたいで保持できる）
+AttendanceRow = namedtuple('AttendanceRow', ['id', 'type', 'timestamp', 'updated_at'])
+
+def jst_day(timestamp):
+    """日時（UTC）の日本時間の日付"""
+    return naive_utc(timestamp).replace(tzinfo=timezone.utc).astimezone(JST_TZ).date()
+
+def day_start_utc(day):
+    """日本時間の日付の開始日時（UTC、タイムゾーンなし）"""
+    return naive_utc(JST_TZ.localize(datetime.combine(day, datetime.min.time())))
+
+class AttendanceRangeCache:
+    """
+    ユーザーごとの出退勤記録の日別キャッシュ（日本時間の日付単位）
+
+    期間指定の一覧表示で、取得済みの日はキャッシュから返し、未取得の日だけを連続する日ごとに
+    まとめて1回のクエリで取得する。当日以降の記録は打刻で随時増えるため常にDBから取得する。
+    記録の変更は attendance_outbox の変更イベント（apply_events）で該当する日だけを破棄する。
+    """
+
+    def __init__(self, max_users=None):
+        self.max_users = max_users if max_users is not None else int(
+            os.environ.get('ATTENDANCE_RANGE_CACHE_USERS', 256))
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # (team_id, user_id) -> {日付: 記録のタプル}
+        self._generation = 0  # 変更イベントを反映した回数（取得中に破棄された日を保存しないため）
+        self.hits = 0     # キャッシュから返した日数
+        self.misses = 0   # DBから取得した日数
+        self.queries = 0
+
+    def apply_events(self, events):
+        """出退勤記録の変更イベント（outbox.ChangeEvent）の日を破棄"""
+        with self._lock:
+            self._generation += 1
+            for change in events:
+                days = self._users.get((change.team_id, change.user_id))
+                if days is not None:
+                    days.pop(change.day, None)
+
+    def attendances(self, team_id, user_id, start, end, today=None):
+        """
+        期間内のユーザーの出退勤記録を新しい順で取得
+
+        Args:
+            start, end: 期間の開始・終了日時（UTC）
+            today: 当日（日本時間、省略時は現在の日付）
+        """
+        start, end = naive_utc(start), naive_utc(end)
+        today = today or datetime.now(JST_TZ).date()
+        first_day, last_day = jst_day(start), jst_day(end)
+        key = (team_id, user_id)
+
+        # キャッシュ対象は当日より前の日のみ
+        cached_days = [first_day + timedelta(days=i)
+                       for i in range((min(last_day, today - timedelta(days=1)) - first_day).days + 1)]
+        with self._lock:
+            days = self._users.get(key)
+            if days is None:
+                days = self._users[key] = {}
+            self._users.move_to_end(key)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            generation = self._generation
+            missing = [day for day in cached_days if day not in days]
+            self.hits += len(cached_days) - len(missing)
+            self.misses += len(missing)
+
+        fetched = {}
+        for run_start, run_end in self._runs(missing):
+            buckets = {run_start + timedelta(days=i): [] for i in range((run_end - run_start).days + 1)}
+            for row in self._query(team_id, user_id, day_start_utc(run_start),
+                                   day_start_utc(run_end + timedelta(days=1))):
+                buckets[jst_day(row.timestamp)].append(row)
+            fetched.update((day, tuple(rows)) for day, rows in buckets.items())
+
+        with self._lock:
+            if generation == self._generation:
+                days.update(fetched)
+            rows = [row for day in cached_days for row in (days.get(day) or fetched.get(day, ()))]
+        if last_day >= today:
+            rows.extend(self._query(team_id, user_id, max(start, day_start_utc(today)), end, inclusive=True))
+        rows = [row for row in rows if start <= row.timestamp <= end]
+        rows.sort(key=lambda row: row.timestamp, reverse=True)
+        return rows
+
+    @staticmethod
+    def _runs(days):
+        """日付のリストを連続する日の (開始日, 終了日) にまとめる"""
+        runs = []
+        for day in days:
+            if runs and runs[-1][1] + timedelta(days=1) == day:
+                runs[-1][1] = day
+            else:
+                runs.append([day, day])
+        return [tuple(run) for run in runs]
+
+    def _query(self, team_id, user_id, start, end, inclusive=False):
+        self.queries += 1
+        query = db.session.query(Attendance.id, Attendance.type, Attendance.timestamp, Attendance.updated_at).filter(
+            Attendance.team_id == team_id,
+            Attendance.user_id == user_id,
+            Attendance.timestamp >= start,
+            Attendance.timestamp <= end if inclusive else Attendance.timestamp < end
+        ).order_by(Attendance.timestamp)
+        return [AttendanceRow(*row) for row in query]
+
+    def clear(self, team_id=None):
+        """キャッシュを破棄（team_id 指定時はそのワークスペースのみ）"""
+        with self._lock:
+            for key in [key for key in self._users if team_id is None or key[0] == team_id]:
+                del self._users[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'days': sum(len(days) for days in self._users.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'queries': self.queries
+            }
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import scoped_session, sessionmaker
+from models import db, DataVersion
+from cache import get_data_version
+
+logger = logging.getLogger(__name__)
+
+class ReplicaRouter:
+    """
+    分析・ダッシュボード向けの読み取りをリードレプリカに振り分けるルーター
+
+    レプリカのデータバージョンの行（data_version）をプライマリと比較して遅延を見積もり、
+    許容遅延（REPLICA_MAX_LAG_SECONDS）を超える場合や接続できない場合はプライマリを使用する。
+    打刻などの書き込みと、書き込み直後の読み取り（自分の記録の表示など）は常にプライマリで行う。
+    """
+
+    def __init__(self, url=None, engine_options=None, max_lag=None, retry_interval=None):
+        self.url = url if url is not None else os.environ.get('DATABASE_REPLICA_URL')
+        self.engine_options = dict(engine_options or {})
+        self.max_lag = max_lag if max_lag is not None else float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 30))
+        # 接続エラー後、レプリカの利用を再試行するまでの秒数
+        self.retry_interval = retry_interval if retry_interval is not None else float(
+            os.environ.get('REPLICA_RETRY_INTERVAL', 30))
+        self._lock = threading.Lock()
+        self._engine = None
+        self._session = None
+        self._down_until = 0.0
+        self.last_error = None
+        self.reads = {'replica': 0, 'primary': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.url)
+
+    def _get_session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._engine = create_engine(self.url, **self.engine_options)
+                    self._session = scoped_session(sessionmaker(bind=self._engine))
+        return self._session
+
+    def _use(self, target):
+        self.reads[target] += 1
+        return self._session if target == 'replica' else db.session
+
+    def read_session(self, team_id, max_lag=None):
+        """
+        読み取りに使用するセッションを取得
+
+        Args:
+            team_id: 読み取り対象のワークスペースID
+            max_lag: 許容する遅延（秒）。0 を指定するとプライマリに追いついている場合のみレプリカを使用
+                     （データバージョン単位でキャッシュする描画結果など）。省略時は REPLICA_MAX_LAG_SECONDS
+        """
+        if not self.enabled or time.monotonic() < self._down_until:
+            return self._use('primary')
+        max_lag = self.max_lag if max_lag is None else max_lag
+
+        try:
+            replica = self._get_session()
+            row = replica.execute(
+                select(DataVersion.version, DataVersion.updated_at).where(DataVersion.team_id == team_id)
+            ).first()
+        except Exception as e:
+            logger.warning(f"Read replica unavailable, falling back to primary: {e}")
+            self.last_error = str(e)
+            self._down_until = time.monotonic() + self.retry_interval
+            self.remove()
+            return self._use('primary')
+
+        primary_version = get_data_version(team_id)
+        if row is None or primary_version is None:
+            return self._use('primary')
+        if row.version >= primary_version:
+            return self._use('replica')
+        # レプリカに未反映の更新は、レプリカが最後に反映した更新より後に行われたもの
+        if max_lag > 0 and row.updated_at is not None:
+            lag = (datetime.now(timezone.utc).replace(tzinfo=None) - row.updated_at.replace(tzinfo=None)).total_seconds()
+            if lag <= max_lag:
+                return self._use('replica')
+        return self._use('primary')
+
+    def remove(self):
+        """リクエスト終了時にレプリカのセッションを破棄"""
+        if self._session is not None:
+            self._session.remove()
+
+    def dispose(self):
+        """fork後のワーカーでレプリカの接続を破棄"""
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+
+    def status(self):
+        """ヘルスチェック用のレプリカ利用状況"""
+        return {
+            'enabled': self.enabled,
+            'available': self.enabled and time.monotonic() >= self._down_until,
+            'max_lag_seconds': self.max_lag,
+            'reads': dict(self.reads),
+            'last_error': self.last_error
+        }
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PeriodicScheduler:
+    """
+    アプリケーション内で定期ジョブを実行するスケジューラー
+
+    gunicorn の複数ワーカーで同じジョブが重複実行されないよう、
+    ファイルロックを取得できた1プロセスだけがジョブを実行する。
+    """
+
+    def __init__(self, app, lock_path=None):
+        self.app = app
+        self.lock_path = lock_path or os.environ.get(
+            'SCHEDULER_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'arabesque-time-scheduler.lock'))
+        self._jobs = {}
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def add_job(self, name, interval, func, run_at_start=False):
+        """ジョブを登録（interval は秒）"""
+        next_run = time.monotonic() if run_at_start else time.monotonic() + interval
+        self._jobs[name] = {
+            'interval': interval,
+            'func': func,
+            'next_run': next_run,
+            'last_run': None,
+            'last_duration': None,
+            'last_error': None
+        }
+
+    def run_job(self, name):
+        """ジョブを即時実行（アプリケーションコンテキスト内）"""
+        from models import db
+
+        job = self._jobs[name]
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                try:
+                    job['func']()
+                finally:
+                    db.session.remove()
+            job['last_error'] = None
+        except Exception as e:
+            logger.error(f"Scheduled job {name} failed: {e}")
+            job['last_error'] = str(e)
+        job['last_run'] = time.time()
+        job['last_duration'] = round(time.perf_counter() - started, 3)
+
+    def _acquire_lock(self):
+        try:
+            import fcntl
+        except ImportError:
+            # fcntl が使えない環境では単一プロセスとみなす
+            return True
+        try:
+            self._lock_file = open(self.lock_path, 'w')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            return False
+
+    def start(self):
+        """スケジューラーを開始（他のプロセスが実行中の場合は False）"""
+        if self._thread is not None and self._thread.is_alive():
+            return True
+        if not self._jobs:
+            return False
+        if not self._acquire_lock():
+            logger.info(f"Scheduler is running in another process (pid {os.getpid()} skipped)")
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"Scheduler started in pid {os.getpid()} with jobs: {list(self._jobs)}")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def status(self):
+        """ジョブの実行状況"""
+        return {
+            name: {key: job[key] for key in ('interval', 'last_run', 'last_duration', 'last_error')}
+            for name, job in self._jobs.items()
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for name, job in self._jobs.items():
+                if job['next_run'] <= now:
+                    self.run_job(name)
+                    job['next_run'] = time.monotonic() + job['interval']
+            next_run = min(job['next_run'] for job in self._jobs.values())
+            self._wakeup.wait(max(0, next_run - time.monotonic()))
+            self._wakeup.clear()
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+import atexit
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from tracing import tracer
+from background_worker import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """チャンネルごとの送信レートを制限するトークンバケット"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now):
+        """トークンが1つ使えるようになるまでの秒数（0なら即時送信可能）"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """トークンを1つ消費"""
+        self._refill(now)
+        self.tokens -= 1
+
+class SlackMessageSender:
+    """
+    Slackへの返信メッセージを非同期に送信するキュー
+
+    - ワークスペース・チャンネルごとのトークンバケットで chat.postMessage のレート制限内に収める
+    - 429（ratelimited）を受けた場合は Retry-After の間だけそのワークスペースの送信を停止して再送
+    - 送信待ちの同一チャンネル・同一本文のメッセージは1通にまとめる
+
+    送信スレッドはプロセス（gunicornワーカー）ごとに初回送信時に起動する。
+    """
+
+    def __init__(self, client_factory, rate=None, burst=None, max_attempts=5):
+        self.client_factory = client_factory
+        self.rate = rate if rate is not None else float(os.environ.get('SLACK_SEND_RATE', 1.0))
+        self.burst = burst if burst is not None else int(os.environ.get('SLACK_SEND_BURST', 3))
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._channels = OrderedDict()  # (team_id, channel) -> deque([text, attempts])
+        self._pending = set()           # 重複送信の集約用 (team_id, channel, text)
+        self._buckets = {}
+        self._retry_until = {}          # team_id -> 送信再開時刻
+        self._in_flight = 0
+        self._worker = BackgroundWorker(self._run, 'slack-sender')
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def send(self, channel, text, team_id=None):
+        """メッセージを送信キューに追加（重複時は False）"""
+        with self._cond:
+            key = (team_id, channel, text)
+            if key in self._pending:
+                self.coalesced += 1
+                return False
+            self._pending.add(key)
+            # [本文, 送信回数, 呼び出し元のトレース, 追加日時]
+            self._channels.setdefault((team_id, channel), deque()).append(
+                [text, 0, tracer.capture(), datetime.now(timezone.utc)])
+            self._worker.ensure_started()
+            self._cond.notify()
+        return True
+
+    def qsize(self):
+        """送信待ちのメッセージ数"""
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self, timeout=10):
+        """送信待ちのメッセージがなくなるまで待機（テスト・終了処理用）"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        """送信状況の統計"""
+        with self._cond:
+            return {
+                'queued': len(self._pending),
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'rate_limited': self.rate_limited,
+                'failed': self.failed
+            }
+
+    def _next_message(self, now):
+        """送信可能なメッセージを取り出す（なければ次に送信可能になるまでの秒数を返す）"""
+        wait = None
+        for key, messages in self._channels.items():
+            retry_until = self._retry_until.get(key[0], 0)
+            if now < retry_until:
+                channel_wait = retry_until - now
+            else:
+                bucket = self._buckets.setdefault(key, TokenBucket(self.rate, self.burst))
+                channel_wait = bucket.wait_time(now)
+            if channel_wait == 0:
+                self._buckets[key].take(now)
+                message = messages.popleft()
+                if not messages:
+                    del self._channels[key]
+                else:
+                    # 他のチャンネルを優先するため末尾へ回す
+                    self._channels.move_to_end(key)
+                return (key, message), 0
+            wait = channel_wait if wait is None else min(wait, channel_wait)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    item, wait = self._next_message(time.monotonic())
+                    if item is not None:
+                        break
+                    self._cond.wait(wait)
+                self._in_flight += 1
+
+            key, message = item
+            try:
+                self._deliver(key, message)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _deliver(self, key, message):
+        from slack_sdk.errors import SlackApiError
+
+        team_id, channel = key
+        text, attempts, trace, queued_at = message
+        if attempts == 0:
+            tracer.record(trace, 'slack.send_queue', queued_at,
+                          (datetime.now(timezone.utc) - queued_at).total_seconds() * 1000, **{'slack.channel': channel})
+        try:
+            with tracer.resume(trace, 'slack.send', **{'slack.channel': channel, 'slack.attempt': attempts + 1}):
+                self.client_factory(team_id).chat_postMessage(channel=channel, text=text)
+            with self._cond:
+                self._pending.discard((team_id, channel, text))
+                self.sent += 1
+        except SlackApiError as e:
+            with self._cond:
+                if e.response is not None and e.response.status_code == 429 and attempts + 1 < self.max_attempts:
+                    # Retry-After の間はワークスペースの送信を停止し、先頭に戻して再送
+                    retry_after = float(e.response.headers.get('Retry-After', 1))
+                    self._retry_until[team_id] = max(self._retry_until.get(team_id, 0), time.monotonic() + retry_after)
+                    self.rate_limited += 1
+                    message[1] = attempts + 1
+                    self._channels.setdefault(key, deque()).appendleft(message)
+                    self._channels.move_to_end(key, last=False)
+                    logger.warning(f"Slack rate limited on {channel}, retrying after {retry_after}s")
+                else:
+                    self._pending.discard((team_id, channel, text))
+                    self.failed += 1
+                    logger.error(f"Error sending Slack message to {channel}: {e}")
+        except Exception as e:
+            with self._cond:
+                self._pending.discard((team_id, channel, text))
+                self.failed += 1
+            logger.error(f"Error sending Slack message to {channel}: {e}")
+
+    def register_shutdown_flush(self, timeout=5):
+        """プロセス終了時に送信待ちのメッセージを送り切る"""
+        atexit.register(lambda: self.flush(timeout) if self._pending else None)
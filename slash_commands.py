@@ -0,0 +1,177 @@
+import os
+import re
+import time
+import threading
+import logging
+from collections import deque, namedtuple
+from datetime import date, datetime, timedelta
+import pytz
+from tracing import tracer
+from background_worker import BackgroundWorker
+from timezones import JST_TZ
+
+logger = logging.getLogger(__name__)
+
+# スラッシュコマンドの照会内容（期間は日本時間の日付、週の照会は週別労働時間の週の開始日）
+CommandQuery = namedtuple('CommandQuery', ['kind', 'start', 'end', 'label'])
+
+# 照会の種類: 即時に応答するもの（集計テーブル・1日分の範囲のクエリ）と response_url で後から応答するもの
+INLINE_KINDS = ('help', 'today', 'week', 'presence')
+DEFERRED_KINDS = ('period',)
+
+COMMAND_USAGE = """
+📋 *`/attendance` の使い方*
+• `/attendance today`（`今日`）: 今日の打刻と労働時間
+• `/attendance this week`（`今週`） / `last week`（`先週`）: 週の労働時間
+• `/attendance this month`（`今月`） / `last month`（`先月`） / `2026-09`: 月の労働時間と出勤日数
+• `/attendance who`（`在席`）: 現在出勤中のメンバー
+""".strip()
+
+_MONTH_PATTERN = re.compile(r'^(\d{4})-(\d{1,2})$')
+
+def _month_range(year, month):
+    start = date(year, month, 1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+def parse_command(text, today, week_start):
+    """
+    スラッシュコマンドの引数を照会内容に変換（解釈できない場合は None）
+
+    Args:
+        today: 今日の日付（日本時間）
+        week_start: 今週の週別労働時間の週の開始日
+    """
+    words = ' '.join((text or '').lower().replace('’', "'").split())
+    if words in ('', 'help', 'ヘルプ'):
+        return CommandQuery('help', None, None, None)
+    if words in ('today', '今日'):
+        return CommandQuery('today', today, today, '今日')
+    if words in ('this week', 'week', '今週'):
+        return CommandQuery('week', week_start, week_start + timedelta(days=6), '今週')
+    if words in ('last week', '先週'):
+        start = week_start - timedelta(days=7)
+        return CommandQuery('week', start, start + timedelta(days=6), '先週')
+    if words in ("who's in", 'whos in', 'who', '在席', '出勤中'):
+        return CommandQuery('presence', None, None, None)
+    if words in ('this month', 'month', '今月'):
+        return CommandQuery('period', today.replace(day=1), today, '今月')
+    if words in ('last month', '先月'):
+        start, end = _month_range(*(today.replace(day=1) - timedelta(days=1)).timetuple()[:2])
+        return CommandQuery('period', start, end, '先月')
+    match = _MONTH_PATTERN.match(words)
+    if match:
+        year, month = int(match.group(1)), int(match.group(2))
+        if not 1 <= month <= 12 or date(year, month, 1) > today:
+            return None
+        start, end = _month_range(year, month)
+        return CommandQuery('period', start, min(end, today), f"{year}年{month}月")
+    return None
+
+def jst_day_bounds(start, end):
+    """日本時間の日付の範囲をUTCの [開始, 終了) に変換（タイムゾーンなし）"""
+    start_jst = JST_TZ.localize(datetime.combine(start, datetime.min.time()))
+    end_jst = JST_TZ.localize(datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return (start_jst.astimezone(pytz.utc).replace(tzinfo=None),
+            end_jst.astimezone(pytz.utc).replace(tzinfo=None))
+
+class DeferredResponder:
+    """
+    スラッシュコマンドの重い照会を応答後に処理して response_url へ送信するキュー
+
+    コマンドには3秒以内に応答（ack）する必要があるため、月単位の集計などは「集計中」と応答してから
+    このキューで処理し、結果を response_url（30分間・5回まで有効）に送信する。
+    同時に受け付ける照会は SLASH_COMMAND_MAX_PENDING 件（既定100）まで。
+
+    処理スレッドはプロセス（gunicornワーカー）ごとに初回の受け付け時に起動する。
+    """
+
+    def __init__(self, app, max_pending=None, webhook_factory=None):
+        self.app = app
+        self.max_pending = max_pending if max_pending is not None else int(
+            os.environ.get('SLASH_COMMAND_MAX_PENDING', 100))
+        self.webhook_factory = webhook_factory or self._webhook_client
+        self._cond = threading.Condition()
+        self._jobs = deque()
+        self._in_flight = 0
+        self._worker = BackgroundWorker(self._run, 'slash-command-responder')
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    @staticmethod
+    def _webhook_client(response_url):
+        from slack_sdk.webhook import WebhookClient
+        return WebhookClient(response_url)
+
+    def submit(self, response_url, job):
+        """照会を受け付ける（job はアプリケーションコンテキスト内で呼び出され、返信本文を返す）"""
+        with self._cond:
+            if len(self._jobs) >= self.max_pending:
+                self.rejected += 1
+                return False
+            self._jobs.append((response_url, job, tracer.capture()))
+            self._worker.ensure_started()
+            self._cond.notify()
+        return True
+
+    def qsize(self):
+        with self._cond:
+            return len(self._jobs)
+
+    def flush(self, timeout=10):
+        """受け付けた照会がなくなるまで待機（テスト・終了処理用）"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._jobs or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._jobs),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'failed': self.failed
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                response_url, job, trace = self._jobs.popleft()
+                self._in_flight += 1
+            try:
+                with tracer.resume(trace, 'slash_command.deferred'):
+                    self._respond(response_url, job)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _respond(self, response_url, job):
+        from models import db
+
+        with self.app.app_context():
+            try:
+                text = job()
+            except Exception as e:
+                logger.error(f"Error answering slash command: {e}")
+                text = "申し訳ありませんが、集計中にエラーが発生しました。"
+            finally:
+                db.session.remove()
+        try:
+            response = self.webhook_factory(response_url).send(text=text, response_type='ephemeral')
+            if response.status_code != 200:
+                raise RuntimeError(f"status {response.status_code}: {response.body}")
+            with self._cond:
+                self.completed += 1
+        except Exception as e:
+            with self._cond:
+                self.failed += 1
+            logger.error(f"Error sending slash command response: {e}")
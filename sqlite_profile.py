@@ -0,0 +1,115 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+def sqlite_pragmas():
+    """
+    SQLiteの接続ごとに設定するPRAGMA（環境変数で調整可能）
+
+    - journal_mode=WAL: 読み取りと書き込みが互いを待たない（データベースファイルに保存され、以降の接続にも適用）
+    - synchronous: WAL では NORMAL でもコミット済みのデータは壊れない（電源断時に直近のコミットが失われる可能性のみ）
+    - cache_size: 接続ごとのページキャッシュ（KiB）
+    - mmap_size: メモリマップで読み込む上限（MiB）
+    """
+    return {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16384)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE_MB', 256)) * 1024 * 1024,
+        'temp_store': 'MEMORY'
+    }
+
+def sqlite_busy_timeout():
+    """他の接続の書き込み完了を待つ時間（秒、SQLITE_BUSY_TIMEOUT、既定30秒）"""
+    return float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))
+
+def install_sqlite_pragmas(engine, pragmas=None):
+    """SQLiteのエンジンの接続時にPRAGMAを設定するイベントを登録"""
+    pragmas = pragmas if pragmas is not None else sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+                if name == 'journal_mode':
+                    mode = cursor.fetchone()[0]
+                    if mode.lower() != str(value).lower():
+                        # メモリ上のデータベースなどWALに対応しない場合
+                        logger.debug(f"SQLite journal_mode is {mode} (requested {value})")
+        finally:
+            cursor.close()
+
+    return _apply_pragmas
+
+class SingleWriter:
+    """
+    SQLiteへの書き込みトランザクションを1つずつ実行するための直列化
+
+    SQLiteの書き込みはデータベース単位で1つしか実行できず、gunicornの複数ワーカーから同時に書き込むと
+    ロック待ちが重なって busy_timeout を超えた書き込みが "database is locked" で失敗する。
+    プロセス内はロック、ワーカー間はデータベースと同じ場所のロックファイル（flock）で順番に書き込む
+    （待機はカーネルのキューで行うため、ロック待ちの再試行による遅延がない）。
+
+    enabled が False の場合（PostgreSQL など）は何もしない。
+    """
+
+    def __init__(self, lock_path=None, enabled=True):
+        self.lock_path = lock_path
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._fd = None
+        self._pid = None
+        self.writes = 0
+        self.waited_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def _lock_file(self):
+        # fork後のワーカープロセスではファイルを開き直す（flock はファイル記述子ごとのロック）
+        if self._fd is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    @contextmanager
+    def serialize(self):
+        """書き込みの順番を待ってから実行（同じスレッドで入れ子にした場合はそのまま実行）"""
+        if not self.enabled or getattr(self._local, 'held', False):
+            yield
+            return
+        started = time.perf_counter()
+        with self._lock:
+            fd = self._lock_file() if self.lock_path and fcntl is not None else None
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                waited = (time.perf_counter() - started) * 1000
+                self.writes += 1
+                self.waited_ms += waited
+                self.max_wait_ms = max(self.max_wait_ms, waited)
+                self._local.held = True
+                yield
+            finally:
+                self._local.held = False
+                if fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'writes': self.writes,
+            'avg_wait_ms': round(self.waited_ms / self.writes, 2) if self.writes else 0,
+            'max_wait_ms': round(self.max_wait_ms, 2)
+        }
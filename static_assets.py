@@ -0,0 +1,94 @@
+import os
+import hashlib
+import logging
+import mimetypes
+from compression import compress, accepted_encoding, brotli, COMPRESSIBLE_MIMETYPES
+
+logger = logging.getLogger(__name__)
+
+# 内容のハッシュを含むURLは内容が変わるとURLも変わるため、ブラウザ・CDNに無期限にキャッシュさせる
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+class StaticAssets:
+    """
+    静的ファイルの内容のハッシュ付きURL（/assets/style.<hash>.css）と事前圧縮した本文
+
+    起動時に static フォルダのファイルを読み込み、ハッシュ付きのファイル名と gzip・brotli
+    （インストール済みの場合）の圧縮結果をメモリに保持する。テンプレートでは
+    asset_url('style.css') でハッシュ付きのURLを取得する（無効時・未登録のファイルは /static/ のURL）。
+    STATIC_FINGERPRINT=false で無効化できる。
+    """
+
+    def __init__(self, app=None):
+        self.enabled = os.environ.get('STATIC_FINGERPRINT', 'true').lower() == 'true'
+        self._by_name = {}         # 元のファイル名 -> ハッシュ付きのファイル名
+        self._variants = {}        # ハッシュ付きのファイル名 -> (mimetype, ハッシュ, {encoding: 本文})
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from flask import request, url_for, abort
+
+        self.build(app.static_folder)
+
+        def asset_url(filename):
+            fingerprinted = self._by_name.get(filename) if self.enabled else None
+            if fingerprinted is None:
+                return url_for('static', filename=filename)
+            return url_for('static_asset', filename=fingerprinted)
+
+        @app.route('/assets/<path:filename>', endpoint='static_asset')
+        def _serve_asset(filename):
+            variant = self._variants.get(filename)
+            if variant is None:
+                abort(404)
+            mimetype, digest, bodies = variant
+            encoding = accepted_encoding(request.accept_encodings)
+            body = bodies.get(encoding) or bodies[None]
+            response = app.response_class(body, mimetype=mimetype)
+            if body is not bodies[None]:
+                response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            response.set_etag(digest)
+            return response.make_conditional(request)
+
+        app.jinja_env.globals['asset_url'] = asset_url
+
+    def build(self, static_folder):
+        """static フォルダのファイルのハッシュと圧縮した本文を作成"""
+        self._by_name.clear()
+        self._variants.clear()
+        if not static_folder or not os.path.isdir(static_folder):
+            return
+        for root, _, files in os.walk(static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                stem, ext = os.path.splitext(filename)
+                fingerprinted = f"{stem}.{digest}{ext}"
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                bodies = {None: data}
+                if mimetype in COMPRESSIBLE_MIMETYPES:
+                    # 事前圧縮は1回のみのため最大の圧縮レベルを使う（圧縮しても小さくならない場合は使わない）
+                    for encoding, level in (('gzip', 9), ('br', 11)):
+                        if encoding == 'br' and brotli is None:
+                            continue
+                        compressed = compress(data, encoding, level)
+                        if len(compressed) < len(data):
+                            bodies[encoding] = compressed
+                self._by_name[filename] = fingerprinted
+                self._variants[fingerprinted] = (mimetype, digest, bodies)
+        logger.debug(f"Built {len(self._variants)} fingerprinted static assets")
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'assets': len(self._variants),
+            'bytes': sum(len(bodies[None]) for _, _, bodies in self._variants.values()),
+            'precompressed_bytes': sum(min(len(body) for body in bodies.values())
+                                       for _, _, bodies in self._variants.values())
+        }
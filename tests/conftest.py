@@ -0,0 +1,22 @@
+import pytest
+from flask import Flask
+from models import db
+from cache import ensure_data_version
+
+@pytest.fixture
+def database_path(tmp_path):
+    """テスト用のSQLiteデータベースファイル"""
+    return tmp_path / 'attendance.db'
+
+@pytest.fixture
+def app(database_path):
+    """一時的なSQLiteデータベースを使うアプリケーション（テスト中はアプリケーションコンテキスト内）"""
+    test_app = Flask(__name__)
+    test_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_path}"
+    db.init_app(test_app)
+    with test_app.app_context():
+        db.create_all()
+        ensure_data_version()
+        yield test_app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,76 @@
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from models import db, User, Attendance, AttendanceIssue, AttendanceOutbox, DataQualityScan
+from data_quality import detect_issues, scan_data_quality, MAX_SESSION_HOURS, FUTURE_PUNCH_HOURS, PAST_PUNCH_DAYS
+from outbox import outbox_gap_timeout
+from workspaces import DEFAULT_TEAM_ID
+
+Row = namedtuple('Row', ['id', 'user_id', 'type', 'timestamp', 'created_at'])
+
+BASE = datetime(2026, 10, 1, 0, 0)
+
+def rows(*punches, user_id=1):
+    """(種別, 基準からの時間) の列を出退勤記録の行にする（記録した日時は打刻と同じ）"""
+    return [Row(i + 1, user_id, kind, BASE + timedelta(hours=hours), BASE + timedelta(hours=hours))
+            for i, (kind, hours) in enumerate(punches)]
+
+def kinds(issues):
+    return [(issue.attendance_id, issue.kind) for issue in issues]
+
+def test_regular_sessions_have_no_issues():
+    assert kinds(detect_issues(rows(('出勤', 0), ('退勤', 8), ('出勤', 24), ('退勤', 32)))) == []
+
+def test_double_checkin_reports_the_overwritten_checkin():
+    assert kinds(detect_issues(rows(('出勤', 0), ('出勤', 1), ('退勤', 8)))) == [(1, 'double_checkin')]
+
+def test_orphan_checkout():
+    assert kinds(detect_issues(rows(('出勤', 0), ('退勤', 8), ('退勤', 9)))) == [(3, 'orphan_checkout')]
+
+def test_long_session_reports_hours_on_the_checkin():
+    issues = list(detect_issues(rows(('出勤', 0), ('退勤', MAX_SESSION_HOURS + 2))))
+    assert kinds(issues) == [(1, 'long_session')]
+    assert issues[0].hours == MAX_SESSION_HOURS + 2
+
+def test_future_and_past_punches_are_relative_to_created_at():
+    past = Row(1, 1, '出勤', BASE - timedelta(days=PAST_PUNCH_DAYS + 1), BASE)
+    future = Row(2, 2, '出勤', BASE + timedelta(hours=FUTURE_PUNCH_HOURS + 1), BASE)
+    assert kinds(detect_issues([past, future])) == [(1, 'past_punch'), (2, 'future_punch')]
+
+def test_sessions_do_not_span_users():
+    issues = detect_issues(rows(('出勤', 0), user_id=1) + rows(('退勤', 8), user_id=2))
+    assert [(issue.user_id, issue.kind) for issue in issues] == [(2, 'orphan_checkout')]
+
+def test_incremental_scan_picks_up_outbox_event_committed_out_of_order(app):
+    now = datetime.now(timezone.utc)
+    now_naive = now.replace(tzinfo=None)
+    alice, bob = User(slack_user_id='UALICE', display_name='Alice'), User(slack_user_id='UBOB', display_name='Bob')
+    db.session.add_all([alice, bob])
+    db.session.commit()
+
+    def punch(user, kind, hours_ago, outbox_id):
+        # 変更イベントのIDを指定するため、出退勤記録は登録時のイベントを介さずに追加する
+        timestamp = now_naive - timedelta(hours=hours_ago)
+        attendance_id = db.session.execute(Attendance.__table__.insert().values(
+            team_id=DEFAULT_TEAM_ID, user_id=user.id, type=kind, timestamp=timestamp,
+            created_at=timestamp)).inserted_primary_key[0]
+        db.session.add(AttendanceOutbox(id=outbox_id, team_id=DEFAULT_TEAM_ID, user_id=user.id,
+                                        attendance_id=attendance_id, day=timestamp.date(), kind='insert',
+                                        version=1, created_at=now_naive))
+        db.session.commit()
+
+    def scan(at=now):
+        stats = scan_data_quality(DEFAULT_TEAM_ID, now=at)
+        return stats, DataQualityScan.query.filter_by(team_id=DEFAULT_TEAM_ID).one().outbox_id
+
+    punch(alice, '出勤', 3, 1)
+    assert scan()[0]['mode'] == 'full'
+    # ID 2 を割り当てたトランザクションより先に ID 3 がコミットされた状態でスキャン
+    punch(bob, '出勤', 2, 3)
+    scan()
+    punch(alice, '出勤', 1, 2)
+    stats, cursor = scan()
+    assert stats['mode'] == 'incremental'
+    assert (alice.id, 'double_checkin') in {(issue.user_id, issue.kind) for issue in AttendanceIssue.query}
+    # 追加から OUTBOX_GAP_TIMEOUT 秒以内のイベントは検査済みとしない
+    assert cursor == 0
+    assert scan(now + timedelta(seconds=outbox_gap_timeout() + 1))[1] == 3
@@ -0,0 +1,55 @@
+import threading
+from contextlib import contextmanager
+from health import ReadinessProbe
+
+class GatedEngine:
+    """疎通確認（connect）が gate が開くまで終わらないエンジン"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+        self.connects = 0
+
+    @contextmanager
+    def connect(self):
+        self.connects += 1
+        self.entered.set()
+        self.gate.wait(5)
+        yield self
+
+    def execute(self, statement):
+        return None
+
+def test_late_callers_wait_for_the_first_check(monkeypatch):
+    probe = ReadinessProbe(interval=60)
+    engine = GatedEngine()
+    monkeypatch.setattr(probe, '_get_engine', lambda url, connect_args: engine)
+    results = []
+    first = threading.Thread(target=lambda: results.append(probe.check('sqlite://')))
+    first.start()
+    assert engine.entered.wait(5)
+    late = threading.Thread(target=lambda: results.append(probe.check('sqlite://')))
+    late.start()
+    late.join(0.2)
+    assert late.is_alive()
+    engine.gate.set()
+    first.join(5)
+    late.join(5)
+    assert [healthy for healthy, _ in results] == [True, True]
+    assert all(result['database'] == 'connected' for _, result in results)
+    assert engine.connects == 1
+
+def test_callers_get_the_cached_result_while_rechecking(monkeypatch):
+    probe = ReadinessProbe(interval=0)
+    engine = GatedEngine()
+    engine.gate.set()
+    monkeypatch.setattr(probe, '_get_engine', lambda url, connect_args: engine)
+    assert probe.check('sqlite://')[0]
+    engine.gate.clear()
+    engine.entered.clear()
+    recheck = threading.Thread(target=probe.check, args=('sqlite://',))
+    recheck.start()
+    assert engine.entered.wait(5)
+    assert probe.check('sqlite://')[0]
+    engine.gate.set()
+    recheck.join(5)
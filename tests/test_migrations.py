@@ -0,0 +1,60 @@
+import sqlite3
+import pytest
+from flask import Flask
+from sqlalchemy import inspect, text
+from models import db, User, Attendance
+from migrations import run_migrations, _has_sqlite_slack_user_unique
+
+LEGACY_SCHEMA = """
+CREATE TABLE user (id INTEGER PRIMARY KEY, slack_user_id VARCHAR(20) NOT NULL UNIQUE, display_name VARCHAR(100) NOT NULL,
+                   email VARCHAR(120), created_at DATETIME);
+CREATE TABLE attendance (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user(id), type VARCHAR(10) NOT NULL,
+                         timestamp DATETIME NOT NULL, created_at DATETIME, updated_at DATETIME);
+INSERT INTO user VALUES (1, 'U1', 'Alice', NULL, '2026-01-01 00:00:00.000000');
+INSERT INTO attendance VALUES (1, 1, '出勤', '2026-10-18 00:00:00.000000', NULL, NULL);
+"""
+
+@pytest.fixture
+def legacy_app(database_path):
+    """複数ワークスペース対応前のスキーマ（UNIQUE(slack_user_id)）の SQLite データベースを移行したアプリケーション"""
+    connection = sqlite3.connect(database_path)
+    connection.executescript(LEGACY_SCHEMA)
+    connection.close()
+    test_app = Flask(__name__)
+    test_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_path}"
+    db.init_app(test_app)
+    with test_app.app_context():
+        db.create_all()
+        run_migrations()
+        yield test_app
+        db.session.remove()
+        db.engine.dispose()
+
+def test_legacy_slack_user_unique_is_dropped(legacy_app):
+    assert not _has_sqlite_slack_user_unique()
+    assert 'ix_user_team_slack_user' in {index['name'] for index in inspect(db.engine).get_indexes('user')}
+
+def test_same_slack_user_in_two_workspaces(legacy_app):
+    db.session.add(User(team_id='T2', slack_user_id='U1', display_name='Alice'))
+    db.session.commit()
+    assert sorted(user.team_id for user in User.query.filter_by(slack_user_id='U1')) == ['T2', 'default']
+
+def test_existing_rows_are_kept(legacy_app):
+    alice = db.session.get(User, 1)
+    assert alice.display_name == 'Alice'
+    assert [attendance.user_id for attendance in Attendance.query.all()] == [1]
+
+def test_migration_is_idempotent(legacy_app):
+    assert run_migrations() == []
+
+def test_obsolete_tables_are_dropped(app):
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE attendance_day_change (id INTEGER PRIMARY KEY, team_id VARCHAR(20), user_id INTEGER, day DATE)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX ix_attendance_day_change_team_changed ON attendance_day_change (team_id, id)"
+        ))
+    assert run_migrations() == ['attendance_day_change']
+    assert 'attendance_day_change' not in inspect(db.engine).get_table_names()
+    assert run_migrations() == []
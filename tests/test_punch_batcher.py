@@ -0,0 +1,87 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import pytest
+from models import db, User, Attendance
+from punch_batcher import PunchBatcher, PunchRequest, commit_punches
+from workspaces import DEFAULT_TEAM_ID
+
+def request(slack_user_id, kind='出勤'):
+    return PunchRequest(DEFAULT_TEAM_ID, slack_user_id, kind, datetime.now(timezone.utc),
+                        {'display_name': f'User {slack_user_id}'})
+
+def recorded():
+    """記録された (SlackユーザーID, 種別) の一覧（記録ID順）"""
+    return [(user.slack_user_id, attendance.type) for attendance, user in
+            db.session.query(Attendance, User).join(User).order_by(Attendance.id)]
+
+class GatedWriter:
+    """set() されるまで記録を始めない書き込みの直列化（記録待ちの打刻を作るため）"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+
+    @contextmanager
+    def serialize(self):
+        self.gate.wait()
+        yield
+
+@pytest.fixture
+def batcher(app):
+    return PunchBatcher(app, max_rows=50, max_wait=0.05)
+
+def test_commit_punches_returns_ids_in_request_order(app):
+    requests = [request('U1'), request('U2', '退勤'), request('U1', '退勤')]
+    attendance_ids = commit_punches(requests)
+    rows = {attendance.id: (user.slack_user_id, attendance.type)
+            for attendance, user in db.session.query(Attendance, User).join(User)}
+    assert [rows[attendance_id] for attendance_id in attendance_ids] == [('U1', '出勤'), ('U2', '退勤'), ('U1', '退勤')]
+    # 未登録ユーザーは1人につき1回だけ作成
+    assert User.query.count() == 2
+
+def test_batched_ids_match_submit_order(batcher):
+    futures = [batcher.submit(DEFAULT_TEAM_ID, f'U{i % 3}', '出勤', datetime.now(timezone.utc), {'display_name': 'x'})
+               for i in range(9)]
+    attendance_ids = [future.result(5) for future in futures]
+    db.session.expire_all()
+    users = {attendance.id: user.slack_user_id for attendance, user in db.session.query(Attendance, User).join(User)}
+    assert [users[attendance_id] for attendance_id in attendance_ids] == [f'U{i % 3}' for i in range(9)]
+    assert batcher.stats()['batches'] < 9
+
+def test_failed_batch_is_recorded_one_by_one_without_duplicates(batcher):
+    futures = [batcher.submit(DEFAULT_TEAM_ID, slack_user_id, kind, datetime.now(timezone.utc), {'display_name': 'x'})
+               for slack_user_id, kind in (('U1', '出勤'), ('U2', 'bogus'), ('U3', '退勤'))]
+    assert futures[0].result(5) and futures[2].result(5)
+    with pytest.raises(Exception):
+        futures[1].result(5)
+    db.session.expire_all()
+    assert recorded() == [('U1', '出勤'), ('U3', '退勤')]
+    assert batcher.stats()['fallbacks'] == 1
+
+def test_failure_after_commit_does_not_record_again(batcher, monkeypatch):
+    def fail(*args):
+        raise RuntimeError('trace failure')
+    monkeypatch.setattr(PunchBatcher, '_record_traces', staticmethod(fail))
+    assert batcher.record(DEFAULT_TEAM_ID, 'U1', '出勤', datetime.now(timezone.utc), {'display_name': 'x'}, timeout=5)
+    db.session.expire_all()
+    assert recorded() == [('U1', '出勤')]
+    assert batcher.stats()['fallbacks'] == 0
+
+def test_record_timeout_cancels_a_queued_punch(app):
+    writer = GatedWriter()
+    batcher = PunchBatcher(app, max_wait=0.01, writer=writer)
+    running = batcher.submit(DEFAULT_TEAM_ID, 'U1', '出勤', datetime.now(timezone.utc), {'display_name': 'x'})
+    # 1件目の記録が始まってから2件目を追加（2件目はキューで待つ）
+    while batcher.qsize():
+        time.sleep(0.01)
+    time.sleep(0.05)
+    with pytest.raises(TimeoutError):
+        batcher.record(DEFAULT_TEAM_ID, 'U2', '出勤', datetime.now(timezone.utc), {'display_name': 'y'}, timeout=0.2)
+    writer.gate.set()
+    assert running.result(5)
+    # 取り消した打刻は後から記録されない
+    after = batcher.submit(DEFAULT_TEAM_ID, 'U3', '出勤', datetime.now(timezone.utc), {'display_name': 'z'})
+    assert after.result(5)
+    db.session.expire_all()
+    assert recorded() == [('U1', '出勤'), ('U3', '出勤')]
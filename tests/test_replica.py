@@ -0,0 +1,64 @@
+import shutil
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, update
+from models import db, DataVersion
+from cache import bump_data_version
+from replica import ReplicaRouter
+from workspaces import DEFAULT_TEAM_ID
+
+MAX_LAG = 30
+
+@pytest.fixture
+def replica_path(app, database_path, tmp_path):
+    """プライマリのファイルをコピーしたレプリカ（コピー時点でプライマリに追いついている）"""
+    bump_data_version()
+    db.session.commit()
+    db.engine.dispose()
+    path = tmp_path / 'replica.db'
+    shutil.copyfile(database_path, path)
+    return path
+
+@pytest.fixture
+def router(replica_path):
+    router = ReplicaRouter(f"sqlite:///{replica_path}", max_lag=MAX_LAG)
+    yield router
+    router.remove()
+    router.dispose()
+
+def read_target(router, **kwargs):
+    return 'primary' if router.read_session(DEFAULT_TEAM_ID, **kwargs) is db.session else 'replica'
+
+def bump_primary():
+    bump_data_version()
+    db.session.commit()
+
+def test_caught_up_replica_is_used(router):
+    assert read_target(router) == 'replica'
+    assert read_target(router, max_lag=0) == 'replica'
+
+def test_lagging_replica_is_used_within_max_lag(router):
+    bump_primary()
+    assert read_target(router) == 'replica'
+    # データバージョン単位でキャッシュする読み取りは追いついている場合のみ
+    assert read_target(router, max_lag=0) == 'primary'
+
+def test_replica_over_max_lag_falls_back_to_primary(router, replica_path):
+    bump_primary()
+    # レプリカの最後の反映を許容遅延より前にずらす
+    engine = create_engine(f"sqlite:///{replica_path}")
+    with engine.begin() as connection:
+        connection.execute(update(DataVersion).values(
+            updated_at=datetime.now(timezone.utc) - timedelta(seconds=MAX_LAG + 60)))
+    engine.dispose()
+    assert read_target(router) == 'primary'
+
+def test_unavailable_replica_falls_back_to_primary(app, tmp_path):
+    router = ReplicaRouter(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}", max_lag=MAX_LAG)
+    assert read_target(router) == 'primary'
+    status = router.status()
+    assert status['available'] is False
+    assert status['last_error']
+    # 再試行までの間は接続を試みない
+    assert read_target(router) == 'primary'
+    assert router.reads == {'replica': 0, 'primary': 2}
@@ -0,0 +1,104 @@
+import threading
+import time
+import pytest
+from slack_sdk import WebClient
+from fake_slack import FakeSlackServer
+from slack_sender import SlackMessageSender, TokenBucket
+
+@pytest.fixture
+def make_server():
+    servers = []
+
+    def make(**kwargs):
+        servers.append(FakeSlackServer(**kwargs).start())
+        return servers[-1]
+    yield make
+    for server in servers:
+        server.stop()
+
+class RecordingClients:
+    """ワークスペースごとの WebClient（送信が完了した時刻とチャンネルを記録、gate が set() されるまで送信しない）"""
+
+    def __init__(self, server):
+        self.server = server
+        self.delivered = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, team_id):
+        clients = self
+        client = WebClient(token='xoxb-fake', base_url=self.server.base_url)
+
+        class Client:
+            def chat_postMessage(self, channel, text):
+                clients.gate.wait()
+                response = client.chat_postMessage(channel=channel, text=text)
+                clients.delivered.append((time.monotonic(), team_id, channel))
+                return response
+        return Client()
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated_at
+    for _ in range(3):
+        assert bucket.wait_time(now) == 0
+        bucket.take(now)
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+    assert bucket.wait_time(now + 0.5) == 0
+
+def test_channel_rate_is_kept_within_the_server_limit(make_server):
+    # 送信側と同じレートで、通信の揺らぎの分だけバーストに余裕を持たせた制限
+    server = make_server(rate_per_channel=10, burst=3)
+    sender = SlackMessageSender(RecordingClients(server), rate=10, burst=2)
+    started = time.monotonic()
+    for i in range(5):
+        sender.send('C1', f'message {i}', team_id='T1')
+    assert sender.flush(timeout=5)
+    # バースト2通の後は1秒に10通（残り3通に0.3秒）
+    assert time.monotonic() - started >= 0.25
+    assert len(server.messages) == 5
+    assert server.rate_limited == 0
+    assert sender.stats()['rate_limited'] == 0
+
+def test_retry_after_pauses_the_whole_workspace(make_server):
+    server = make_server(rate_per_channel=2, burst=1, retry_after=1)
+    clients = RecordingClients(server)
+    sender = SlackMessageSender(clients, rate=100, burst=10)
+    sender.send('CA', 'first', team_id='T1')
+    sender.send('CA', 'second', team_id='T1')
+    wait_until(lambda: sender.stats()['rate_limited'] >= 1)
+    limited_at = time.monotonic()
+    sender.send('CB', 'same workspace', team_id='T1')
+    sender.send('CC', 'other workspace', team_id='T2')
+    assert sender.flush(timeout=10)
+    delivered_at = {channel: at for at, _, channel in clients.delivered}
+    # 429 を受けたワークスペースは別のチャンネルも Retry-After の間は送信しない
+    assert delivered_at['CB'] - limited_at >= 0.8
+    assert delivered_at['CC'] - limited_at < 0.5
+    assert sorted(message['text'] for message in server.messages) == [
+        'first', 'other workspace', 'same workspace', 'second']
+    assert sender.stats()['failed'] == 0
+
+def test_duplicate_pending_messages_are_coalesced(make_server):
+    server = make_server(rate_per_channel=100, burst=100)
+    clients = RecordingClients(server)
+    clients.gate.clear()
+    sender = SlackMessageSender(clients, rate=100, burst=100)
+    assert sender.send('C1', 'hello', team_id='T1') is True
+    assert sender.send('C1', 'hello', team_id='T1') is False
+    assert sender.send('C2', 'hello', team_id='T1') is True
+    assert sender.send('C1', 'hello', team_id='T2') is True
+    clients.gate.set()
+    assert sender.flush(timeout=5)
+    assert sorted(message['channel'] for message in server.messages) == ['C1', 'C1', 'C2']
+    assert sender.stats()['coalesced'] == 1
+    # 送信済みの本文は再び送信できる
+    assert sender.send('C1', 'hello', team_id='T1') is True
+    assert sender.flush(timeout=5)
+    assert len(server.messages) == 4
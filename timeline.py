@@ -0,0 +1,220 @@
+import os
+import mmap
+import time
+import struct
+import atexit
+import threading
+import logging
+from array import array
+from datetime import date, datetime, timezone, timedelta
+from models import db, WeeklyHours
+from weekly_stats import WeeklyStatsIndex
+
+logger = logging.getLogger(__name__)
+
+# 週番号（オフセット）の基準となる週の開始日（月曜日）
+EPOCH_WEEK = date(2000, 1, 3)
+
+# キャッシュファイルのヘッダー（識別子, 同期時刻(UNIX秒), 先頭の週番号, ユーザー数, 週数）
+FILE_MAGIC = b'ATLINE02'
+FILE_HEADER = struct.Struct('<8sdiII')
+
+def week_offset(week_start):
+    """週の開始日から基準週からの週番号を取得"""
+    return (week_start - EPOCH_WEEK).days // 7
+
+def week_of_offset(offset):
+    """週番号から週の開始日を取得"""
+    return EPOCH_WEEK + timedelta(weeks=offset)
+
+class _TeamTimeline:
+    """1ワークスペース分のユーザー別週次労働時間（ユーザーごとに週番号で引ける float32 配列）"""
+
+    def __init__(self):
+        self.series = {}      # user_id -> array('f')（添字は base からの週数）
+        self.base = None      # 配列の先頭の週番号（ワークスペースで最も古い週）
+        self.synced_at = None
+        self.dirty = False
+
+    def _rebase(self, base):
+        """より古い週の記録が追加された場合に全ユーザーの配列の先頭を延ばす"""
+        if self.base is not None:
+            padding = array('f', bytes(4 * (self.base - base)))
+            for user_id, values in self.series.items():
+                self.series[user_id] = padding + values
+        self.base = base
+
+    def set(self, user_id, week, hours):
+        if self.base is None or week < self.base:
+            if hours == 0:
+                return
+            self._rebase(week)
+        offset = week - self.base
+        values = self.series.get(user_id)
+        if values is None:
+            if hours == 0:
+                return
+            values = self.series[user_id] = array('f')
+        if offset >= len(values):
+            if hours == 0:
+                return
+            values.extend([0.0] * (offset + 1 - len(values)))
+        old = values[offset]
+        values[offset] = hours
+        if values[offset] != old:
+            self.dirty = True
+
+    def to_bytes(self):
+        """ユーザーID列と、週数を揃えた float32 の行列として書き出す"""
+        user_ids = array('q', sorted(self.series))
+        weeks = max((len(values) for values in self.series.values()), default=0)
+        synced_at = self.synced_at.replace(tzinfo=timezone.utc).timestamp() if self.synced_at else 0.0
+        chunks = [FILE_HEADER.pack(FILE_MAGIC, synced_at, self.base or 0, len(user_ids), weeks), user_ids.tobytes()]
+        for user_id in user_ids:
+            values = self.series[user_id]
+            chunks.append(values.tobytes())
+            chunks.append(bytes(4 * (weeks - len(values))))
+        return b''.join(chunks)
+
+    @classmethod
+    def from_file(cls, path):
+        """キャッシュファイルをメモリマップして読み込む（形式が異なる場合は None）"""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < FILE_HEADER.size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, synced_at, base, user_count, weeks = FILE_HEADER.unpack_from(mm, 0)
+                if magic != FILE_MAGIC or len(mm) != FILE_HEADER.size + user_count * (8 + 4 * weeks):
+                    return None
+                offset = FILE_HEADER.size
+                user_ids = array('q')
+                user_ids.frombytes(mm[offset:offset + 8 * user_count])
+                offset += 8 * user_count
+                timeline = cls()
+                timeline.base = base if user_count else None
+                for user_id in user_ids:
+                    values = array('f')
+                    values.frombytes(mm[offset:offset + 4 * weeks])
+                    timeline.series[user_id] = values
+                    offset += 4 * weeks
+        if synced_at:
+            timeline.synced_at = datetime.fromtimestamp(synced_at, timezone.utc).replace(tzinfo=None)
+        return timeline
+
+class WeeklyTimeline:
+    """
+    ユーザー別の週次労働時間の時系列キャッシュ
+
+    weekly_hours テーブルの更新分（updated_at が前回同期以降の行）だけを差分反映し、
+    ワークスペースごとにファイルへ保存する（再起動後はファイルをメモリマップして読み込み、差分のみ同期）。
+    グラフ用の取得は配列のスライスのみで、出退勤記録や週別集計を読み直さない。
+    """
+
+    def __init__(self, directory, persist_interval=None):
+        self.directory = directory
+        self.persist_interval = persist_interval if persist_interval is not None else float(
+            os.environ.get('TIMELINE_PERSIST_INTERVAL', 60))
+        self._lock = threading.Lock()
+        self._teams = {}
+        self._persisted_at = {}
+
+    def _path(self, team_id):
+        return os.path.join(self.directory, f'{team_id}.bin')
+
+    def _load(self, team_id):
+        team = None
+        path = self._path(team_id)
+        if os.path.exists(path):
+            try:
+                team = _TeamTimeline.from_file(path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Failed to load timeline cache {path}: {e}")
+            if team is None:
+                logger.warning(f"Ignoring incompatible timeline cache: {path}")
+        return team or _TeamTimeline()
+
+    def sync(self, team_id, session=None, now=None):
+        """ワークスペースの weekly_hours テーブルの更新分を取り込む（session はリードレプリカ用）"""
+        now = now or datetime.now(timezone.utc)
+        query = (session or db.session).query(WeeklyHours.user_id, WeeklyHours.week_start, WeeklyHours.hours).filter(
+            WeeklyHours.team_id == team_id
+        )
+        with self._lock:
+            team = self._teams.get(team_id)
+            if team is None:
+                team = self._teams[team_id] = self._load(team_id)
+                self._persisted_at[team_id] = time.monotonic()
+            if team.synced_at is not None:
+                query = query.filter(WeeklyHours.updated_at >= team.synced_at - WeeklyStatsIndex.SYNC_MARGIN)
+            started = now.replace(tzinfo=None)
+            for user_id, week_start, hours in query.all():
+                team.set(user_id, week_offset(week_start), hours)
+            team.synced_at = started
+
+            if team.dirty and time.monotonic() - self._persisted_at.get(team_id, 0) >= self.persist_interval:
+                self._persist(team_id, team)
+
+    def series(self, team_id, user_ids, start_week, end_week):
+        """
+        ユーザーごとの週次労働時間の時系列を取得
+
+        Args:
+            start_week, end_week: 取得する期間の最初と最後の週の開始日（月曜日）
+
+        Returns:
+            dict: user_id -> 週ごとの労働時間のリスト（start_week から end_week まで）
+        """
+        start = week_offset(start_week)
+        end = week_offset(end_week) + 1
+        result = {}
+        with self._lock:
+            team = self._teams.get(team_id) or _TeamTimeline()
+            base = team.base if team.base is not None else start
+            # 配列の範囲外（base より前・記録の最終週より後）は0で埋める
+            leading = min(max(base - start, 0), end - start)
+            for user_id in user_ids:
+                values = team.series.get(user_id, array('f'))[max(start - base, 0):max(end - base, 0)]
+                result[user_id] = [0] * leading + [round(v, 2) for v in values]
+                result[user_id] += [0] * (end - start - len(result[user_id]))
+        return result
+
+    def forget_user(self, user_id):
+        """削除されたユーザーの時系列を破棄"""
+        with self._lock:
+            for team in self._teams.values():
+                if team.series.pop(user_id, None) is not None:
+                    team.dirty = True
+
+    def _persist(self, team_id, team):
+        """一時ファイルに書き出してから置き換える（他のワーカーが読み込み中でも安全）"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(team_id)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(team.to_bytes())
+            os.replace(tmp_path, path)
+            team.dirty = False
+        except OSError as e:
+            logger.warning(f"Failed to persist timeline cache for {team_id}: {e}")
+        self._persisted_at[team_id] = time.monotonic()
+
+    def persist_all(self):
+        """未保存の変更をすべてファイルに書き出す"""
+        with self._lock:
+            for team_id, team in self._teams.items():
+                if team.dirty:
+                    self._persist(team_id, team)
+
+    def reset(self):
+        """メモリ上の時系列と保存済みファイルを破棄（週別集計の作り直し後に使用）"""
+        with self._lock:
+            self._teams.clear()
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.endswith('.bin'):
+                        os.remove(os.path.join(self.directory, name))
+
+    def register_shutdown_persist(self):
+        """プロセス終了時に未保存の変更を書き出す"""
+        atexit.register(self.persist_all)
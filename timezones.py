@@ -0,0 +1,11 @@
+from datetime import timezone
+import pytz
+
+# 日付の区切り・表示に使う日本時間
+JST_TZ = pytz.timezone('Asia/Tokyo')
+
+def naive_utc(timestamp):
+    """DBの日時（タイムゾーンなし、UTC）と比較できる形に変換"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.replace(tzinfo=None)
@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+import functools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# 実行中のスパン（スレッド・asyncio タスクごと）
+_current_span = ContextVar('current_span', default=None)
+
+# SQL文の属性として記録する最大文字数
+MAX_STATEMENT_LENGTH = 300
+
+class Span:
+    """処理区間（OpenTelemetry のスパンと同じく trace_id・span_id・親の span_id・属性を持つ）"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'status',
+                 'start_time', '_started', 'duration_ms', 'thread')
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_time = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.duration_ms = None
+        self.thread = threading.current_thread().name
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.status = 'error'
+        self.attributes['error'] = f"{type(error).__name__}: {error}"
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time.isoformat(),
+            'duration_ms': round(self.duration_ms, 3),
+            'status': self.status,
+            'thread': self.thread,
+            'attributes': self.attributes
+        }
+
+class JsonLinesExporter:
+    """終了したスパンを1行1件のJSONで出力（ファイルまたは標準出力）"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stream = None
+        self._pid = None
+        self.exported = 0
+
+    def _output(self):
+        if self.path is None:
+            return sys.stdout
+        # fork後のワーカープロセスでは開き直す（追記モードのため各ワーカーの行は混在しない）
+        if self._stream is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._stream = open(self.path, 'a', encoding='utf-8', buffering=1)
+        return self._stream
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            try:
+                self._output().write(line + '\n')
+                self.exported += 1
+            except OSError as e:
+                logger.error(f"Error exporting span: {e}")
+
+class Tracer:
+    """
+    処理区間（スパン）の計測
+
+    TRACING_ENABLED=true の場合のみ計測する（無効時は span() が何もしない）。
+    新しいトレースは TRACE_SAMPLE_RATE（既定1.0）の割合で記録し、終了したスパンを
+    TRACE_EXPORTER（file: TRACE_FILE に追記、stdout: 標準出力）へ出力する。
+
+    バックグラウンドスレッドの処理は、キューに追加する時点の capture() を resume() に渡して
+    呼び出し元のトレースに含める。
+    """
+
+    def __init__(self, enabled=None, exporter=None, sample_rate=None):
+        self.enabled = enabled if enabled is not None else os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+        self.exporter = exporter
+
+    def configure(self, default_path):
+        """環境変数から出力先を設定（TRACE_FILE 省略時は default_path）"""
+        if self.exporter is None:
+            if os.environ.get('TRACE_EXPORTER', 'file') == 'stdout':
+                self.exporter = JsonLinesExporter()
+            else:
+                self.exporter = JsonLinesExporter(os.environ.get('TRACE_FILE', default_path))
+        return self
+
+    @contextmanager
+    def span(self, name, root=False, **attributes):
+        """
+        スパンを開始（実行中のスパンがあればその子、なければ新しいトレース）
+
+        Args:
+            root: 実行中のスパンがない場合にトレースを開始するか（False の場合は何も記録しない）
+        """
+        parent = _current_span.get()
+        if not self.enabled or (parent is None and not root):
+            yield None
+            return
+        if parent is None:
+            if random.random() >= self.sample_rate:
+                yield None
+                return
+            span = Span(name, f"{random.getrandbits(128):032x}", None, attributes)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._end(span)
+
+    def start(self, name, **attributes):
+        """区間の開始と終了が別の関数の場合のスパンの開始（end で終了、トレース中の場合のみ記録）"""
+        parent = _current_span.get()
+        if not self.enabled or parent is None:
+            return None
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    def start_root(self, name, **attributes):
+        """リクエストの開始時などに新しいトレースを開始して実行中のスパンにする（トークンを返す）"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        span = Span(name, f"{random.getrandbits(128):032x}", None, attributes)
+        return span, _current_span.set(span)
+
+    def end_root(self, started, error=None):
+        if started is None:
+            return
+        span, token = started
+        if error is not None:
+            span.record_error(error)
+        _current_span.reset(token)
+        self._end(span)
+
+    def end(self, span, error=None):
+        if span is None:
+            return
+        if error is not None:
+            span.record_error(error)
+        self._end(span)
+
+    def record(self, parent, name, started_at, duration_ms, **attributes):
+        """計測済みの区間を capture() したスパンの子として記録（複数のトレースにまたがる一括処理用）"""
+        if parent is None or not self.enabled:
+            return
+        span = Span(name, parent.trace_id, parent.span_id, attributes)
+        span.start_time = started_at
+        span.duration_ms = duration_ms
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    def _end(self, span):
+        span.finish()
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    @staticmethod
+    def capture():
+        """実行中のスパン（バックグラウンドスレッドへの受け渡し用、トレース中でなければ None）"""
+        return _current_span.get()
+
+    @contextmanager
+    def resume(self, parent, name, **attributes):
+        """capture() したスパンの子としてスパンを開始（バックグラウンドスレッド用）"""
+        if parent is None or not self.enabled:
+            yield None
+            return
+        token = _current_span.set(parent)
+        try:
+            with self.span(name, **attributes) as span:
+                yield span
+        finally:
+            _current_span.reset(token)
+
+    def traced(self, name=None):
+        """関数の実行をスパンとして記録するデコレーター（トレース中の場合のみ）"""
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or _current_span.get() is None:
+                    return func(*args, **kwargs)
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def instrument_sqlalchemy(self, engine_class):
+        """SQL文の実行ごとのスパン（トレース中の場合のみ）"""
+        from sqlalchemy import event
+
+        @event.listens_for(engine_class, 'before_cursor_execute')
+        def _start_statement(conn, cursor, statement, parameters, context, executemany):
+            span = self.start('db.query', **{
+                'db.system': conn.dialect.name,
+                'db.statement': ' '.join(statement.split())[:MAX_STATEMENT_LENGTH]
+            })
+            if span is not None:
+                conn.info.setdefault('trace_spans', []).append(span)
+
+        @event.listens_for(engine_class, 'after_cursor_execute')
+        def _end_statement(conn, cursor, statement, parameters, context, executemany):
+            spans = conn.info.get('trace_spans')
+            if spans:
+                span = spans.pop()
+                if cursor.rowcount is not None and cursor.rowcount >= 0:
+                    span.set_attribute('db.rows', cursor.rowcount)
+                self.end(span)
+
+        @event.listens_for(engine_class, 'handle_error')
+        def _fail_statement(exception_context):
+            conn = exception_context.connection
+            spans = conn.info.get('trace_spans') if conn is not None else None
+            if spans:
+                self.end(spans.pop(), exception_context.original_exception)
+
+    def instrument_slack_sdk(self):
+        """Slack Web API の呼び出しとリクエストの署名検証のスパン（トレース中の場合のみ）"""
+        from slack_sdk.web.base_client import BaseClient
+        from slack_sdk.signature import SignatureVerifier
+
+        if getattr(BaseClient.api_call, '_traced', False):
+            return
+        api_call = BaseClient.api_call
+        is_valid = SignatureVerifier.is_valid
+
+        @functools.wraps(api_call)
+        def traced_api_call(client, api_method, *args, **kwargs):
+            if _current_span.get() is None:
+                return api_call(client, api_method, *args, **kwargs)
+            with self.span('slack.api', **{'slack.method': api_method}):
+                return api_call(client, api_method, *args, **kwargs)
+
+        @functools.wraps(is_valid)
+        def traced_is_valid(verifier, *args, **kwargs):
+            if _current_span.get() is None:
+                return is_valid(verifier, *args, **kwargs)
+            with self.span('slack.verify_signature'):
+                return is_valid(verifier, *args, **kwargs)
+
+        traced_api_call._traced = True
+        BaseClient.api_call = traced_api_call
+        SignatureVerifier.is_valid = traced_is_valid
+
+def summarize_traces(path, root_name=None):
+    """
+    出力したスパンをトレースの起点（ルートスパン）の名前ごとに集計
+
+    Returns:
+        dict: ルートスパン名 -> {'count', 'p50_ms', 'p95_ms', 'children': {スパン名: 1トレースあたりの平均ms}}
+    """
+    spans_by_trace = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            span = json.loads(line)
+            spans_by_trace.setdefault(span['trace_id'], []).append(span)
+    summary = {}
+    for spans in spans_by_trace.values():
+        roots = [span for span in spans if span['parent_span_id'] is None]
+        if not roots:
+            continue
+        root = roots[0]
+        name = f"{root['name']} {root['attributes'].get('http.route', '')}".strip()
+        if root_name and root_name not in name:
+            continue
+        entry = summary.setdefault(name, {'durations': [], 'children': {}})
+        entry['durations'].append(root['duration_ms'])
+        for span in spans:
+            if span is not root:
+                entry['children'][span['name']] = entry['children'].get(span['name'], 0) + span['duration_ms']
+    result = {}
+    for name, entry in summary.items():
+        durations = sorted(entry['durations'])
+        count = len(durations)
+        result[name] = {
+            'count': count,
+            'p50_ms': round(durations[count // 2], 2),
+            'p95_ms': round(durations[min(count - 1, int(count * 0.95))], 2),
+            'children': {child: round(total / count, 2)
+                         for child, total in sorted(entry['children'].items(), key=lambda x: -x[1])}
+        }
+    return result
+
+# アプリケーション全体で共有するトレーサー
+tracer = Tracer()
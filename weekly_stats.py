@@ -0,0 +1,242 @@
+import bisect
+import threading
+import logging
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db, User, Attendance, WeeklyHours
+
+logger = logging.getLogger(__name__)
+
+# 全体統計の対象期間（日数）
+OVERALL_WINDOW_DAYS = 90
+
+def week_start_of(timestamp):
+    """記録の週の開始日（月曜日、UTC日付基準）"""
+    return timestamp.date() - timedelta(days=timestamp.weekday())
+
+class OrderStatistics:
+    """
+    値の追加・削除に対応した順序統計（平均・中央値・パーセンタイルを厳密に計算）
+
+    ソート済みリストと合計・件数を差分で保持するため、統計値の取得時に再ソートしない。
+    """
+
+    def __init__(self, values=()):
+        self._values = sorted(values)
+        self.total = sum(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, value):
+        bisect.insort(self._values, value)
+        self.total += value
+
+    def remove(self, value):
+        index = bisect.bisect_left(self._values, value)
+        if index < len(self._values) and self._values[index] == value:
+            del self._values[index]
+            self.total -= value
+
+    def merge(self, other):
+        """他の順序統計と結合した新しいインスタンスを返す"""
+        merged = OrderStatistics()
+        merged._values = sorted(self._values + other._values)
+        merged.total = self.total + other.total
+        return merged
+
+    def mean(self):
+        return self.total / len(self._values) if self._values else 0
+
+    def quantile(self, q):
+        """q分位点（線形補間、q=0.5 で statistics.median と一致）"""
+        if not self._values:
+            return 0
+        position = (len(self._values) - 1) * q
+        lower = int(position)
+        upper = min(lower + 1, len(self._values) - 1)
+        return self._values[lower] + (self._values[upper] - self._values[lower]) * (position - lower)
+
+    def values(self):
+        return list(self._values)
+
+    def summary(self):
+        """calculate_work_hours_statistics と同じ形式の統計値"""
+        return {
+            'weekly_hours': self.values(),
+            'average_hours': round(self.mean(), 2),
+            'median_hours': round(self.quantile(0.5), 2),
+            'p90_hours': round(self.quantile(0.9), 2),
+            'total_weeks': len(self._values),
+            'total_hours': round(self.total, 2)
+        }
+
+class _TeamWeeklyStats:
+    """1ワークスペース分の週別労働時間の統計"""
+
+    def __init__(self):
+        self.values = {}      # (user_id, week_start) -> hours
+        self.per_user = {}    # user_id -> OrderStatistics
+        self.overall = OrderStatistics()
+        self.window_start = None
+        self.synced_at = None
+
+    def set(self, user_id, week_start, hours):
+        key = (user_id, week_start)
+        old = self.values.get(key, 0)
+        if old == hours:
+            return
+        user_stats = self.per_user.setdefault(user_id, OrderStatistics())
+        in_window = self.window_start is not None and week_start >= self.window_start
+        if old > 0:
+            user_stats.remove(old)
+            if in_window:
+                self.overall.remove(old)
+        if hours > 0:
+            self.values[key] = hours
+            user_stats.add(hours)
+            if in_window:
+                self.overall.add(hours)
+        else:
+            self.values.pop(key, None)
+
+    def rebuild_overall(self):
+        self.overall = OrderStatistics(
+            hours for (_, week_start), hours in self.values.items() if week_start >= self.window_start
+        )
+
+class WeeklyStatsIndex:
+    """
+    週別労働時間の統計インデックス（ワークスペースごとにユーザー別・全体）
+
+    weekly_hours テーブルの更新分（updated_at が前回同期以降の行）だけを読み込んで
+    差分反映するため、他のワーカーでの更新も1回の小さなクエリで取り込める。
+    """
+
+    # ワーカー間の時計のずれを考慮して前回同期時刻より少し前から読み込む
+    SYNC_MARGIN = timedelta(seconds=5)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._teams = {}
+
+    def sync(self, team_id, now=None, session=None):
+        """ワークスペースの weekly_hours テーブルの更新分を取り込む（session はリードレプリカ用）"""
+        now = now or datetime.now(timezone.utc)
+        query = (session or db.session).query(WeeklyHours.user_id, WeeklyHours.week_start, WeeklyHours.hours).filter(
+            WeeklyHours.team_id == team_id
+        )
+        with self._lock:
+            team = self._teams.setdefault(team_id, _TeamWeeklyStats())
+            if team.synced_at is not None:
+                query = query.filter(WeeklyHours.updated_at >= team.synced_at - self.SYNC_MARGIN)
+            started = now.replace(tzinfo=None)
+            for user_id, week_start, hours in query.all():
+                team.set(user_id, week_start, hours)
+            team.synced_at = started
+
+            window_start = week_start_of(now - timedelta(days=OVERALL_WINDOW_DAYS))
+            if window_start != team.window_start:
+                team.window_start = window_start
+                team.rebuild_overall()
+
+    def user_summary(self, team_id, user_id):
+        with self._lock:
+            team = self._teams.get(team_id)
+            user_stats = team.per_user.get(user_id) if team else None
+            return (user_stats or OrderStatistics()).summary()
+
+    def overall_summary(self, team_id):
+        with self._lock:
+            team = self._teams.get(team_id)
+            return (team.overall if team else OrderStatistics()).summary()
+
+    def forget_user(self, user_id):
+        """削除されたユーザーの値を破棄"""
+        with self._lock:
+            for team in self._teams.values():
+                for key in [key for key in team.values if key[0] == user_id]:
+                    team.set(key[0], key[1], 0)
+                team.per_user.pop(user_id, None)
+
+def refresh_weekly_hours(session, keys, calculate_func):
+    """
+    指定した (user_id, week_start) の週別労働時間を出退勤記録から再計算して保存
+
+    Args:
+        keys: 再計算する (user_id, week_start) の集合
+        calculate_func: 出退勤記録のリストから労働時間を計算する関数
+    """
+    for user_id, week_start in keys:
+        user = session.get(User, user_id)
+        if user is None:
+            continue
+        start = datetime.combine(week_start, datetime.min.time())
+        records = session.query(Attendance).filter(
+            Attendance.team_id == user.team_id,
+            Attendance.user_id == user_id,
+            Attendance.timestamp >= start,
+            Attendance.timestamp < start + timedelta(days=7)
+        ).all()
+        hours = calculate_func(records) if records else 0
+        row = session.query(WeeklyHours).filter_by(team_id=user.team_id, user_id=user_id, week_start=week_start).first()
+        if row is None:
+            session.add(WeeklyHours(team_id=user.team_id, user_id=user_id, week_start=week_start, hours=hours))
+        elif row.hours != hours:
+            row.hours = hours
+
+def rebuild_weekly_hours(calculate_func):
+    """全出退勤記録から週別労働時間を作り直す（初回導入時・不整合時用）"""
+    db.session.query(WeeklyHours).delete()
+    weekly = {}
+    current = None
+    query = db.session.query(Attendance).order_by(Attendance.team_id, Attendance.user_id, Attendance.timestamp)
+    for record in query.yield_per(1000):
+        key = (record.team_id, record.user_id, week_start_of(record.timestamp))
+        if key != current:
+            current = key
+            weekly[key] = []
+        weekly[key].append(record)
+    db.session.add_all(
+        WeeklyHours(team_id=team_id, user_id=user_id, week_start=week_start, hours=calculate_func(records))
+        for (team_id, user_id, week_start), records in weekly.items()
+    )
+    db.session.commit()
+    return len(weekly)
+
+def _affected_weeks(obj):
+    """出退勤記録の変更で再計算が必要になる週"""
+    timestamps = []
+    state = inspect(obj)
+    if state.persistent or state.deleted:
+        history = state.attrs.timestamp.history
+        timestamps.extend(history.deleted or ())
+        timestamps.extend(history.unchanged or ())
+    timestamps.append(obj.timestamp or datetime.now(timezone.utc))
+    return {(obj.user_id, week_start_of(ts)) for ts in timestamps if ts is not None}
+
+def install_weekly_hours_hooks(calculate_func):
+    """出退勤記録の変更をコミット前に weekly_hours へ反映するイベントを登録"""
+
+    @event.listens_for(Session, 'before_flush')
+    def _collect_dirty_weeks(session, flush_context, instances):
+        keys = session.info.setdefault('weekly_hours_dirty', set())
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Attendance) and obj.user_id is not None:
+                keys.update(_affected_weeks(obj))
+
+    @event.listens_for(Session, 'before_commit')
+    def _refresh_dirty_weeks(session):
+        session.flush()
+        keys = session.info.pop('weekly_hours_dirty', None)
+        if keys:
+            # 追加直後の記録はタイムゾーン付きの日時を保持しているため、DBの値で読み直す
+            for obj in list(session.identity_map.values()):
+                if isinstance(obj, Attendance):
+                    session.expire(obj, ['timestamp'])
+            refresh_weekly_hours(session, keys, calculate_func)
+
+    @event.listens_for(Session, 'after_rollback')
+    def _discard_dirty_weeks(session):
+        session.info.pop('weekly_hours_dirty', None)
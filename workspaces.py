@@ -0,0 +1,103 @@
+import os
+import json
+import threading
+import logging
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# 単一ワークスペース運用時（SLACK_WORKSPACES 未設定時）のワークスペースID
+DEFAULT_TEAM_ID = os.environ.get('SLACK_TEAM_ID', 'default')
+
+@dataclass(frozen=True)
+class Workspace:
+    """Slackワークスペース（チーム）ごとの設定"""
+    team_id: str
+    bot_token: str
+    admin_user_id: str = None
+
+def load_workspaces():
+    """
+    ワークスペース設定を環境変数から読み込む
+
+    SLACK_WORKSPACES にJSON（{"T123": {"bot_token": "xoxb-...", "admin_user_id": "U..."}, ...}）を
+    指定すると複数ワークスペースで運用する。未設定の場合は SLACK_BOT_TOKEN / ADMIN_USER_ID を
+    DEFAULT_TEAM_ID のワークスペースとして扱う。
+    """
+    raw = os.environ.get('SLACK_WORKSPACES')
+    if not raw:
+        return {DEFAULT_TEAM_ID: Workspace(
+            team_id=DEFAULT_TEAM_ID,
+            bot_token=os.environ.get('SLACK_BOT_TOKEN'),
+            admin_user_id=os.environ.get('ADMIN_USER_ID')
+        )}
+    try:
+        config = json.loads(raw)
+    except ValueError as e:
+        logger.error(f"Invalid SLACK_WORKSPACES: {e}")
+        raise ValueError(f"Invalid SLACK_WORKSPACES: {e}")
+    return {
+        team_id: Workspace(team_id=team_id, bot_token=settings.get('bot_token'),
+                           admin_user_id=settings.get('admin_user_id'))
+        for team_id, settings in config.items()
+    }
+
+WORKSPACES = load_workspaces()
+MULTI_WORKSPACE = bool(os.environ.get('SLACK_WORKSPACES'))
+
+def resolve_team_id(team_id):
+    """SlackのチームIDをアプリ内のワークスペースIDに変換（未登録の場合は None）"""
+    if not MULTI_WORKSPACE:
+        return DEFAULT_TEAM_ID
+    return team_id if team_id in WORKSPACES else None
+
+def get_workspace(team_id):
+    """ワークスペース設定を取得"""
+    return WORKSPACES.get(team_id or DEFAULT_TEAM_ID)
+
+class SlackClientPool:
+    """ワークスペースごとの Slack Web クライアントと auth.test 結果を保持するプール"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._auth_results = {}
+
+    def get(self, team_id=None):
+        """ワークスペースの WebClient を取得（初回呼び出し時に生成）"""
+        team_id = team_id or DEFAULT_TEAM_ID
+        client = self._clients.get(team_id)
+        if client is None:
+            from slack_sdk import WebClient
+            workspace = get_workspace(team_id)
+            if workspace is None:
+                raise KeyError(f"Unknown workspace: {team_id}")
+            with self._lock:
+                client = self._clients.get(team_id)
+                if client is None:
+                    # SLACK_API_BASE_URL でローカルの疑似Slackサーバーなどに差し替え可能
+                    client = WebClient(
+                        token=workspace.bot_token,
+                        base_url=os.environ.get('SLACK_API_BASE_URL', WebClient.BASE_URL)
+                    )
+                    self._clients[team_id] = client
+        return client
+
+    def authorize(self, enterprise_id, team_id, logger):
+        """Bolt の authorize 関数（ワークスペースごとのボットトークンを返す）"""
+        from slack_bolt.authorization import AuthorizeResult
+
+        workspace_id = resolve_team_id(team_id)
+        if workspace_id is None:
+            logger.warning(f"Event from unregistered workspace: {team_id}")
+            return None
+        result = self._auth_results.get(workspace_id)
+        if result is None:
+            client = self.get(workspace_id)
+            result = AuthorizeResult.from_auth_test_response(
+                auth_test_response=client.auth_test(),
+                bot_token=client.token
+            )
+            with self._lock:
+                self._auth_results[workspace_id] = result
+        return result